@@ -40,6 +40,9 @@ from PIL import Image
 import io
 import base64
 import os
+import time
+import uuid
+import weakref
 from typing import Optional, Tuple
 
 # 导入云端推理模块
@@ -48,12 +51,34 @@ try:
 except ImportError:
     cloud_infer = None
 
+# 跨会话共享的解码图片缓存 + 有界的会话图片状态
+from src.image_store import get_image_store, ImageTooLarge
+from src.session_images import get_session_image_store
+# 相近选区结果复用
+from src.roi_index import get_roi_index
+from src.result_cache import cached, get_result_cache
+# 持久化任务队列（设置 JOB_QUEUE_DB 时分析交给独立 worker 进程）
+from src.job_queue import get_job_queue, queue_enabled
+# 后端双通道调度（交互优先，批量让路）
+from src.scheduler import get_scheduler, in_lane, Ticket, INTERACTIVE
+# 批量分析（多图 / 多选区）
+from src.batch import get_batch, drop_batch
+# 后台推理执行器
+from src.jobs import get_executor, get_speculator, SessionBusy, Overloaded
+from src.jobs import QUEUED as JOB_QUEUED, DONE as JOB_DONE, ERROR as JOB_ERROR
+# 面板级 CPU 耗时统计
+from src.utils.profiling import panel_timer, record_panel
+from src.utils.tracing import span, start_span, use_span
+
 st.set_page_config(
     page_title="AI Fashion Fabric Analyst",
     page_icon="👔",
     layout="wide",
     initial_sidebar_state="expanded"
 )
+# 整页重跑计时；fragment 重跑不经过这里，图片面板据此判断是否处于整页重跑中
+_PAGE_T0 = (time.thread_time(), time.perf_counter())
+st.session_state["__full_run__"] = True
 
 # ==================== API Key 管理 ====================
 def get_api_key(engine: str = "qwen-vl") -> Optional[str]:
@@ -110,6 +135,14 @@ try:
 except Exception:
     CROP_CANVAS_AVAILABLE = False
 
+# 自研裁剪组件（松开时回传，拖动不触发重跑）；需要前端构建产物或 Dev Server
+WEB_CROPPER_AVAILABLE = False
+try:
+    from ui.web_cropper import st_web_cropper, cropper_stats, component_available
+    WEB_CROPPER_AVAILABLE = component_available()
+except Exception:
+    WEB_CROPPER_AVAILABLE = False
+
 # ==================== 双语配置 ====================
 I18N = {
     "zh": {
@@ -154,6 +187,30 @@ I18N = {
         "language": "语言",
         "enable_web": "启用联网增强",
         "enable_web_help": "从互联网检索补充信息（如最新材料、供应商、价格等）。注意：会增加 10-15 秒响应时间",
+        "roi_reused": "♻️ 复用了相近选区（重叠度 {iou:.0%}）的分析结果",
+        "force_refresh": "🔄 重新分析",
+        "batch_section": "📚 批量分析",
+        "batch_upload": "上传多张图片",
+        "batch_queue_files": "▶️ 分析全部 {n} 张",
+        "batch_add_roi": "➕ 选区加入批量",
+        "batch_added": "已加入批量 {n} 项",
+        "batch_full": "⚠️ 批量队列已满（最多 {n} 项）",
+        "batch_progress": "已完成 {finished}/{total} · 分析中 {running} · 排队 {queued}"
+                          " · 平均 {avg_latency_s}s",
+        "batch_cancel": "⏹ 取消未完成项",
+        "batch_clear": "🗑️ 清空批量",
+        "batch_open": "查看结果",
+        "batch_queued": "⏳ 排队中",
+        "batch_running": "🔄 分析中",
+        "batch_done": "✅ 完成",
+        "batch_error": "❌ 失败",
+        "batch_cancelled": "⏹ 已取消",
+        "queue_position": "⏳ 排队第 {pos} 位",
+        "queue_eta": "，预计等待约 {eta:.0f} 秒",
+        "overloaded": "🚦 服务繁忙，已暂缓提交（前面约 {pending} 个请求{eta}），有空位后自动开始",
+        "lane_waits": "后端排队 p95：交互 {interactive:.0f}ms · 批量 {bulk:.0f}ms（并发上限 {capacity}）",
+        "speculative": "⚡ 选区停稳后预先分析",
+        "speculative_help": "选区停止变化 {s} 秒后自动开始分析，点击分析时选区和参数未变则直接出结果。注意：拖动后放弃的预分析也会消耗 API 调用",
         "web_results": "检索条数",
         "api_status": "API 状态",
         "api_ok": "✅ API KEY 已配置",
@@ -181,6 +238,7 @@ I18N = {
         "crop_hint": "✂️ 拖动橙色框选择区域 | 拖动角点调整大小",
         "crop_failed": "⚠️ 裁剪工具加载失败，切换到数值裁剪模式",
         "manual_crop": "🎯 数值裁剪模式",
+        "crop_dblclick_hint": "拖动/缩放选框后双击确认选区",
         "start_x": "起点X",
         "start_y": "起点Y",
         "end_x": "终点X",
@@ -191,6 +249,10 @@ I18N = {
         "analyze_region": "🤖 AI 分析选中区域",
         "analyze_full": "🤖 分析整张图片",
         "analyzing": "🤖 AI 分析中...",
+        "job_queued": "⏳ 排队中...",
+        "cancel_job": "✖ 取消分析",
+        "too_many_jobs": "⚠️ 当前会话进行中的分析过多，请等待完成或取消后再试",
+        "job_failed": "❌ 分析失败",
         "error_no_infer": "❌ 云端推理模块不可用",
         "error_no_key": "DASHSCOPE_API_KEY 缺失",
         "footer_crop": "✂️ 交互式裁剪：拖动移动 • 拖角调整大小",
@@ -201,6 +263,7 @@ I18N = {
         "recommendations": "💡 推荐方案",
         "dfm_risks": "⚠️ DFM 风险",
         "next_actions": "📌 下一步行动",
+        "evidence": "🌐 联网证据",
         "material": "材质",
         "weave": "织法",
         "weight": "克重",
@@ -228,6 +291,7 @@ I18N = {
         "interlining": "衬里建议",
         "tolerance": "公差要求",
         "image_load_error": "图片加载失败",
+        "image_too_large": "❌ 图片过大（{size}），上限为 {limit} 百万像素，请缩小后重新上传",
     },
     "en": {
         "app_title": "👔 Design to Production",
@@ -271,6 +335,34 @@ I18N = {
         "language": "Language",
         "enable_web": "Enable Web Search",
         "enable_web_help": "Retrieve additional information from the internet (latest materials, suppliers, prices, etc.). Note: Increases response time by 10-15 seconds",
+        "roi_reused": "♻️ Reused the result of a nearly identical crop (IoU {iou:.0%})",
+        "force_refresh": "🔄 Run fresh analysis",
+        "batch_section": "📚 Batch analysis",
+        "batch_upload": "Upload multiple images",
+        "batch_queue_files": "▶️ Analyze all {n} images",
+        "batch_add_roi": "➕ Add crop to batch",
+        "batch_added": "Queued {n} item(s) for batch analysis",
+        "batch_full": "⚠️ Batch queue is full (max {n} items)",
+        "batch_progress": "{finished}/{total} finished · {running} running · {queued} queued"
+                          " · avg {avg_latency_s}s",
+        "batch_cancel": "⏹ Cancel remaining",
+        "batch_clear": "🗑️ Clear batch",
+        "batch_open": "Open result",
+        "batch_queued": "⏳ Queued",
+        "batch_running": "🔄 Running",
+        "batch_done": "✅ Done",
+        "batch_error": "❌ Failed",
+        "batch_cancelled": "⏹ Cancelled",
+        "queue_position": "⏳ Position {pos} in queue",
+        "queue_eta": ", about {eta:.0f}s to wait",
+        "overloaded": "🚦 Server busy, your request is deferred ({pending} ahead{eta})"
+                      " and will start automatically",
+        "lane_waits": "Backend queue p95: interactive {interactive:.0f}ms · batch {bulk:.0f}ms"
+                      " (concurrency {capacity})",
+        "speculative": "⚡ Pre-analyze when the crop settles",
+        "speculative_help": "Starts the analysis once the crop has not changed for {s} s;"
+                            " clicking Analyze with the same crop and settings returns immediately."
+                            " Note: pre-analyses abandoned by further dragging still use API calls",
         "web_results": "Search Results",
         "api_status": "API Status",
         "api_ok": "✅ API KEY Configured",
@@ -298,6 +390,7 @@ I18N = {
         "crop_hint": "✂️ Drag to select area | Drag corners to resize",
         "crop_failed": "⚠️ Crop tool failed, switching to manual mode",
         "manual_crop": "🎯 Manual Crop Mode",
+        "crop_dblclick_hint": "Drag or resize the box, then double-click to confirm",
         "start_x": "Start X",
         "start_y": "Start Y",
         "end_x": "End X",
@@ -308,6 +401,11 @@ I18N = {
         "analyze_region": "🤖 Analyze Selected Region",
         "analyze_full": "🤖 Analyze Full Image",
         "analyzing": "🤖 Analyzing...",
+        "job_queued": "⏳ Queued...",
+        "cancel_job": "✖ Cancel",
+        "too_many_jobs": "⚠️ Too many analyses in progress for this session."
+                         " Wait for one to finish or cancel it.",
+        "job_failed": "❌ Analysis failed",
         "error_no_infer": "❌ Cloud inference unavailable",
         "error_no_key": "DASHSCOPE_API_KEY missing",
         "footer_crop": "✂️ Interactive Crop: Drag to move • Drag corners to resize",
@@ -318,6 +416,7 @@ I18N = {
         "recommendations": "💡 Recommendations",
         "dfm_risks": "⚠️ DFM Risks",
         "next_actions": "📌 Next Actions",
+        "evidence": "🌐 Web Evidence",
         "material": "Material",
         "weave": "Weave",
         "weight": "Weight",
@@ -345,6 +444,8 @@ I18N = {
         "interlining": "Interlining",
         "tolerance": "Tolerance",
         "image_load_error": "Image load failed",
+        "image_too_large": "❌ Image too large ({size}). The limit is {limit} megapixels;"
+                           " please downscale it and upload again",
     }
 }
 
@@ -354,284 +455,434 @@ def t(key, lang="zh"):
     """翻译辅助函数"""
     return I18N.get(lang, I18N["zh"]).get(key, key)
 
+# ==================== 局部重跑（fragment） ====================
+# Streamlit ≥1.37 为 st.fragment，1.33-1.36 为 st.experimental_fragment，更早版本回退为整页重跑。
+# 裁剪只重跑图片面板、改设置只重跑设置面板、任务轮询只重跑结果面板。
+# APP_FRAGMENTS=0 可关闭（用于对比每次交互的服务端 CPU 耗时）
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if os.getenv("APP_FRAGMENTS", "1") == "0":
+    _fragment = None
+
+
+def _run_panel(fn, run_every=None):
+    """以 fragment 方式渲染面板（不支持时直接调用）"""
+    if _fragment is None:
+        fn()
+    else:
+        _fragment(fn, run_every=run_every)()
+
+
+def analysis_settings() -> dict:
+    """从设置面板的控件状态读取分析参数（设置面板是 fragment，不能依赖模块级变量）"""
+    ss = st.session_state
+    enable_web = bool(ss.get("enable_web", False))
+    options = ss.get("constraints_options") or []
+    return {
+        "task_type": ss.get("task_type", "auto"),
+        "budget": ss.get("budget", "mid"),
+        "scene": ss.get("scene", "casual"),
+        # 约束条件内部值为英文，转换为逗号分隔用于 API
+        "constraints": ",".join(options) if options else "none",
+        "engine": ss.get("engine", "qwen-vl"),
+        "enable_web": enable_web,
+        "k_per_query": ss.get("k_per_query", 4) if enable_web else 4,
+    }
+
+def params_key() -> str:
+    """语言 + 分析参数键（不同参数的结果互不复用）"""
+    return f"{lang}|{sorted(analysis_settings().items())}"
+
+
+def analysis_call(image: Image.Image, box: Optional[Tuple[int, int, int, int]] = None):
+    """
+    组装一次分析调用（后台提交和预分析共用）。
+
+    Args:
+        image: 要分析的图片
+        box: 选区（工作图坐标）；给定时任务完成后结果写入选区复用索引
+
+    Returns:
+        (kwargs, meta)：cloud_infer(image, **kwargs)；meta 存入任务
+    """
+    settings = analysis_settings()
+    kwargs = dict(settings, lang=lang, prefetch_labels=st.session_state.get("__evidence_labels__"))
+    meta = {"engine": settings["engine"]}
+    upload = st.session_state.get("__upload_key__")
+    if box and upload:
+        meta["roi"] = (upload[1], tuple(box), params_key())
+    return kwargs, meta
+
+
+def analysis_key(patch_key: Optional[str]) -> Optional[str]:
+    """选区 + 语言 + 分析参数的组合键（预分析与点击是否一致以此判断）"""
+    if not patch_key:
+        return None
+    return f"{patch_key}|{params_key()}"
+
+
+def _session_id() -> str:
+    """当前会话标识（用于后台任务限流和会话图片配额）"""
+    if "__session_id__" not in st.session_state:
+        st.session_state["__session_id__"] = uuid.uuid4().hex
+    return st.session_state["__session_id__"]
+
+
+def session_images():
+    """
+    当前会话的图片槽位（"image" 引用共享解码缓存，"patch" 为裁剪图）。
+
+    图片不再直接放进 session_state：句柄随会话回收时自动释放，
+    超出会话配额/全局预算的裁剪图压缩落盘。
+    """
+    lease = st.session_state.get("__image_lease__")
+    if lease is None:
+        lease = get_session_image_store().lease(_session_id())
+        st.session_state["__image_lease__"] = lease
+    return lease
+
+
+def session_batch():
+    """当前会话的批量分析队列（会话回收时取消未完成的条目）"""
+    if "__batch__" not in st.session_state:
+        weakref.finalize(session_images(), drop_batch, _session_id())
+        st.session_state["__batch__"] = True
+    return get_batch(_session_id())
+
+
+def queue_batch(name: str, data: bytes, box: Optional[Tuple[int, int, int, int]] = None) -> bool:
+    """按当前分析参数把一张图（或其中一个选区）加入批量分析"""
+    if cloud_infer is None:
+        st.error(t("error_no_infer", lang))
+        return False
+    settings = analysis_settings()
+    if not get_api_key(settings["engine"]):
+        st.error(t("error_no_key", lang))
+        return False
+    batch = session_batch()
+    item = batch.add(name, data, cached(cloud_infer), box=box, meta={"engine": settings["engine"]},
+                     **dict(settings, lang=lang))
+    if item is None:
+        st.warning(t("batch_full", lang).format(n=batch.max_items))
+        return False
+    return True
+
 # ==================== 侧边栏 ====================
 # 先初始化语言选择（顶部）
 if "lang" not in st.session_state:
     st.session_state["lang"] = "zh"
 
+def render_settings():
+    """分析参数 + 模型/密钥设置（fragment：改设置只重跑这一块，不重跑图片和结果面板）"""
+    with panel_timer("settings", log):
+        st.header(t("analysis_params", lang))
+
+        # === 区域类型选择 ===
+        st.subheader(t("roi_type", lang))
+        st.radio(
+            "",
+            ["auto", "fabric", "print", "construction"],
+            index=0,
+            format_func=lambda x: {
+                "auto": t("task_auto", lang),
+                "fabric": t("task_fabric", lang),
+                "print": t("task_print", lang),
+                "construction": t("task_construction", lang)
+            }[x],
+            help=t("roi_help", lang),
+            key="task_type",
+        )
+
+        st.divider()
+
+        # === 上下文参数 ===
+        st.subheader(t("production_context", lang))
+
+        st.select_slider(
+            t("budget", lang),
+            options=["low", "mid", "high"],
+            value="mid",
+            format_func=lambda x: {
+                "low": t("budget_low", lang),
+                "mid": t("budget_mid", lang),
+                "high": t("budget_high", lang)
+            }[x],
+            key="budget",
+        )
+
+        st.selectbox(
+            t("scene", lang),
+            ["casual", "evening", "activewear", "office", "home", "wedding", "stage"],
+            index=0,
+            format_func=lambda x: {
+                "casual": t("scene_casual", lang),
+                "evening": t("scene_evening", lang),
+                "activewear": t("scene_activewear", lang),
+                "office": t("scene_office", lang),
+                "home": t("scene_home", lang),
+                "wedding": t("scene_wedding", lang),
+                "stage": t("scene_stage", lang)
+            }[x],
+            key="scene",
+        )
+
+        # 约束条件的内部值保持英文，显示使用双语
+        constraint_map_zh = {
+            "eco": "环保", "wash": "可水洗", "durable": "耐磨",
+            "stretch": "四向弹", "wrinkle": "防皱", "quickdry": "快干",
+            "uv": "抗UV", "antibac": "抗菌"
+        }
+        constraint_map_en = {
+            "eco": "Eco-friendly", "wash": "Washable", "durable": "Durable",
+            "stretch": "4-way Stretch", "wrinkle": "Wrinkle-resistant",
+            "quickdry": "Quick-dry", "uv": "UV-resistant", "antibac": "Anti-bacterial"
+        }
+        constraint_display = constraint_map_zh if lang == "zh" else constraint_map_en
+
+        st.multiselect(
+            t("constraints", lang),
+            list(constraint_display.keys()),
+            default=[],
+            format_func=lambda x: constraint_display[x],
+            key="constraints_options",
+        )
+
+        st.divider()
+
+        # === 基础设置 ===
+        st.subheader(t("basic_settings", lang))
+
+        # 模型选择
+        model_options = {
+            "qwen-vl": t("model_qwen", lang),
+            "openai-gpt4v": t("model_openai", lang),
+            "google-gemini": t("model_google", lang)
+        }
+        engine = st.selectbox(
+            t("model", lang),
+            options=list(model_options.keys()),
+            format_func=lambda x: model_options[x],
+            index=0,
+            key="engine",
+        )
+        enable_web = st.checkbox(
+            t("enable_web", lang),
+            value=False,
+            help=t("enable_web_help", lang),
+            key="enable_web",
+        )
+        if enable_web:
+            st.slider(t("web_results", lang), 1, 10, 4, key="k_per_query")
+        st.checkbox(
+            t("speculative", lang),
+            value=False,
+            help=t("speculative_help", lang).format(s=get_speculator().idle_s),
+            key="speculative",
+        )
+
+        st.divider()
+
+        # === API 密钥配置 ===
+        st.subheader(t("api_key_input", lang))
+
+        # 根据模型选择确定 API 密钥的环境变量名称和占位符
+        api_config = {
+            "qwen-vl": {
+                "env_var": "DASHSCOPE_API_KEY",
+                "placeholder_zh": "sk-xxxxxxxxxxxxxxxxxxxxxxxx",
+                "placeholder_en": "sk-xxxxxxxxxxxxxxxxxxxxxxxx",
+                "help_zh": "在此输入您的阿里云灵积 API 密钥，或在 .streamlit/secrets.toml 中配置",
+                "help_en": "Enter your Alibaba Cloud DashScope API key here,"
+                           " or configure in .streamlit/secrets.toml",
+            },
+            "openai-gpt4v": {
+                "env_var": "OPENAI_API_KEY",
+                "placeholder_zh": "sk-proj-xxxxxxxxxxxxxxxxxx",
+                "placeholder_en": "sk-proj-xxxxxxxxxxxxxxxxxx",
+                "help_zh": "在此输入您的 OpenAI API 密钥，或在 .streamlit/secrets.toml 中配置",
+                "help_en": "Enter your OpenAI API key here,"
+                           " or configure in .streamlit/secrets.toml",
+            },
+            "google-gemini": {
+                "env_var": "GOOGLE_API_KEY",
+                "placeholder_zh": "AIzaSyxxxxxxxxxxxxxxxxxxxxxxxxx",
+                "placeholder_en": "AIzaSyxxxxxxxxxxxxxxxxxxxxxxxxx",
+                "help_zh": "在此输入您的 Google AI Studio API 密钥，"
+                           "或在 .streamlit/secrets.toml 中配置",
+                "help_en": "Enter your Google AI Studio API key here,"
+                           " or configure in .streamlit/secrets.toml",
+            }
+        }
+
+        current_config = api_config.get(engine, api_config["qwen-vl"])
+        placeholder = (current_config["placeholder_zh"] if lang == "zh"
+                       else current_config["placeholder_en"])
+        help_text = current_config["help_zh"] if lang == "zh" else current_config["help_en"]
+
+        # 用户输入API密钥
+        user_api_key = st.text_input(
+            label="",
+            value="",
+            type="password",
+            placeholder=placeholder,
+            help=help_text,
+            key=f"user_api_key_input_{engine}"
+        )
+
+        # 保存到 session_state
+        if user_api_key:
+            st.session_state[f"user_api_key_{engine}"] = user_api_key
+
+        # 获取最终使用的API密钥（优先级：用户输入 > secrets.toml > 环境变量）
+        final_api_key = None
+        env_var = current_config["env_var"]
+        if st.session_state.get(f"user_api_key_{engine}"):
+            final_api_key = st.session_state[f"user_api_key_{engine}"]
+        else:
+            try:
+                final_api_key = st.secrets.get(env_var) or os.getenv(env_var)
+            except Exception:
+                final_api_key = os.getenv(env_var)
+
+        # 显示API密钥状态
+        if final_api_key:
+            status_text = t("api_ok", lang)
+            st.success(status_text)
+        else:
+            status_text = t("api_missing", lang)
+            st.error(status_text)
+
+        # 根据模型显示不同的教程链接
+        dashscope_doc = t("api_link", lang)
+        openai_doc = "https://platform.openai.com/docs/api-reference/authentication"
+        with st.expander(t("api_get_key", lang), expanded=False):
+            if engine == "qwen-vl":
+                if lang == "zh":
+                    st.markdown(f"""
+                    **获取阿里云灵积 API 密钥**
+
+                    1. 访问 [阿里云灵积平台](https://dashscope.aliyun.com/)
+                    2. 注册/登录阿里云账号
+                    3. 在控制台中创建 API Key
+                    4. 复制密钥并粘贴到上方输入框
+
+                    🔗 **官方文档**: [如何获取 API Key]({dashscope_doc})
+                    """)
+                else:
+                    st.markdown(f"""
+                    **Get Alibaba Cloud DashScope API Key**
+
+                    1. Visit [Alibaba Cloud DashScope](https://dashscope.aliyun.com/)
+                    2. Register/Login to your Alibaba Cloud account
+                    3. Create an API Key in the console
+                    4. Copy and paste the key above
+
+                    🔗 **Official Docs**: [How to Get API Key]({dashscope_doc})
+                    """)
+
+            elif engine == "openai-gpt4v":
+                if lang == "zh":
+                    st.markdown(f"""
+                    **获取 OpenAI API 密钥**
+
+                    1. 访问 [OpenAI Platform](https://platform.openai.com/)
+                    2. 注册/登录 OpenAI 账号
+                    3. 进入 [API Keys 页面](https://platform.openai.com/api-keys)
+                    4. 点击 "Create new secret key" 创建新密钥
+                    5. 复制密钥并粘贴到上方输入框
+
+                    ⚠️ **注意**: 需要 GPT-4 Vision 权限
+
+                    🔗 **官方文档**: [OpenAI API Keys]({openai_doc})
+
+                    💰 **定价**: [OpenAI Pricing](https://openai.com/api/pricing/)
+                    """)
+                else:
+                    st.markdown(f"""
+                    **Get OpenAI API Key**
+
+                    1. Visit [OpenAI Platform](https://platform.openai.com/)
+                    2. Register/Login to your OpenAI account
+                    3. Go to [API Keys page](https://platform.openai.com/api-keys)
+                    4. Click "Create new secret key" to create a new key
+                    5. Copy and paste the key above
+
+                    ⚠️ **Note**: GPT-4 Vision access required
+
+                    🔗 **Official Docs**: [OpenAI API Keys]({openai_doc})
+
+                    💰 **Pricing**: [OpenAI Pricing](https://openai.com/api/pricing/)
+                    """)
+
+            elif engine == "google-gemini":
+                if lang == "zh":
+                    st.markdown("""
+                    **获取 Google AI Studio API 密钥**
+
+                    1. 访问 [Google AI Studio](https://aistudio.google.com/)
+                    2. 使用 Google 账号登录
+                    3. 点击 "Get API Key" 获取密钥
+                    4. 复制密钥并粘贴到上方输入框
+
+                    ⚠️ **注意**: 需要 Gemini Pro Vision 权限
+
+                    🔗 **官方文档**: [Google AI Studio](https://ai.google.dev/tutorials/setup)
+
+                    💰 **定价**: [Gemini Pricing](https://ai.google.dev/pricing)
+                    """)
+                else:
+                    st.markdown("""
+                    **Get Google AI Studio API Key**
+
+                    1. Visit [Google AI Studio](https://aistudio.google.com/)
+                    2. Login with your Google account
+                    3. Click "Get API Key" to obtain your key
+                    4. Copy and paste the key above
+
+                    ⚠️ **Note**: Gemini Pro Vision access required
+
+                    🔗 **Official Docs**: [Google AI Studio](https://ai.google.dev/tutorials/setup)
+
+                    💰 **Pricing**: [Gemini Pricing](https://ai.google.dev/pricing)
+                    """)
+
+
+
+
 with st.sidebar:
     # 语言选择放在最顶部
     lang = st.radio("🌐 Language / 语言", ["zh", "en"], index=0, horizontal=True, key="lang_selector")
     st.session_state["lang"] = lang
     
     st.divider()
-    
+
     st.title(t("app_title", lang))
     st.caption(t("app_subtitle", lang))
-    
+
     uploaded_file = st.file_uploader(
         t("upload_label", lang),
         type=["jpg", "jpeg", "png"],
         help=t("upload_help", lang)
     )
+
+    with st.expander(t("batch_section", lang), expanded=False):
+        batch_files = st.file_uploader(
+            t("batch_upload", lang),
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+            key="batch_files",
+        ) or []
+        if st.button(t("batch_queue_files", lang).format(n=len(batch_files)),
+                     disabled=not batch_files, use_container_width=True, key="batch_queue_files"):
+            queued = 0
+            for f in batch_files:
+                if not queue_batch(f.name, f.getvalue()):
+                    break
+                queued += 1
+            if queued:
+                st.success(t("batch_added", lang).format(n=queued))
     
     st.divider()
-    st.header(t("analysis_params", lang))
-    
-    # === 区域类型选择 ===
-    st.subheader(t("roi_type", lang))
-    task_type = st.radio(
-        "",
-        ["auto", "fabric", "print", "construction"],
-        index=0,
-        format_func=lambda x: {
-            "auto": t("task_auto", lang),
-            "fabric": t("task_fabric", lang),
-            "print": t("task_print", lang),
-            "construction": t("task_construction", lang)
-        }[x],
-        help=t("roi_help", lang)
-    )
-    
-    st.divider()
-    
-    # === 上下文参数 ===
-    st.subheader(t("production_context", lang))
-    
-    budget = st.select_slider(
-        t("budget", lang),
-        options=["low", "mid", "high"],
-        value="mid",
-        format_func=lambda x: {
-            "low": t("budget_low", lang),
-            "mid": t("budget_mid", lang),
-            "high": t("budget_high", lang)
-        }[x]
-    )
-    
-    scene = st.selectbox(
-        t("scene", lang),
-        ["casual", "evening", "activewear", "office", "home", "wedding", "stage"],
-        index=0,
-        format_func=lambda x: {
-            "casual": t("scene_casual", lang),
-            "evening": t("scene_evening", lang),
-            "activewear": t("scene_activewear", lang),
-            "office": t("scene_office", lang),
-            "home": t("scene_home", lang),
-            "wedding": t("scene_wedding", lang),
-            "stage": t("scene_stage", lang)
-        }[x]
-    )
-    
-    # 约束条件的内部值保持英文，显示使用双语
-    constraint_map_zh = {
-        "eco": "环保", "wash": "可水洗", "durable": "耐磨", 
-        "stretch": "四向弹", "wrinkle": "防皱", "quickdry": "快干", 
-        "uv": "抗UV", "antibac": "抗菌"
-    }
-    constraint_map_en = {
-        "eco": "Eco-friendly", "wash": "Washable", "durable": "Durable", 
-        "stretch": "4-way Stretch", "wrinkle": "Wrinkle-resistant", 
-        "quickdry": "Quick-dry", "uv": "UV-resistant", "antibac": "Anti-bacterial"
-    }
-    constraint_display = constraint_map_zh if lang == "zh" else constraint_map_en
-    
-    constraints_options = st.multiselect(
-        t("constraints", lang),
-        list(constraint_display.keys()),
-        default=[],
-        format_func=lambda x: constraint_display[x]
-    )
-    # 转换为英文值用于API
-    constraints = ",".join(constraints_options) if constraints_options else "none"
-    
-    st.divider()
-    
-    # === 基础设置 ===
-    st.subheader(t("basic_settings", lang))
-    
-    # 模型选择
-    model_options = {
-        "qwen-vl": t("model_qwen", lang),
-        "openai-gpt4v": t("model_openai", lang),
-        "google-gemini": t("model_google", lang)
-    }
-    engine = st.selectbox(
-        t("model", lang), 
-        options=list(model_options.keys()),
-        format_func=lambda x: model_options[x],
-        index=0
-    )
-    enable_web = st.checkbox(
-        t("enable_web", lang), 
-        value=False,
-        help=t("enable_web_help", lang)
-    )
-    if enable_web:
-        k_per_query = st.slider(t("web_results", lang), 1, 10, 4)
-    else:
-        k_per_query = 4
-    
-    st.divider()
-    
-    # === API 密钥配置 ===
-    st.subheader(t("api_key_input", lang))
-    
-    # 根据模型选择确定 API 密钥的环境变量名称和占位符
-    api_config = {
-        "qwen-vl": {
-            "env_var": "DASHSCOPE_API_KEY",
-            "placeholder_zh": "sk-xxxxxxxxxxxxxxxxxxxxxxxx",
-            "placeholder_en": "sk-xxxxxxxxxxxxxxxxxxxxxxxx",
-            "help_zh": "在此输入您的阿里云灵积 API 密钥，或在 .streamlit/secrets.toml 中配置",
-            "help_en": "Enter your Alibaba Cloud DashScope API key here, or configure in .streamlit/secrets.toml",
-        },
-        "openai-gpt4v": {
-            "env_var": "OPENAI_API_KEY",
-            "placeholder_zh": "sk-proj-xxxxxxxxxxxxxxxxxx",
-            "placeholder_en": "sk-proj-xxxxxxxxxxxxxxxxxx",
-            "help_zh": "在此输入您的 OpenAI API 密钥，或在 .streamlit/secrets.toml 中配置",
-            "help_en": "Enter your OpenAI API key here, or configure in .streamlit/secrets.toml",
-        },
-        "google-gemini": {
-            "env_var": "GOOGLE_API_KEY",
-            "placeholder_zh": "AIzaSyxxxxxxxxxxxxxxxxxxxxxxxxx",
-            "placeholder_en": "AIzaSyxxxxxxxxxxxxxxxxxxxxxxxxx",
-            "help_zh": "在此输入您的 Google AI Studio API 密钥，或在 .streamlit/secrets.toml 中配置",
-            "help_en": "Enter your Google AI Studio API key here, or configure in .streamlit/secrets.toml",
-        }
-    }
-    
-    current_config = api_config.get(engine, api_config["qwen-vl"])
-    placeholder = current_config["placeholder_zh"] if lang == "zh" else current_config["placeholder_en"]
-    help_text = current_config["help_zh"] if lang == "zh" else current_config["help_en"]
-    
-    # 用户输入API密钥
-    user_api_key = st.text_input(
-        label="",
-        value="",
-        type="password",
-        placeholder=placeholder,
-        help=help_text,
-        key=f"user_api_key_input_{engine}"
-    )
-    
-    # 保存到 session_state
-    if user_api_key:
-        st.session_state[f"user_api_key_{engine}"] = user_api_key
-    
-    # 获取最终使用的API密钥（优先级：用户输入 > secrets.toml > 环境变量）
-    final_api_key = None
-    if f"user_api_key_{engine}" in st.session_state and st.session_state[f"user_api_key_{engine}"]:
-        final_api_key = st.session_state[f"user_api_key_{engine}"]
-    else:
-        try:
-            final_api_key = st.secrets.get(current_config["env_var"]) or os.getenv(current_config["env_var"])
-        except Exception:
-            final_api_key = os.getenv(current_config["env_var"])
-    
-    # 显示API密钥状态
-    if final_api_key:
-        status_text = t("api_ok", lang)
-        st.success(status_text)
-    else:
-        status_text = t("api_missing", lang)
-        st.error(status_text)
-    
-    # 根据模型显示不同的教程链接
-    with st.expander(t("api_get_key", lang), expanded=False):
-        if engine == "qwen-vl":
-            if lang == "zh":
-                st.markdown("""
-                **获取阿里云灵积 API 密钥**
-                
-                1. 访问 [阿里云灵积平台](https://dashscope.aliyun.com/)
-                2. 注册/登录阿里云账号
-                3. 在控制台中创建 API Key
-                4. 复制密钥并粘贴到上方输入框
-                
-                🔗 **官方文档**: [如何获取 API Key](https://help.aliyun.com/zh/dashscope/developer-reference/activate-dashscope-and-create-an-api-key)
-                """)
-            else:
-                st.markdown("""
-                **Get Alibaba Cloud DashScope API Key**
-                
-                1. Visit [Alibaba Cloud DashScope](https://dashscope.aliyun.com/)
-                2. Register/Login to your Alibaba Cloud account
-                3. Create an API Key in the console
-                4. Copy and paste the key above
-                
-                🔗 **Official Docs**: [How to Get API Key](https://help.aliyun.com/zh/dashscope/developer-reference/activate-dashscope-and-create-an-api-key)
-                """)
-        
-        elif engine == "openai-gpt4v":
-            if lang == "zh":
-                st.markdown("""
-                **获取 OpenAI API 密钥**
-                
-                1. 访问 [OpenAI Platform](https://platform.openai.com/)
-                2. 注册/登录 OpenAI 账号
-                3. 进入 [API Keys 页面](https://platform.openai.com/api-keys)
-                4. 点击 "Create new secret key" 创建新密钥
-                5. 复制密钥并粘贴到上方输入框
-                
-                ⚠️ **注意**: 需要 GPT-4 Vision 权限
-                
-                🔗 **官方文档**: [OpenAI API Keys](https://platform.openai.com/docs/api-reference/authentication)
-                
-                💰 **定价**: [OpenAI Pricing](https://openai.com/api/pricing/)
-                """)
-            else:
-                st.markdown("""
-                **Get OpenAI API Key**
-                
-                1. Visit [OpenAI Platform](https://platform.openai.com/)
-                2. Register/Login to your OpenAI account
-                3. Go to [API Keys page](https://platform.openai.com/api-keys)
-                4. Click "Create new secret key" to create a new key
-                5. Copy and paste the key above
-                
-                ⚠️ **Note**: GPT-4 Vision access required
-                
-                🔗 **Official Docs**: [OpenAI API Keys](https://platform.openai.com/docs/api-reference/authentication)
-                
-                💰 **Pricing**: [OpenAI Pricing](https://openai.com/api/pricing/)
-                """)
-        
-        elif engine == "google-gemini":
-            if lang == "zh":
-                st.markdown("""
-                **获取 Google AI Studio API 密钥**
-                
-                1. 访问 [Google AI Studio](https://aistudio.google.com/)
-                2. 使用 Google 账号登录
-                3. 点击 "Get API Key" 获取密钥
-                4. 复制密钥并粘贴到上方输入框
-                
-                ⚠️ **注意**: 需要 Gemini Pro Vision 权限
-                
-                🔗 **官方文档**: [Google AI Studio](https://ai.google.dev/tutorials/setup)
-                
-                💰 **定价**: [Gemini Pricing](https://ai.google.dev/pricing)
-                """)
-            else:
-                st.markdown("""
-                **Get Google AI Studio API Key**
-                
-                1. Visit [Google AI Studio](https://aistudio.google.com/)
-                2. Login with your Google account
-                3. Click "Get API Key" to obtain your key
-                4. Copy and paste the key above
-                
-                ⚠️ **Note**: Gemini Pro Vision access required
-                
-                🔗 **Official Docs**: [Google AI Studio](https://ai.google.dev/tutorials/setup)
-                
-                💰 **Pricing**: [Gemini Pricing](https://ai.google.dev/pricing)
-                """)
-    
-    
+    _run_panel(render_settings)
     st.divider()
     with st.expander(t("about", lang), expanded=False):
         st.markdown(t("about_content", lang))
@@ -767,6 +1018,21 @@ def render_result_block(result: dict, engine_name: str, lang: str = "zh"):
             with st.expander(t("next_actions", lang), expanded=False):
                 for i, action in enumerate(next_actions, 1):
                     st.markdown(f"**{i}.** {action}")
+
+        # === 卡片5: 联网证据 ===
+        evidence = result.get("evidence") or {}
+        if evidence.get("items"):
+            with st.expander(t("evidence", lang), expanded=False):
+                for item in evidence["items"]:
+                    title = item.get("title", "")
+                    url = item.get("url", "")
+                    if url.startswith("http"):
+                        title = f"[{title}]({url})"
+                    st.markdown(f"- **{title}**: {item.get('snippet', '')}")
+                ev_stats = meta.get("evidence") or {}
+                if ev_stats:
+                    st.caption(f"tokens: {ev_stats.get('raw_tokens', 0)}"
+                               f" → {ev_stats.get('packed_tokens', 0)}")
     
     # === 兼容旧格式 ===
     elif analysis_type == "fabric":
@@ -888,50 +1154,99 @@ def render_result_block(result: dict, engine_name: str, lang: str = "zh"):
 # ==================== 布局：左预览 / 右推荐 ====================
 colL, colR = st.columns([7, 5], gap="large")
 
-with colL:
+def render_image_panel():
+    """上传图预览 + 裁剪（fragment：拖动裁剪框只重跑这一块）"""
+    with panel_timer("image", log):
+        _render_image_panel()
+
+
+def _render_image_panel():
     st.subheader(t("image_section", lang))
     img = None
     uploaded = uploaded_file
     if uploaded:
         try:
-            img = Image.open(uploaded).convert("RGB")
+            # 共享解码缓存：同一上传内容只解码一次（跨重跑、跨会话）
+            store = get_image_store()
+            file_id = getattr(uploaded, "file_id", None) or uploaded.name
+            upload_key = st.session_state.get("__upload_key__")
+            entry = store.get(upload_key[1]) if upload_key and upload_key[0] == file_id else None
+            if entry is None:
+                entry = store.get_or_decode(uploaded.getvalue())
+                if not upload_key or upload_key[0] != file_id:
+                    st.session_state.pop("__result__", None)  # 换图后清除旧结果
+                st.session_state["__upload_key__"] = (file_id, entry.key)
+            img = entry.image  # 工作图（长边 ≤ IMAGE_WORKING_MAX_SIDE），选区按原图分辨率解码
+        except ImageTooLarge as _e:
+            if _e.size:
+                size = f"{_e.size[0]}×{_e.size[1]}, {_e.size[0] * _e.size[1] / 1e6:.0f} MP"
+            else:
+                size = "?"
+            st.error(t("image_too_large", lang).format(size=size, limit=f"{_e.limit / 1e6:.0f}"))
+            img = None
         except Exception as _e:
             st.error(f"{t('image_load_error', lang)}：{_e}")
             img = None
 
         patch = None
+        box = None  # 选区 (x, y, w, h)，工作图坐标
+        patch_key = None  # 裁剪图内容键：<原图哈希>:<x,y,w,h>
+        web_cropper_shown = False
+
+        # 裁剪工具优先级：web_cropper（松开时回传）→ streamlit-cropper（双击确认时回传）→ 数值裁剪
+        if img and WEB_CROPPER_AVAILABLE:
+            try:
+                box = st_web_cropper(img, key="web_cropper",
+                                     image_key=st.session_state["__upload_key__"][1])
+                web_cropper_shown = True  # 首次回传前 box 为空，不显示数值裁剪
+                if box:
+                    x, y, w, h = box
+                    patch = entry.roi(box)
+                    patch_key = f"{entry.key}:{x},{y},{w},{h}"
+                stats = cropper_stats("web_cropper")
+                if stats["reruns"]:
+                    log.debug(f"web_cropper reruns={stats['reruns']} gestures={stats['gestures']} "
+                              f"per_gesture={stats['reruns_per_gesture']}")
+            except Exception as e:
+                st.warning(t("crop_failed", lang))
+                log.error(f"st_web_cropper error: {e}")
+                patch = None
 
-        # 裁剪工具：streamlit-cropper（直接在原图上操作）
-        if img and CROP_CANVAS_AVAILABLE:
+        if img and patch is None and CROP_CANVAS_AVAILABLE and not web_cropper_shown:
             try:
                 from streamlit_cropper import st_cropper
-                
-                # 使用 st_cropper 进行可视化裁剪（自带图片显示）
-                cropped_img = st_cropper(
-                    img, 
-                    realtime_update=True,  # 实时更新
+
+                # 使用 st_cropper 进行可视化裁剪（自带图片显示）；拖动只在前端预览，
+                # 双击确认时才回传坐标触发重跑（realtime_update=True 时每次拖动结束都重跑）
+                st.caption(t("crop_dblclick_hint", lang))
+                rect = st_cropper(
+                    img,
+                    realtime_update=False,
                     box_color='#FF6B00',   # 橙色边框
                     aspect_ratio=None,      # 自由比例
+                    return_type="box",     # 只取选区坐标，按原图分辨率解码
                     key="image_cropper"
                 )
-                
-                # st_cropper 直接返回裁剪后的图片
-                if cropped_img and cropped_img.size[0] > 0 and cropped_img.size[1] > 0:
-                    patch = cropped_img
-                        
+
+                if rect and rect["width"] > 0 and rect["height"] > 0:
+                    box = (rect["left"], rect["top"], rect["width"], rect["height"])
+                    patch = entry.roi(box)
+                    patch_key = f"{entry.key}:{','.join(map(str, box))}"
+
             except Exception as e:
                 st.warning(t("crop_failed", lang))
                 log.error(f"st_cropper error: {e}")
                 patch = None
 
         # 兜底：数值裁剪
-        if img and patch is None:
+        if img and patch is None and not web_cropper_shown:
             st.caption(t("manual_crop", lang))
-            st.image(img, caption=f"{img.size[0]}×{img.size[1]}px", use_container_width=True)
-            
+            ow, oh = entry.original_size
+            st.image(img, caption=f"{ow}×{oh}px", use_container_width=True)
+
             W, H = img.size
             default_size = min(W, H, 300)  # 默认选区大小
-            
+
             col1, col2 = st.columns(2)
             with col1:
                 x1 = st.number_input(t("start_x", lang), 0, W, 0, 10)
@@ -939,75 +1254,336 @@ with colL:
             with col2:
                 x2 = st.number_input(t("end_x", lang), 0, W, min(W, default_size), 10)
                 y2 = st.number_input(t("end_y", lang), 0, H, min(H, default_size), 10)
-            
+
             if x2 > x1 and y2 > y1:
-                patch = img.crop((x1, y1, x2, y2))
+                box = (x1, y1, x2 - x1, y2 - y1)
+                patch = entry.roi(box)
+                patch_key = f"{entry.key}:{x1},{y1},{x2 - x1},{y2 - y1}"
 
-        # 保存到 session_state
-        st.session_state["__patch__"] = patch
-        st.session_state["__img__"] = img
+        if patch is not None:
+            st.caption(f"{t('selected_area', lang)}：{patch.size[0]}×{patch.size[1]}px")
+            if box and st.button(t("batch_add_roi", lang), key="batch_add_roi"):
+                x, y, w, h = box
+                if queue_batch(f"{uploaded.name} [{x},{y},{w},{h}]", uploaded.getvalue(), box):
+                    st.rerun()  # 整页重跑以开始轮询批量进度
+
+        # 保存到会话图片槽位（原图只存引用）
+        images = session_images()
+        images.ref("image", entry.key if img else None)
+        images.put("patch", patch, key=patch_key)
+        st.session_state["__patch_key__"] = patch_key if patch is not None else None
+        st.session_state["__patch_box__"] = tuple(box) if patch is not None and box else None
+
+        # 预分析：选区停稳 idle_s 秒后提交（选区再变化会重新计时并丢弃旧的预分析）
+        speculator = get_speculator()
+        key = analysis_key(st.session_state["__patch_key__"])
+        if st.session_state.get("speculative") and key and cloud_infer is not None:
+            kwargs, meta = analysis_call(patch, st.session_state["__patch_box__"])
+            if get_api_key(meta["engine"]):
+                speculator.schedule(_session_id(), key, cached(in_lane(INTERACTIVE, cloud_infer)),
+                                    patch, meta=meta, **kwargs)
+        else:
+            speculator.discard(_session_id())
+        # 仅重跑本面板时，分析按钮的可用状态不会刷新：选区从无到有（或反之）时整页重跑一次
+        has_patch_changed = (patch is not None) != st.session_state.get("__has_patch__")
+        if not st.session_state.get("__full_run__") and has_patch_changed:
+            st.rerun()
     else:
         st.info(t("upload_first", lang))
-        st.session_state["__patch__"] = None
-        st.session_state["__img__"] = None
+        session_images().clear()
+
+
+with colL:
+    _run_panel(render_image_panel)
+
+# ==================== 后台分析 ====================
+POLL_INTERVAL = 0.5  # 轮询任务状态的间隔（秒）
+QUEUE_JOB_PREFIX = "q:"  # 持久化队列任务的 id 前缀（区分进程内任务）
+
+
+def begin_trace(**attributes):
+    """
+    开始一次分析的 trace：根 span "analysis" 从点击开始，跨多次重跑，结果渲染完才结束。
+    后台任务中的缓存查找、排队、模型调用等 span 都挂在它下面；未结束的上一次记为被替换。
+    """
+    end_trace(replaced=True)
+    root = start_span("analysis", root=True, lang=lang, **attributes)
+    st.session_state["__trace__"] = root
+    return root
+
+
+def end_trace(error: Optional[str] = None, **attributes) -> None:
+    """结束当前分析的 trace（error 不为空时记为失败）"""
+    root = st.session_state.pop("__trace__", None)
+    if root is not None:
+        root.set(**attributes)
+        if error:
+            root.fail(error)
+        root.end()
+
+
+def submit_analysis(image: Image.Image, box: Optional[Tuple[int, int, int, int]] = None):
+    """校验依赖和密钥后，把分析提交到后台执行器"""
+    if cloud_infer is None:
+        st.error(t("error_no_infer", lang))
+        return
+    st.session_state.pop("__reused__", None)
+    deferred = st.session_state.pop("__deferred__", None)
+    st.session_state.pop("__ticket__", None)
+    kwargs, meta = analysis_call(image, box)
+    if not get_api_key(meta["engine"]):
+        st.error(t("error_no_key", lang))
+        return
+    # 暂缓后的重新提交沿用原来的 trace（排队时间从第一次点击算起）
+    root = st.session_state.get("__trace__") if deferred else None
+    if root is None:
+        root = begin_trace(engine=meta["engine"], task_type=kwargs.get("task_type"), roi=bool(box),
+                           size=list(image.size))
+    if queue_enabled():
+        # 持久化队列：替换语义由页面负责（取消本会话上一个任务）
+        cancel_job(st.session_state.pop("__job_id__", None))
+        job_id = get_job_queue().enqueue(image, kwargs, session_id=_session_id(),
+                                         meta=dict(meta, trace=root.context()))
+        st.session_state["__job_id__"] = QUEUE_JOB_PREFIX + job_id
+        return
+    ticket = Ticket(INTERACTIVE)  # 排队凭证：结果面板据此显示排队位置和预计等待
+    try:
+        # 先查共享结果缓存（命中不占后端空位），未命中再排队调用
+        infer = cached(in_lane(INTERACTIVE, cloud_infer, ticket=ticket))
+        with use_span(root):  # 后台线程中的 span 接在本次分析的 trace 下
+            job = get_executor().submit(_session_id(), infer, image, meta=meta, **kwargs)
+        st.session_state["__job_id__"] = job.id
+        st.session_state["__ticket__"] = ticket
+    except Overloaded:
+        # 准入控制拒绝：暂缓提交，结果面板轮询到有空位时自动重新提交。
+        # 本会话正在进行的上一次分析不取消（新任务被接纳时执行器才替换它）；
+        # 轮询重试每 0.5 秒一次，只在暂缓开始时记录
+        st.session_state["__deferred__"] = {"slot": "patch" if box else "image", "box": box}
+        if not deferred:
+            root.set(deferrals=root.attributes.get("deferrals", 0) + 1)
+            log.info(f"analysis deferred: executor {get_executor().snapshot()}")
+    except SessionBusy:
+        end_trace(error="session busy")
+        st.warning(t("too_many_jobs", lang))
+
+
+def get_job(job_id: Optional[str]):
+    """按 id 取任务：进程内 InferenceJob 或持久化队列的 QueuedJob（字段一致）"""
+    if job_id and job_id.startswith(QUEUE_JOB_PREFIX):
+        return get_job_queue().get(job_id[len(QUEUE_JOB_PREFIX):])
+    return get_executor().get(job_id)
+
+
+def cancel_job(job_id: Optional[str]) -> None:
+    if job_id and job_id.startswith(QUEUE_JOB_PREFIX):
+        get_job_queue().cancel(job_id[len(QUEUE_JOB_PREFIX):])
+    elif job_id:
+        get_executor().cancel(job_id)
+
+
+def render_analysis_panel():
+    """任务状态 + 最近一次结果；任务结束时触发整页重跑以停止轮询"""
+    with panel_timer("result", log):
+        _render_analysis_panel()
+
+
+def queue_status(job) -> str:
+    """任务状态文字：在后端排队时显示排队位置和预计等待"""
+    ticket = st.session_state.get("__ticket__")
+    pos = get_scheduler().position(ticket) if ticket is not None else None
+    if pos is not None:
+        eta = get_scheduler().eta(INTERACTIVE, pos)
+        wait = t("queue_eta", lang).format(eta=eta) if eta and eta >= 1 else ""
+        return t("queue_position", lang).format(pos=pos + 1) + wait + f" · {job.elapsed:.1f}s"
+    status = t("job_queued", lang) if job.status == JOB_QUEUED else t("analyzing", lang)
+    return f"{status} {job.elapsed:.1f}s"
+
+
+def _render_analysis_panel():
+    deferred = st.session_state.get("__deferred__")
+    if deferred:
+        # 暂缓的提交：每次轮询重试一次，被接纳后整页重跑以改为轮询任务
+        image = session_images().get(deferred["slot"])
+        if image is not None:
+            submit_analysis(image, deferred["box"])
+        if st.session_state.get("__deferred__") is None or image is None:
+            st.session_state.pop("__deferred__", None)
+            st.rerun()
+        pending = get_scheduler().pending(INTERACTIVE)
+        eta = get_scheduler().eta(INTERACTIVE, pending)
+        wait = t("queue_eta", lang).format(eta=eta) if eta and eta >= 1 else ""
+        st.warning(t("overloaded", lang).format(pending=pending, eta=wait))
+        if st.button(t("cancel_job", lang), use_container_width=True, key="cancel_deferred"):
+            st.session_state.pop("__deferred__", None)
+            end_trace(cancelled=True)
+            st.rerun()
+
+    job = get_job(st.session_state.get("__job_id__"))
+    if job is not None and job.active:
+        st.info(queue_status(job))
+        if st.button(t("cancel_job", lang), use_container_width=True, key="cancel_job"):
+            cancel_job(st.session_state.pop("__job_id__", None))
+            end_trace(cancelled=True)
+            st.rerun()
+    elif job is not None:
+        st.session_state.pop("__job_id__", None)
+        if job.status == JOB_DONE:
+            engine = job.meta.get("engine", analysis_settings()["engine"])
+            st.session_state["__result__"] = (job.result, engine)
+            st.session_state.pop("__reused__", None)
+            if isinstance(job.result, dict):
+                evidence = job.result.get("evidence") or {}
+                st.session_state["__evidence_labels__"] = evidence.get("labels", [])
+                if job.meta.get("roi") and job.result.get("engine") != "error":
+                    get_roi_index().store(*job.meta["roi"], job.result)
+        elif job.status == JOB_ERROR:
+            st.session_state["__job_error__"] = job.error
+            end_trace(error=job.error)
+        else:
+            end_trace(cancelled=True)
+        log.debug(f"backend lanes: {get_scheduler().snapshot()};"
+                  f" result cache: {get_result_cache().snapshot()}")
+        st.rerun()
+
+    error = st.session_state.pop("__job_error__", None)
+    if error:
+        st.error(f"{t('job_failed', lang)}: {error}")
+    reused = st.session_state.get("__reused__")
+    if reused:
+        st.caption(t("roi_reused", lang).format(iou=reused["iou"]))
+        if st.button(t("force_refresh", lang), key="force_refresh"):
+            patch = session_images().get("patch")
+            if patch is not None:
+                submit_analysis(patch, st.session_state.get("__patch_box__"))
+                st.rerun()  # 整页重跑以开始轮询新任务
+    last = st.session_state.get("__result__")
+    root = st.session_state.get("__trace__")
+    if last and root is not None and not (st.session_state.get("__job_id__")
+                                          or st.session_state.get("__deferred__")):
+        # 本次分析的结果第一次渲染：记入 trace 后结束
+        with use_span(root), span("render"):
+            render_result_block(last[0], last[1], lang)
+        end_trace()
+    elif last:
+        render_result_block(last[0], last[1], lang)
+
 
 with colR:
     st.subheader(t("result_section", lang))
-    patch = st.session_state.get("__patch__")
-    img = st.session_state.get("__img__")
-    
-    # 显示选区信息
-    if patch:
-        w, h = patch.size
-        st.caption(f"{t('selected_area', lang)}：{w}×{h}px")
+    images = session_images()
+    patch = images.get("patch")
+    img = images.get("image")
+    st.session_state["__has_patch__"] = patch is not None
+    log.debug(f"session images: {images.usage()}")
 
-    # 分析按钮
+    # 分析按钮（提交到后台，不阻塞页面；再次点击会替换进行中的分析）
     rec_btn = st.button(t("analyze_region", lang), use_container_width=True, disabled=not bool(patch), type="primary")
     if rec_btn:
-        if cloud_infer is None:
-            st.error(t("error_no_infer", lang))
+        # 相近选区（IoU ≥ ROI_REUSE_IOU、参数相同）已有结果时直接复用
+        upload = st.session_state.get("__upload_key__")
+        patch_box = st.session_state.get("__patch_box__")
+        match = None
+        if upload and patch_box:
+            match = get_roi_index().lookup(upload[1], patch_box, params_key())
+        spec_job = None
+        if match is not None:
+            st.session_state["__result__"] = (match.result, analysis_settings()["engine"])
+            st.session_state["__reused__"] = {"iou": match.iou, "box": match.box}
+            cancel_job(st.session_state.pop("__job_id__", None))
+            begin_trace(engine=analysis_settings()["engine"], roi=True, reused="roi",
+                        iou=round(match.iou, 3))
+            log.info(f"roi reuse hit iou={match.iou:.2f}: {get_roi_index().snapshot()}")
+        elif st.session_state.get("speculative"):
+            spec_job = get_speculator().claim(_session_id(),
+                                              analysis_key(st.session_state.get("__patch_key__")))
+            log.info(f"speculation {'hit' if spec_job else 'miss'}: {get_speculator().snapshot()}")
+        if match is not None:
+            pass  # 已复用，不再提交
+        elif spec_job is not None:
+            st.session_state.pop("__reused__", None)
+            st.session_state.pop("__ticket__", None)
+            st.session_state["__job_id__"] = spec_job.id
+            begin_trace(engine=analysis_settings()["engine"], roi=True, reused="speculation")
         else:
-            api_key_now = get_api_key(engine)
-            if not api_key_now:
-                st.error(t("error_no_key", lang))
-            else:
-                with st.spinner(t("analyzing", lang)):
-                    result = cloud_infer(
-                        patch, 
-                        engine=engine, 
-                        lang=lang, 
-                        enable_web=enable_web, 
-                        k_per_query=k_per_query,
-                        task_type=task_type,
-                        budget=budget,
-                        scene=scene,
-                        constraints=constraints
-                    )
-                render_result_block(result, engine, lang)
+            submit_analysis(patch, patch_box)
 
     # 兜底：整图识别
     if (not patch) and img:
         if st.button(t("analyze_full", lang), use_container_width=True, type="primary"):
-            if cloud_infer is None:
-                st.error(t("error_no_infer", lang))
-            else:
-                api_key_now = get_api_key(engine)
-                if not api_key_now:
-                    st.error(t("error_no_key", lang))
-                else:
-                    with st.spinner(t("analyzing", lang)):
-                        result = cloud_infer(
-                            img, 
-                            engine=engine, 
-                            lang=lang, 
-                            enable_web=enable_web, 
-                            k_per_query=k_per_query,
-                            task_type=task_type,
-                            budget=budget,
-                            scene=scene,
-                            constraints=constraints
-                        )
-                    render_result_block(result, engine, lang)
+            submit_analysis(img)
+
+    _job = get_job(st.session_state.get("__job_id__"))
+    job_active = bool(_job and _job.active) or bool(st.session_state.get("__deferred__"))
+    # 任务进行中时仅结果面板按间隔重跑，页面其余部分不受影响
+    _run_panel(render_analysis_panel, run_every=POLL_INTERVAL if job_active else None)
+
+# ==================== 批量分析 ====================
+BATCH_COLUMNS = 4  # 进度格每行条目数
+
+
+def render_batch_panel():
+    """批量进度格 + 打开已完成条目的结果（fragment：批量进行中时按间隔重跑）"""
+    with panel_timer("batch", log):
+        _render_batch_panel()
+
+
+def _render_batch_panel():
+    batch = session_batch()
+    items = batch.items()
+    if not items:
+        return
+    st.divider()
+    st.subheader(t("batch_section", lang))
+    progress = batch.progress()
+    st.progress(progress["finished"] / progress["total"],
+                text=t("batch_progress", lang).format(**progress))
+    lanes = get_scheduler().snapshot()
+    st.caption(t("lane_waits", lang).format(capacity=get_scheduler().capacity,
+                                            **{lane: s["wait_p95_ms"]
+                                               for lane, s in lanes.items()}))
+
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button(t("batch_cancel", lang), disabled=not batch.active, use_container_width=True,
+                     key="batch_cancel"):
+            batch.cancel()
+    with c2:
+        if st.button(t("batch_clear", lang), use_container_width=True, key="batch_clear"):
+            batch.clear()
+            st.session_state.pop("__batch_open__", None)
+            st.rerun()
+
+    for row in range(0, len(items), BATCH_COLUMNS):
+        for col, item in zip(st.columns(BATCH_COLUMNS), items[row:row + BATCH_COLUMNS]):
+            with col.container(border=True):
+                if item.thumb is not None:
+                    st.image(item.thumb, use_container_width=True)
+                st.caption(item.name)
+                seconds = item.latency if item.latency is not None else item.elapsed
+                timing = f"{seconds:.1f}s"
+                st.markdown(f"{t('batch_' + item.status, lang)} · {timing}")
+                if item.error:
+                    st.caption(item.error)
+                if item.status == JOB_DONE and isinstance(item.result, dict):
+                    if st.button(t("batch_open", lang), key=f"batch_open_{item.id}",
+                                 use_container_width=True):
+                        st.session_state["__batch_open__"] = item.id
+
+    opened = batch.get(st.session_state.get("__batch_open__"))
+    if opened is not None and isinstance(opened.result, dict):
+        st.markdown(f"#### {opened.name}")
+        engine = opened.meta.get("engine", analysis_settings()["engine"])
+        render_result_block(opened.result, engine, lang)
+
+    # 批量结束后整页重跑一次以停止轮询
+    polling = st.session_state.get("__batch_polling__")
+    if not st.session_state.get("__full_run__") and polling and not batch.active:
+        st.rerun()
+
+
+batch_active = session_batch().active
+st.session_state["__batch_polling__"] = batch_active
+_run_panel(render_batch_panel, run_every=POLL_INTERVAL if batch_active else None)
 
 # ==================== 底部信息 ====================
 st.divider()
@@ -1019,6 +1595,14 @@ with col2:
 with col3:
     st.caption(t("footer_tech", lang))
 
+st.session_state["__full_run__"] = False
+record_panel("page", *_PAGE_T0, log=log)
+
+# 不支持 fragment 的旧版本：任务或批量进行中时整页轮询
+if _fragment is None and (job_active or batch_active):
+    time.sleep(POLL_INTERVAL)
+    st.rerun()
+
 def main():
     pass
 
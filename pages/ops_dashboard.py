@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+运维页：服务是否健康，不用再去翻 logs/app.log
+
+Streamlit 多页面：与 app_new.py 同进程运行，直接读取进程内指标和各组件的 snapshot()：
+- 各阶段耗时直方图（按阶段 + task_type，来自追踪 span，见 src/utils/metrics.py）
+- 结果缓存 / 解码缓存 / 选区复用 / 预分析命中率
+- 后端通道的在途数与排队深度、执行器与批量队列、持久化队列（启用时）
+- 限流事件（准入拒绝、会话超限、HTTP 429）、载荷大小、各面板服务端 CPU
+- 按需剖析开关（见 src/utils/stack_profiler.py）与最近的剖析文件下载
+- 内存追踪开关与各阶段内存峰值、分配位置（见 src/utils/memtrace.py）
+请求路径上只有指标计数，本页的聚合只在打开本页时进行。
+"""
+
+import os
+import time
+
+import streamlit as st
+
+from src.batch import batch_snapshot
+from src.image_store import get_image_store
+from src.job_queue import get_job_queue, queue_enabled
+from src.jobs import get_bulk_executor, get_executor, get_speculator
+from src.result_cache import get_result_cache
+from src.roi_index import get_roi_index
+from src.scheduler import get_scheduler
+from src.session_images import get_session_image_store
+from src.utils import memtrace
+from src.utils.metrics import WINDOW_S, metrics_snapshot
+from src.utils.profiling import panel_stats
+from src.utils.stack_profiler import configure, profile_next, profiler_snapshot
+from src.utils.tracing import get_exporter
+
+st.set_page_config(page_title="Ops", page_icon="📊", layout="wide")
+
+I18N = {
+    "zh": {
+        "title": "📊 运维面板",
+        "caption": "进程 {pid} · 已运行 {uptime} · 最近窗口 {window} 分钟",
+        "auto_refresh": "自动刷新",
+        "interval": "刷新间隔（秒）",
+        "range": "统计范围",
+        "range_window": "最近窗口",
+        "range_total": "启动以来",
+        "inflight": "后端在途",
+        "queued": "排队中",
+        "throttled": "限流事件（窗口）",
+        "result_hit": "结果缓存命中率",
+        "decode_hit": "解码缓存命中率",
+        "rss": "进程内存",
+        "latency": "各阶段耗时",
+        "stages": "阶段",
+        "histogram": "耗时分布",
+        "no_data": "暂无数据",
+        "queues": "队列与在途",
+        "caches": "缓存",
+        "throttling": "限流事件",
+        "payload": "载荷大小",
+        "panels": "面板服务端 CPU",
+        "traces": "追踪导出",
+        "profiling": "🔬 按需剖析（cloud_infer）",
+        "profile_rate": "抽样比例",
+        "profile_match": "匹配条件（如 task_type=print）",
+        "profile_next": "剖析接下来 N 次",
+        "profile_apply": "应用",
+        "profile_recent": "最近的剖析文件（collapsed stacks，可拖入 speedscope）",
+        "memory": "🧠 各阶段内存（MEMTRACE）",
+        "memtrace_mode": "内存追踪模式",
+        "memtrace_off": "关闭",
+        "mem_sites": "增长最多的分配位置",
+    },
+    "en": {
+        "title": "📊 Ops dashboard",
+        "caption": "pid {pid} · up {uptime} · window {window} min",
+        "auto_refresh": "Auto refresh",
+        "interval": "Interval (s)",
+        "range": "Range",
+        "range_window": "Recent window",
+        "range_total": "Since start",
+        "inflight": "Backend in flight",
+        "queued": "Queued",
+        "throttled": "Throttle events (window)",
+        "result_hit": "Result cache hit ratio",
+        "decode_hit": "Decode cache hit ratio",
+        "rss": "Process RSS",
+        "latency": "Stage latency",
+        "stages": "Stages",
+        "histogram": "Latency distribution",
+        "no_data": "No data yet",
+        "queues": "Queues & in-flight",
+        "caches": "Caches",
+        "throttling": "Throttle events",
+        "payload": "Payload sizes",
+        "panels": "Server CPU per panel",
+        "traces": "Trace export",
+        "profiling": "🔬 On-demand profiling (cloud_infer)",
+        "profile_rate": "Sample rate",
+        "profile_match": "Match (e.g. task_type=print)",
+        "profile_next": "Profile next N calls",
+        "profile_apply": "Apply",
+        "profile_recent": "Recent profiles (collapsed stacks, open in speedscope)",
+        "memory": "🧠 Memory by stage (MEMTRACE)",
+        "memtrace_mode": "Memory tracking mode",
+        "memtrace_off": "off",
+        "mem_sites": "Top allocation sites",
+    },
+}
+lang = st.session_state.get("lang", "zh")
+
+
+def t(key: str) -> str:
+    return I18N.get(lang, I18N["zh"]).get(key, key)
+
+
+_STARTED = st.session_state.setdefault("__ops_started__", time.time())
+
+
+def _fmt_bucket(le: float, unit: str) -> str:
+    if le == float("inf"):
+        return "+inf"
+    if unit == "bytes":
+        return f"≤{le / 1024:.0f}KB" if le < 1024 * 1024 else f"≤{le / 1024 / 1024:.0f}MB"
+    return f"≤{le / 1000:.0f}s" if le >= 1000 else f"≤{le:.0f}ms"
+
+
+def _histogram_chart(rows, unit: str, color: str) -> None:
+    """按桶画柱状图（桶按数值顺序排列，color 为分组标签名）"""
+    data = [{"bucket": _fmt_bucket(le, unit), "order": i, color: r["labels"].get(color, "-"),
+             "count": n}
+            for r in rows for i, (le, n) in enumerate(r.get("buckets", []))]
+    if not data:
+        st.caption(t("no_data"))
+        return
+    st.vega_lite_chart({"values": data}, {
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "bucket", "type": "ordinal", "sort": {"field": "order"}, "title": None},
+            "y": {"field": "count", "type": "quantitative", "stack": True},
+            "color": {"field": color, "type": "nominal"},
+        },
+    }, use_container_width=True)
+
+
+def _latency_section(metrics, window: bool) -> None:
+    st.subheader(t("latency"))
+    rows = metrics.get("stage_latency_ms", [])
+    stages = sorted({r["labels"]["stage"] for r in rows})
+    default = [s for s in ("analysis", "backend_call", "queue_wait", "cache_lookup", "render")
+               if s in stages]
+    chosen = st.multiselect(t("stages"), stages, default=default or stages[:5], key="ops_stages")
+    picked = [r for r in rows if r["labels"]["stage"] in chosen]
+    if not picked:
+        st.caption(t("no_data"))
+        return
+    cols = ("count", "p50", "p95", "p99", "max", "avg") if window else ("count", "avg", "max")
+    st.dataframe([dict(stage=r["labels"]["stage"], task_type=r["labels"].get("task_type", "-"),
+                       **{c: r.get(c) for c in cols})
+                  for r in sorted(picked, key=lambda r: (r["labels"]["stage"],
+                                                         r["labels"].get("task_type", "")))],
+                 use_container_width=True, hide_index=True)
+    if window:
+        stage = st.selectbox(t("histogram"), chosen, key="ops_hist_stage")
+        _histogram_chart([r for r in picked if r["labels"]["stage"] == stage], "ms", "task_type")
+
+
+def render_dashboard(window: bool) -> None:
+    metrics = metrics_snapshot(window)
+    lanes = get_scheduler().snapshot()
+    executor, bulk = get_executor().snapshot(), get_bulk_executor().snapshot()
+    batches = batch_snapshot()
+    cache = get_result_cache().snapshot()
+    decode = get_image_store().snapshot()
+    images = get_session_image_store().snapshot()
+    roi, spec = get_roi_index().snapshot(), get_speculator().snapshot()
+    throttles = metrics.get("throttle_events", [])
+
+    inflight = sum(l["running"] for l in lanes.values())
+    queued = (sum(l["waiting"] for l in lanes.values())
+              + executor["queued"] + bulk["queued"] + batches["queued"])
+    decode_lookups = decode["hits"] + decode["decodes"]
+    c = st.columns(6)
+    c[0].metric(t("inflight"), f"{inflight} / {get_scheduler().capacity}")
+    c[1].metric(t("queued"), queued)
+    c[2].metric(t("throttled"), sum(r["window"] for r in throttles))
+    c[3].metric(t("result_hit"), f"{cache['overall_hit_ratio']:.0%}")
+    rss = images.get("process_rss")
+    decode_hit = f"{decode['hits'] / decode_lookups:.0%}" if decode_lookups else "-"
+    c[4].metric(t("decode_hit"), decode_hit)
+    c[5].metric(t("rss"), f"{rss / 1024 / 1024:.0f} MB" if rss else "-")
+
+    _latency_section(metrics, window)
+
+    left, right = st.columns(2)
+    with left:
+        st.subheader(t("queues"))
+        st.dataframe([dict(lane=name, **snap) for name, snap in lanes.items()],
+                     use_container_width=True, hide_index=True)
+        st.dataframe([dict(pool="interactive", **executor), dict(pool="bulk", **bulk)],
+                     use_container_width=True, hide_index=True)
+        st.json({"batch": batches,
+                 **({"job_queue": get_job_queue().snapshot()} if queue_enabled() else {})},
+                expanded=False)
+
+        st.subheader(t("throttling"))
+        if throttles:
+            st.dataframe([dict(kind=r["labels"].get("kind", "-"), window=r["window"],
+                               total=r["total"]) for r in throttles],
+                         use_container_width=True, hide_index=True)
+        else:
+            st.caption(t("no_data"))
+    with right:
+        st.subheader(t("caches"))
+        st.dataframe([
+            {"cache": "result / local", "lookups": cache["local"]["lookups"],
+             "hits": cache["local"]["hits"], "hit_ratio": cache["local"]["hit_ratio"]},
+            {"cache": "result / remote", "lookups": cache["remote"]["lookups"],
+             "hits": cache["remote"]["hits"], "hit_ratio": cache["remote"]["hit_ratio"]},
+            {"cache": "decode", "lookups": decode_lookups, "hits": decode["hits"],
+             "hit_ratio": round(decode["hits"] / decode_lookups, 3) if decode_lookups else 0.0},
+            {"cache": "roi reuse", "lookups": roi["lookups"], "hits": roi["hits"],
+             "hit_ratio": roi["hit_rate"]},
+            {"cache": "speculation", "lookups": spec["hits"] + spec["misses"], "hits": spec["hits"],
+             "hit_ratio": spec["hit_rate"]},
+        ], use_container_width=True, hide_index=True)
+        if cache["remote"]["nodes"]:
+            remote = cache["remote"]
+            st.caption(f"remote: {', '.join(remote['nodes'])} · errors {remote['errors']}")
+
+        st.subheader(t("payload"))
+        payload = metrics.get("payload_bytes", [])
+        if payload:
+            st.dataframe([dict(stage=r["labels"]["stage"], count=r["count"],
+                               avg_kb=round(r["avg"] / 1024, 1), max_kb=round(r["max"] / 1024, 1),
+                               **({"p95_kb": round(r["p95"] / 1024, 1)} if window else {}))
+                          for r in payload], use_container_width=True, hide_index=True)
+        else:
+            st.caption(t("no_data"))
+
+    memory = metrics.get("mem_peak_bytes", [])
+    if memory:
+        st.subheader(t("memory"))
+        st.dataframe([dict(stage=r["labels"]["stage"], mode=r["labels"].get("mode", "-"),
+                           count=r["count"], avg_mb=round(r["avg"] / 1048576, 2),
+                           max_mb=round(r["max"] / 1048576, 2),
+                           **({"p95_mb": round(r["p95"] / 1048576, 2)} if window else {}))
+                      for r in sorted(memory, key=lambda r: -r["max"])],
+                     use_container_width=True, hide_index=True)
+
+    st.subheader(t("panels"))
+    st.dataframe([dict(panel=name, **s) for name, s in panel_stats().items()],
+                 use_container_width=True, hide_index=True)
+    st.caption(f"{t('traces')}: {get_exporter().snapshot()}")
+
+
+def render_profiling() -> None:
+    """剖析开关：在页面上修改，对本进程内后续的 cloud_infer 调用立即生效"""
+    snap = profiler_snapshot()
+    with st.expander(t("profiling"), expanded=bool(snap["rate"] or snap["pending"])):
+        with st.form("ops_profiling"):
+            c1, c2, c3 = st.columns([1, 2, 1])
+            rate = c1.number_input(t("profile_rate"), 0.0, 1.0, float(snap["rate"]), step=0.01)
+            match = c2.text_input(t("profile_match"), snap["match"])
+            n = c3.number_input(t("profile_next"), 0, 100, 0)
+            if st.form_submit_button(t("profile_apply")):
+                configure(rate=rate, match=match)
+                profile_next(n)
+                snap = profiler_snapshot()
+        st.caption(f"pending {snap['pending']} · profiled {snap['profiled']}"
+                   f" · interval {snap['interval_ms']}ms")
+        if snap["recent"]:
+            st.caption(t("profile_recent"))
+            for path in snap["recent"][:5]:
+                try:
+                    data = open(path, "rb").read()
+                except OSError:
+                    continue
+                st.download_button(os.path.basename(path), data, file_name=os.path.basename(path),
+                                   key=f"prof_{path}")
+
+
+def render_memtrace() -> None:
+    """内存追踪开关（对本进程后续的 span 立即生效）与分配位置汇总"""
+    current = memtrace.mode()
+    with st.expander(t("memory"), expanded=bool(current)):
+        options = [""] + list(memtrace.MODES)
+        chosen = st.radio(t("memtrace_mode"), options, index=options.index(current),
+                          horizontal=True, format_func=lambda m: m or t("memtrace_off"),
+                          key="ops_memtrace")
+        if chosen != current:
+            memtrace.enable(chosen)
+        sites = memtrace.top_sites(5)
+        if sites:
+            st.caption(t("mem_sites"))
+            st.dataframe([dict(stage=stage, site=r["site"], kb=round(r["bytes"] / 1024, 1),
+                               blocks=r["blocks"], seen=r["seen"])
+                          for stage, rows in sites.items() for r in rows],
+                         use_container_width=True, hide_index=True)
+
+
+st.title(t("title"))
+uptime = time.time() - _STARTED
+st.caption(t("caption").format(pid=os.getpid(), uptime=f"{uptime / 60:.0f} min",
+                               window=WINDOW_S // 60))
+c1, c2, c3 = st.columns([1, 1, 2])
+auto = c1.toggle(t("auto_refresh"), value=True, key="ops_auto")
+interval = c2.select_slider(t("interval"), options=[1, 2, 5, 10, 30], value=2, key="ops_interval")
+scope = c3.radio(t("range"), ["window", "total"], horizontal=True, key="ops_range",
+                 format_func=lambda v: t("range_" + v))
+
+render_profiling()
+render_memtrace()
+
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if auto and _fragment is not None:
+    _fragment(render_dashboard, run_every=interval)(scope == "window")
+else:
+    render_dashboard(scope == "window")
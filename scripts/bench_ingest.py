@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+上传解码峰值内存基准：整图解码 vs draft 工作图 + ROI 解码
+
+对 2-100 MP 的合成 JPEG/PNG，分别在独立子进程中测量：
+- full:    Image.open(...).convert("RGB")（旧路径）
+- ingest:  DecodedImageStore.get_or_decode（工作图 + 预览金字塔）
+- roi:     ingest 后再按原图分辨率解码 1024×1024 选区
+
+峰值内存取子进程 VmHWM 相对解码前 RSS 的增量（PIL 栅格不经过 Python 分配器，tracemalloc 统计不到）。
+
+用法：
+    python scripts/bench_ingest.py --mp 2 12 25 50 100 --formats JPEG PNG
+"""
+
+from __future__ import annotations
+import argparse
+import io
+import math
+import multiprocessing as mp
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _hwm_mb() -> float:
+    # 用 VmHWM 而非 ru_maxrss：后者跨 exec 继承父进程的峰值（父进程生成大图时会很高）
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def make_image(path: Path, megapixels: float, fmt: str) -> None:
+    """生成带渐变和纹理的合成图（避免纯色图压缩得过小、解码过快）"""
+    from PIL import Image, ImageChops
+
+    w = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    h = int(w * 3 / 4)
+    base = Image.linear_gradient("L").resize((w, h))
+    noise = Image.effect_noise((512, 512), 48).resize((w, h), Image.NEAREST)
+    img = Image.merge("RGB", (base, ImageChops.add(base, noise, scale=2), noise))
+    kwargs = {"quality": 90} if fmt == "JPEG" else {"compress_level": 1}
+    img.save(path, format=fmt, **kwargs)
+
+
+def _measure(mode: str, path: str, queue) -> None:
+    data = Path(path).read_bytes()
+    if mode != "full":
+        import src.image_store  # noqa: F401  先导入，避免把模块加载计入峰值
+    before = _hwm_mb()
+    t0 = time.perf_counter()
+    if mode == "full":
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        size = img.size
+    else:
+        from src.image_store import DecodedImageStore
+
+        entry = DecodedImageStore().get_or_decode(data)
+        size = entry.image.size
+        if mode == "roi":
+            w, h = entry.image.size
+            scale = entry.original_size[0] / w
+            side = min(1024 / scale, w, h)
+            size = entry.roi((int((w - side) / 2), int((h - side) / 2), int(side), int(side))).size
+    queue.put({"peak_mb": _hwm_mb() - before, "seconds": time.perf_counter() - t0, "size": size})
+
+
+def measure(mode: str, path: Path) -> dict:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(mode, str(path), queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="上传解码峰值内存对比")
+    parser.add_argument("--mp", type=float, nargs="+", default=[2, 12, 25, 50, 100], help="图片百万像素数")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--modes", nargs="+", default=["full", "ingest", "roi"])
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'format':<6} {'MP':>5} {'mode':<7} {'peak MB':>9} {'time s':>7}  size")
+        for fmt in args.formats:
+            for megapixels in args.mp:
+                path = Path(tmp) / f"bench_{megapixels:g}.{fmt.lower()}"
+                make_image(path, megapixels, fmt)
+                for mode in args.modes:
+                    r = measure(mode, path)
+                    print(f"{fmt:<6} {megapixels:>5g} {mode:<7} {r['peak_mb']:>9.1f} "
+                          f"{r['seconds']:>7.2f}  {r['size'][0]}x{r['size'][1]}")
+                path.unlink()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+冷启动导入耗时检查（import-time budget）
+
+对每个入口（页面、HTTP 服务、队列 worker、CLI 脚本）在全新解释器里只执行它的模块级 import 语句
+（用 ast 从入口文件中提取，不运行入口本身），用 `python -X importtime` 得到每个模块的
+自身 / 累计导入耗时，输出：
+- 每个入口的冷启动导入总耗时与预算
+- 累计耗时最多的顶层导入、自身耗时最多的模块
+并在以下情况返回非 0（可直接放进 CI / pre-commit）：
+- 某个入口的导入总耗时（多次运行取中位数）超过预算
+- 非页面入口导入了页面专用依赖（streamlit 等）：worker 和 CLI 进程不应为 UI 付出任何导入成本
+
+用法：
+    python scripts/check_import_budget.py                    # 检查全部入口
+    python scripts/check_import_budget.py worker api         # 只检查部分入口
+    python scripts/check_import_budget.py --top 15 --runs 5
+    python scripts/check_import_budget.py --budget ui=2500 --scale 1.5   # 调整预算（慢机器放宽）
+    python scripts/check_import_budget.py --module src.aug.prefetch      # 单个模块的导入剖析（不做预算检查）
+"""
+
+from __future__ import annotations
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# 入口 -> (入口文件, 预算毫秒)；预算按开发机实测值留出约一倍余量
+ENTRIES: Dict[str, Tuple[str, float]] = {
+    "ui": ("app_new.py", 2500),
+    "api": ("scripts/serve_api.py", 900),
+    "worker": ("scripts/job_queue.py", 400),
+    "trace_report": ("scripts/trace_report.py", 300),
+    "replay_label_log": ("scripts/replay_label_log.py", 300),
+}
+# 页面专用依赖：除 ui 外的入口导入其中任何一个即失败
+UI_ONLY = ("streamlit", "streamlit_cropper", "pandas", "pyarrow", "altair")
+
+
+def entry_imports(path: Path) -> str:
+    """
+    入口文件的模块级 import 语句（含 try/except 中的可选导入，不含 if __name__ == "__main__" 块），
+    拼成可直接 exec 的代码（入口里的 sys.path 设置由 PYTHONPATH 代替）。
+    """
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    keep: List[ast.stmt] = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if not (isinstance(node, ast.ImportFrom) and node.module == "__future__"):
+                keep.append(node)
+        elif isinstance(node, ast.Try):
+            imports = [n for n in node.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+            if imports:
+                handler = ast.ExceptHandler(type=None, name=None, body=[ast.Pass()])
+                keep.append(ast.Try(body=imports, handlers=[handler], orelse=[], finalbody=[]))
+    return ast.unparse(ast.Module(body=keep, type_ignores=[]))
+
+
+def run_importtime(code: str) -> List[Tuple[int, int, int, str]]:
+    """在全新解释器里执行 code，返回 [(自身 us, 累计 us, 缩进层级, 模块名)]（按导入顺序）"""
+    env = dict(os.environ, PYTHONPATH=str(ROOT), PYTHONDONTWRITEBYTECODE="")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip()
+                           else "import failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us), int(cum_us), (len(name) - len(name.lstrip())) // 2,
+                     name.strip()))
+    return rows
+
+
+def profile(code: str, runs: int) -> Tuple[float, List[Tuple[int, int, int, str]]]:
+    """多次运行取导入总耗时中位数（ms），并返回中位数那次的明细"""
+    results = []
+    for _ in range(max(1, runs)):
+        rows = run_importtime(code)
+        top = min((r[2] for r in rows), default=0)
+        results.append((sum(r[1] for r in rows if r[2] == top) / 1000, rows))
+    results.sort(key=lambda r: r[0])
+    return results[len(results) // 2]
+
+
+def report(name: str, total_ms: float, rows, top: int, budget: Optional[float]) -> List[str]:
+    status = "" if budget is None else (f"  budget {budget:.0f}ms  "
+                                        + ("OK" if total_ms <= budget else "OVER"))
+    lines = [f"[{name}] cold-start imports {total_ms:.0f}ms, {len(rows)} modules{status}"]
+    level = min((r[2] for r in rows), default=0)
+    lines.append(f"  {'slowest top-level imports':<44}{'cumulative ms':>14}")
+    for self_us, cum_us, _lvl, mod in sorted((r for r in rows if r[2] == level),
+                                             key=lambda r: -r[1])[:top]:
+        lines.append(f"  {mod:<44}{cum_us / 1000:>14.1f}")
+    lines.append(f"  {'slowest modules (self time)':<44}{'self ms':>14}")
+    for self_us, _cum, _lvl, mod in sorted(rows, key=lambda r: -r[0])[:top]:
+        lines.append(f"  {mod:<44}{self_us / 1000:>14.1f}")
+    return lines
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="冷启动导入耗时检查")
+    parser.add_argument("entries", nargs="*", help=f"要检查的入口（默认全部：{', '.join(ENTRIES)}）")
+    parser.add_argument("--runs", type=int, default=3, help="每个入口运行次数（取中位数）")
+    parser.add_argument("--top", type=int, default=8, help="列出最慢的模块数")
+    parser.add_argument("--budget", action="append", default=[], metavar="ENTRY=MS",
+                        help="覆盖某个入口的预算")
+    parser.add_argument("--scale", type=float, default=float(os.getenv("IMPORT_BUDGET_SCALE", "1")),
+                        help="所有预算乘以该系数（慢机器 / CI 放宽）")
+    parser.add_argument("--module", default="", help="只剖析单个模块的导入（如 src.aug.prefetch）")
+    args = parser.parse_args(argv)
+
+    if args.module:
+        total_ms, rows = profile(f"import {args.module}", args.runs)
+        print("\n".join(report(args.module, total_ms, rows, args.top, None)))
+        return 0
+
+    budgets = {name: ms for name, (_path, ms) in ENTRIES.items()}
+    for item in args.budget:
+        name, _, ms = item.partition("=")
+        budgets[name] = float(ms)
+    names = args.entries or list(ENTRIES)
+    unknown = [n for n in names if n not in ENTRIES]
+    if unknown:
+        parser.error(f"unknown entries: {', '.join(unknown)}")
+
+    failures = []
+    for name in names:
+        path = ROOT / ENTRIES[name][0]
+        try:
+            total_ms, rows = profile(entry_imports(path), args.runs)
+        except RuntimeError as e:
+            failures.append(f"{name}: import failed: {e}")
+            continue
+        budget = budgets[name] * args.scale
+        print("\n".join(report(name, total_ms, rows, args.top, budget)))
+        print()
+        if total_ms > budget:
+            failures.append(f"{name}: {total_ms:.0f}ms > budget {budget:.0f}ms")
+        if name != "ui":
+            loaded = {r[3].split(".")[0] for r in rows}
+            leaked = [m for m in UI_ONLY if m in loaded]
+            if leaked:
+                failures.append(f"{name}: imports UI-only dependencies: {', '.join(leaked)}")
+
+    if failures:
+        print("FAILED")
+        for f in failures:
+            print(f"  {f}")
+        return 1
+    print("all entries within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
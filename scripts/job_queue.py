@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+持久化任务队列命令行：启动 worker 进程池、提交图片、查看状态和结果
+
+worker 进程从 SQLite 队列领取 cloud_infer 任务（带租约和重试），与 Streamlit 进程互不依赖：
+UI 重启不丢任务，扩容推理只需多开 worker。
+
+用法：
+    # 启动 4 个 worker 进程（Ctrl+C 停止；运行中的任务跑完后退出）
+    python scripts/job_queue.py worker -n 4
+
+    # 提交并等待结果
+    python scripts/job_queue.py submit fabric.jpg --engine qwen-vl --lang zh --wait
+
+    python scripts/job_queue.py status            # 各状态计数 + 最近任务
+    python scripts/job_queue.py result <job_id>   # 打印结果 JSON
+    python scripts/job_queue.py cancel <job_id>
+    python scripts/job_queue.py purge --hours 24  # 删除已结束超过 24 小时的任务
+
+    # 不调用 API 的扩容测试：worker 用 1 秒的假分析，提交 40 个任务，比较 1/2/4 个 worker 的吞吐
+    python scripts/job_queue.py worker -n 4 --stub 1.0
+    python scripts/job_queue.py submit fabric.jpg --repeat 40
+
+数据库路径取 --db，其次 JOB_QUEUE_DB，默认 cache/job_queue.sqlite3。
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing as mp
+import signal
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.job_queue import DEFAULT_DB, QUEUE_DB, JobQueue, run_worker  # noqa: E402
+
+
+def _stub(latency: float):
+    """假分析：固定耗时，返回图片尺寸（用于扩容测试）"""
+    def fn(image, **params):
+        time.sleep(latency)
+        return {"engine": "stub", "size": list(image.size), "params": params}
+    return fn
+
+
+def _worker_main(db: str, stop, stub: float) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由父进程统一处理 Ctrl+C
+    queue = JobQueue(db)
+    handled = run_worker(queue, fn=_stub(stub) if stub else None, stop=stop)
+    print(f"worker exited, handled {handled} jobs", flush=True)
+
+
+def cmd_worker(args) -> int:
+    ctx = mp.get_context("spawn")
+    stop = ctx.Event()
+    procs = [ctx.Process(target=_worker_main, args=(args.db, stop, args.stub),
+                         name=f"queue-worker-{i}")
+             for i in range(args.n)]
+    for p in procs:
+        p.start()
+    print(f"{args.n} workers on {args.db}", flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while any(p.is_alive() for p in procs) and not stop.is_set():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for p in procs:
+        p.join()
+    return 0
+
+
+def cmd_submit(args) -> int:
+    from PIL import Image
+
+    queue = JobQueue(args.db)
+    image = Image.open(args.image).convert("RGB")
+    params = {"engine": args.engine, "lang": args.lang, "task_type": args.task_type,
+              "enable_web": args.web}
+    t0 = time.time()
+    ids = [queue.enqueue(image, params, session_id="cli") for _ in range(args.repeat)]
+    for job_id in ids:
+        print(job_id)
+    if not args.wait:
+        return 0
+    pending = set(ids)
+    while pending:
+        for job_id in list(pending):
+            job = queue.get(job_id)
+            if job is None or not job.active:
+                pending.discard(job_id)
+        time.sleep(0.2)
+    wall = time.time() - t0
+    jobs = [queue.get(i) for i in ids]
+    failed = [j for j in jobs if j.status != "done"]
+    print(f"{len(ids)} jobs in {wall:.2f}s ({len(ids) / wall:.2f} jobs/s), {len(failed)} not done",
+          file=sys.stderr)
+    if len(ids) == 1 and jobs[0].result is not None:
+        print(json.dumps(jobs[0].result, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+
+def cmd_status(args) -> int:
+    queue = JobQueue(args.db)
+    print(json.dumps(queue.snapshot()))
+    for job in queue.recent(args.state, args.limit):
+        latency = f"{job.latency:.2f}s" if job.latency is not None else "-"
+        print(f"{job.id}  {job.status:<9} attempts={job.attempts}/{job.max_attempts}"
+              f"  latency={latency}  {job.error or ''}")
+    return 0
+
+
+def cmd_result(args) -> int:
+    job = JobQueue(args.db).get(args.job_id)
+    if job is None:
+        print("not found", file=sys.stderr)
+        return 1
+    if job.status != "done":
+        print(f"{job.status} {job.error or ''}", file=sys.stderr)
+        return 1
+    print(json.dumps(job.result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_cancel(args) -> int:
+    return 0 if JobQueue(args.db).cancel(args.job_id) else 1
+
+
+def cmd_purge(args) -> int:
+    print(JobQueue(args.db).purge(args.hours * 3600))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="持久化任务队列")
+    parser.add_argument("--db", default=QUEUE_DB or DEFAULT_DB, help="队列数据库路径")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("worker", help="启动 worker 进程池")
+    p.add_argument("-n", type=int, default=2, help="worker 进程数")
+    p.add_argument("--stub", type=float, default=0.0, help="用固定耗时（秒）的假分析代替 cloud_infer")
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser("submit", help="提交图片分析")
+    p.add_argument("image")
+    p.add_argument("--engine", default="qwen-vl")
+    p.add_argument("--lang", default="zh", choices=["zh", "en"])
+    p.add_argument("--task-type", default="auto")
+    p.add_argument("--web", action="store_true", help="启用联网证据")
+    p.add_argument("--repeat", type=int, default=1, help="同一图片提交多次（扩容测试）")
+    p.add_argument("--wait", action="store_true", help="等待全部结束并报告吞吐")
+    p.set_defaults(func=cmd_submit)
+
+    p = sub.add_parser("status", help="队列状态")
+    p.add_argument("--state", default=None, help="只列出该状态的任务")
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("result", help="打印任务结果")
+    p.add_argument("job_id")
+    p.set_defaults(func=cmd_result)
+
+    p = sub.add_parser("cancel", help="取消任务")
+    p.add_argument("job_id")
+    p.set_defaults(func=cmd_cancel)
+
+    p = sub.add_parser("purge", help="删除已结束的旧任务")
+    p.add_argument("--hours", type=float, default=24)
+    p.set_defaults(func=cmd_purge)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
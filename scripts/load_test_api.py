@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 推理服务压测：吞吐（requests/s）与延迟分位数
+
+默认在本进程内启动一个假后端服务（--stub 秒/次，不调用 API），再用 --concurrency 个并发客户端
+发送 --requests 个请求；指定 --url 时改为压测已运行的服务。
+被准入控制拒绝（429）的请求单独计数，不计入延迟分位数。
+
+用法：
+    python scripts/load_test_api.py --requests 200 --concurrency 16 --stub 0.2 --max-inflight 8
+    python scripts/load_test_api.py --url http://127.0.0.1:8600 --image fabric.jpg --concurrency 4
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import io
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.http_service import create_app, stub_backend, web  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def sample_image() -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.effect_noise((640, 480), 40).convert("RGB").save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+async def _start_stub(args) -> tuple:
+    app = create_app(stub_backend(args.stub), max_inflight=args.max_inflight,
+                     max_queue=args.max_queue)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run(args) -> int:
+    import aiohttp
+
+    image = Path(args.image).read_bytes() if args.image else sample_image()
+    runner: Optional[web.AppRunner] = None
+    url = args.url
+    if not url:
+        runner, url = await _start_stub(args)
+    endpoint = f"{url.rstrip('/')}/v1/analyze"
+
+    latencies: List[float] = []
+    counts = {"ok": 0, "rejected": 0, "error": 0}
+    remaining = iter(range(args.requests))
+
+    async def client(session):
+        for _ in remaining:
+            form = aiohttp.FormData()
+            form.add_field("image", image, filename="sample.jpg", content_type="image/jpeg")
+            form.add_field("lang", args.lang)
+            t0 = time.perf_counter()
+            try:
+                async with session.post(endpoint, data=form) as resp:
+                    await resp.read()
+                    if resp.status == 200:
+                        counts["ok"] += 1
+                        latencies.append(time.perf_counter() - t0)
+                    elif resp.status == 429:
+                        counts["rejected"] += 1
+                    else:
+                        counts["error"] += 1
+            except aiohttp.ClientError:
+                counts["error"] += 1
+
+    t0 = time.perf_counter()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+    wall = time.perf_counter() - t0
+    if runner is not None:
+        await runner.cleanup()
+
+    local = "" if args.url else f" (stub {args.stub:.2f}s, max_inflight {args.max_inflight})"
+    print(f"target      {url}{local}")
+    print(f"requests    {args.requests}  concurrency {args.concurrency}  wall {wall:.2f}s")
+    print(f"ok          {counts['ok']}  rejected(429) {counts['rejected']}"
+          f"  errors {counts['error']}")
+    print(f"throughput  {counts['ok'] / wall:.2f} req/s")
+    p50, p95, p99 = (percentile(latencies, q) * 1000 for q in (50, 95, 99))
+    print(f"latency     p50 {p50:.0f}ms  p95 {p95:.0f}ms  p99 {p99:.0f}ms")
+    return 0 if counts["error"] == 0 else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HTTP 推理服务压测")
+    parser.add_argument("--url", default="", help="已运行服务的地址；为空时启动本地假后端")
+    parser.add_argument("--image", default="", help="请求使用的图片（默认生成 640×480 噪声图）")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--lang", default="zh")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求超时（秒）")
+    parser.add_argument("--stub", type=float, default=0.2, help="本地假后端每次分析耗时（秒）")
+    parser.add_argument("--max-inflight", type=int, default=4, help="本地假后端的同时分析数")
+    parser.add_argument("--max-queue", type=int, default=16, help="本地假后端的排队上限")
+    args = parser.parse_args(argv)
+    if web is None:
+        print("aiohttp 未安装。请运行: pip install aiohttp", file=sys.stderr)
+        return 1
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
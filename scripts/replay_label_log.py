@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+回放标签日志，对比规范化前后的 web_evidence 缓存命中率
+
+日志格式：
+- 纯文本：每行一个标签
+- JSONL：每行一个对象，读取 "label" 字段（如 cache/fabric_kb/web_cache.jsonl）
+
+用法：
+    python scripts/replay_label_log.py labels.txt --lang zh
+    python scripts/replay_label_log.py labels.txt --capacity 64   # 模拟有限容量 LRU
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.aug.fabric_alias import canonical_name, label_key  # noqa: E402
+
+
+def read_labels(path: Path) -> List[str]:
+    labels = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    line = json.loads(line).get("label", "")
+                except ValueError:
+                    continue
+            if line:
+                labels.append(line)
+    return labels
+
+
+def replay(labels: Iterable[str], key_fn: Callable[[str], str], capacity: int = 0) -> dict:
+    """按顺序回放标签，模拟以 key_fn(label) 为键的 LRU 缓存"""
+    cache: OrderedDict = OrderedDict()
+    hits = total = 0
+    for label in labels:
+        key = key_fn(label)
+        total += 1
+        if key in cache:
+            hits += 1
+            cache.move_to_end(key)
+        else:
+            cache[key] = True
+            if capacity and len(cache) > capacity:
+                cache.popitem(last=False)
+    return {"total": total, "hits": hits, "hit_rate": hits / total if total else 0.0}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="规范化前后缓存命中率对比")
+    parser.add_argument("logs", nargs="+", type=Path)
+    parser.add_argument("--lang", default="zh")
+    parser.add_argument("--capacity", type=int, default=0, help="LRU 容量（0 为不限）")
+    args = parser.parse_args(argv)
+
+    labels: List[str] = []
+    for p in args.logs:
+        labels.extend(read_labels(p))
+    if not labels:
+        print("日志为空")
+        return 1
+
+    before = replay(labels, lambda s: s.strip(), args.capacity)
+    after = replay(labels, lambda s: canonical_name(label_key(s), args.lang), args.capacity)
+
+    print(f"labels:          {len(labels)}")
+    print(f"distinct raw:    {len(set(s.strip() for s in labels))}")
+    print(f"distinct canon:  {len(set(label_key(s) for s in labels))}")
+    print(f"hit rate before: {before['hit_rate']:.1%} ({before['hits']}/{before['total']})")
+    print(f"hit rate after:  {after['hit_rate']:.1%} ({after['hits']}/{after['total']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
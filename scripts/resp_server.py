@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+本地 Redis 协议替身服务（用于测试共享结果缓存，不需要安装 Redis）
+
+只实现结果缓存用到的命令：PING / ECHO / AUTH / SELECT / GET / SET [EX|PX] / DEL / EXISTS /
+DBSIZE / FLUSHDB / FLUSHALL / INFO / QUIT。数据只在内存中，进程退出即清空。
+
+用法：
+    # 起两个节点，模拟两台共享缓存
+    python scripts/resp_server.py --port 6390 &
+    python scripts/resp_server.py --port 6391 &
+
+    # 两个应用实例指向同一组节点：一个实例分析过的图片，另一个实例直接命中远程层
+    export RESULT_CACHE_REMOTE=redis://127.0.0.1:6390,redis://127.0.0.1:6391
+    streamlit run app_new.py --server.port 8501
+    streamlit run app_new.py --server.port 8502
+
+    python scripts/resp_server.py --port 6390 --latency-ms 2   # 模拟网络往返
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RespStore:
+    """按 db 编号分区的内存键值表（过期时间为 monotonic 秒）"""
+
+    def __init__(self):
+        self.dbs: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.commands = 0
+
+    def db(self, n: int) -> Dict[bytes, Tuple[bytes, Optional[float]]]:
+        return self.dbs.setdefault(n, {})
+
+    def get(self, n: int, key: bytes) -> Optional[bytes]:
+        entry = self.db(n).get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.db(n)[key]
+            return None
+        return entry[0]
+
+
+def _bulk(data: Optional[bytes]) -> bytes:
+    return b"$-1\r\n" if data is None else b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    """读一条命令：RESP 数组，或 redis-cli / telnet 的内联命令"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:].strip())):
+        header = await reader.readline()
+        size = int(header[1:].strip())
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def _execute(store: RespStore, state: Dict[str, int], args: List[bytes]) -> bytes:
+    name = args[0].upper().decode(errors="replace")
+    db = store.db(state["db"])
+    store.commands += 1
+    if name == "PING":
+        return b"+PONG\r\n" if len(args) == 1 else _bulk(args[1])
+    if name == "ECHO" and len(args) == 2:
+        return _bulk(args[1])
+    if name == "AUTH":
+        return b"+OK\r\n"  # 替身服务不校验密码
+    if name == "SELECT" and len(args) == 2:
+        state["db"] = int(args[1])
+        return b"+OK\r\n"
+    if name == "GET" and len(args) == 2:
+        return _bulk(store.get(state["db"], args[1]))
+    if name == "SET" and len(args) >= 3:
+        expires = None
+        opts = [a.upper() for a in args[3:]]
+        if len(opts) == 2 and opts[0] in (b"EX", b"PX"):
+            seconds = int(opts[1]) / (1000 if opts[0] == b"PX" else 1)
+            expires = time.monotonic() + seconds
+        elif opts:
+            return b"-ERR syntax error\r\n"
+        db[args[1]] = (args[2], expires)
+        return b"+OK\r\n"
+    if name in ("DEL", "EXISTS") and len(args) >= 2:
+        found = [k for k in args[1:] if store.get(state["db"], k) is not None]
+        if name == "DEL":
+            for k in found:
+                db.pop(k, None)
+        return b":%d\r\n" % len(found)
+    if name == "DBSIZE":
+        return b":%d\r\n" % len(db)
+    if name == "FLUSHDB":
+        db.clear()
+        return b"+OK\r\n"
+    if name == "FLUSHALL":
+        store.dbs.clear()
+        return b"+OK\r\n"
+    if name == "INFO":
+        keys = sum(len(d) for d in store.dbs.values())
+        info = f"# Server\r\nresp_server:1\r\nkeys:{keys}\r\ncommands:{store.commands}\r\n"
+        return _bulk(info.encode())
+    return b"-ERR unknown command '%s'\r\n" % args[0][:32]
+
+
+async def serve(host: str, port: int, latency_ms: float = 0.0) -> None:
+    store = RespStore()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        state = {"db": 0}
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                if args[0].upper() == b"QUIT":
+                    writer.write(b"+OK\r\n")
+                    break
+                if latency_ms:
+                    await asyncio.sleep(latency_ms / 1000)
+                try:
+                    writer.write(_execute(store, state, args))
+                except ValueError:
+                    writer.write(b"-ERR value is not an integer or out of range\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"resp stand-in listening on {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="本地 Redis 协议替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每条命令附加的延迟（模拟网络往返）")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency_ms))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+启动异步 HTTP 推理服务（见 src/http_service.py）
+
+用法：
+    python scripts/serve_api.py --port 8600
+    python scripts/serve_api.py --stub 0.8 --max-inflight 8     # 假后端，每次 0.8 秒
+
+    curl -F image=@fabric.jpg -F lang=en http://127.0.0.1:8600/v1/analyze
+    curl -F image=@a.jpg -F image=@b.jpg http://127.0.0.1:8600/v1/analyze/stream
+"""
+
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.http_service import MAX_BATCH, MAX_BODY_MB, MAX_INFLIGHT, MAX_QUEUE  # noqa: E402
+from src.http_service import create_app, stub_backend, web  # noqa: E402
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="异步 HTTP 推理服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--stub", type=float, default=0.0, help="用固定耗时（秒）的假后端代替 cloud_infer")
+    parser.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT, help="同时分析的图片数")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="可排队的图片数，超出返回 429")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="单个批量请求的最大图片数")
+    parser.add_argument("--max-body-mb", type=float, default=MAX_BODY_MB, help="请求体上限（MB）")
+    args = parser.parse_args(argv)
+
+    if web is None:
+        print("aiohttp 未安装。请运行: pip install aiohttp", file=sys.stderr)
+        return 1
+    app = create_app(stub_backend(args.stub) if args.stub else None, max_inflight=args.max_inflight,
+                     max_queue=args.max_queue, max_batch=args.max_batch,
+                     max_body_mb=args.max_body_mb)
+    web.run_app(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+追踪 span 汇总：各阶段耗时分布 + 最慢的 trace
+
+读取 src/utils/tracing.py 写出的 JSONL（默认 TRACE_DIR 下的 spans.jsonl 及轮转文件），输出：
+- 各阶段（span 名）的次数、p50 / p95 / 最大 / 合计耗时，可按属性再分组（如 --by task_type）
+- 最慢的 N 个 trace，每个展开为 span 树（相对根的开始偏移 + 耗时）
+- span 带内存属性时（MEMTRACE 开启，见 src/utils/memtrace.py）：各阶段内存峰值表和增长最多的分配位置
+
+用法：
+    python scripts/trace_report.py                       # 全部 trace
+    python scripts/trace_report.py --root analysis       # 只看页面分析（根 span 名）
+    python scripts/trace_report.py --since 2 --top 5     # 最近 2 小时，最慢 5 个
+    python scripts/trace_report.py --by task_type        # 各阶段按 task_type 分组
+    python scripts/trace_report.py --trace 4bf92f3577b34da6a3ce929d0e0e4736
+    python scripts/trace_report.py logs/traces/spans.jsonl.1 other-host/spans.jsonl
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.utils.tracing import TRACE_DIR  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def span_files(paths: List[str]) -> List[Path]:
+    """参数为空时取 TRACE_DIR 下的 spans.jsonl*；目录展开为其中的 spans.jsonl*"""
+    out: List[Path] = []
+    for p in [Path(x) for x in paths] or [TRACE_DIR]:
+        out.extend(sorted(p.glob("spans.jsonl*")) if p.is_dir() else [p])
+    return [p for p in out if p.is_file()]
+
+
+def load_spans(files: Iterable[Path], since_ns: int = 0) -> List[Dict]:
+    spans = []
+    for path in files:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    s = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 进程被杀时可能留下半行
+                if s.get("end_time_unix_nano") and s["start_time_unix_nano"] >= since_ns:
+                    spans.append(s)
+    return spans
+
+
+def group_traces(spans: List[Dict]) -> Dict[str, List[Dict]]:
+    traces: Dict[str, List[Dict]] = defaultdict(list)
+    for s in spans:
+        traces[s["trace_id"]].append(s)
+    return traces
+
+
+def trace_root(spans: List[Dict]) -> Optional[Dict]:
+    ids = {s["span_id"] for s in spans}
+    roots = [s for s in spans if not s.get("parent_span_id") or s["parent_span_id"] not in ids]
+    return min(roots, key=lambda s: s["start_time_unix_nano"]) if roots else None
+
+
+def trace_duration_ms(spans: List[Dict]) -> float:
+    root = trace_root(spans)
+    if root is not None and not root.get("parent_span_id"):
+        return root["duration_ms"]
+    # 根 span 还没写出（分析未结束 / 其它进程）：按最早开始到最晚结束计算
+    end = max(s["end_time_unix_nano"] for s in spans)
+    return (end - min(s["start_time_unix_nano"] for s in spans)) / 1e6
+
+
+def stage_table(traces: Dict[str, List[Dict]], by: Optional[str]) -> List[str]:
+    """各阶段耗时分布；by 为属性名时按 (阶段, 属性值) 分组，属性取 span 自身或其 trace 根"""
+    groups: Dict[tuple, List[float]] = defaultdict(list)
+    for spans in traces.values():
+        root = trace_root(spans) or {}
+        for s in spans:
+            key = (s["name"],)
+            if by:
+                value = s.get("attributes", {}).get(by, root.get("attributes", {}).get(by, "-"))
+                key = (s["name"], str(value))
+            groups[key].append(s["duration_ms"])
+    header = f"{'stage':<16}" + (f"{by:<14}" if by else "") + \
+        f"{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}"
+    lines = [header, "-" * len(header)]
+    for key, durations in sorted(groups.items(), key=lambda kv: -sum(kv[1])):
+        p50, p95 = percentile(durations, 50), percentile(durations, 95)
+        lines.append(f"{key[0]:<16}" + (f"{key[1][:13]:<14}" if by else "")
+                     + f"{len(durations):>7}{p50:>10.1f}{p95:>10.1f}"
+                     f"{max(durations):>10.1f}{sum(durations) / 1000:>10.2f}")
+    return lines
+
+
+def memory_table(traces: Dict[str, List[Dict]], top: int = 5) -> List[str]:
+    """
+    各阶段内存（MEMTRACE 开启时 span 带内存属性）：tracemalloc 峰值 / 存活增量、RSS 峰值上涨，
+    以及各阶段累计增长最多的分配位置（来自 mem_top）。没有内存属性时返回空列表。
+    """
+    peaks: Dict[str, List[float]] = defaultdict(list)
+    deltas: Dict[str, List[float]] = defaultdict(list)
+    hwm: Dict[str, List[float]] = defaultdict(list)
+    sites: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for spans in traces.values():
+        for s in spans:
+            a = s.get("attributes", {})
+            if "mem_peak_bytes" in a:
+                peaks[s["name"]].append(a["mem_peak_bytes"] / 1048576)
+                deltas[s["name"]].append(a.get("mem_delta_bytes", 0) / 1048576)
+            if "rss_hwm_growth_bytes" in a:
+                hwm[s["name"]].append(a["rss_hwm_growth_bytes"] / 1048576)
+            for site, size, _count in a.get("mem_top", []):
+                sites[s["name"]][site] += size
+    stages = set(peaks) | set(hwm)
+    if not stages:
+        return []
+    header = f"{'stage':<16}{'count':>7}{'peak p50 MB':>13}{'peak p95 MB':>13}{'peak max MB':>13}" \
+             f"{'kept max MB':>13}{'rss hwm+ MB':>13}"
+    lines = [header, "-" * len(header)]
+    for stage in sorted(stages, key=lambda n: -max(peaks.get(n) or hwm.get(n) or [0])):
+        p, d, h = peaks.get(stage, []), deltas.get(stage, []), hwm.get(stage, [])
+        lines.append(f"{stage:<16}{max(len(p), len(h)):>7}"
+                     + (f"{percentile(p, 50):>13.2f}{percentile(p, 95):>13.2f}"
+                        f"{max(p):>13.2f}{max(d):>13.2f}" if p else f"{'-':>13}" * 4)
+                     + (f"{sum(h):>13.2f}" if h else f"{'-':>13}"))
+    for stage, by_site in sorted(sites.items()):
+        lines.append(f"\ntop allocation sites: {stage}")
+        for site, size in sorted(by_site.items(), key=lambda kv: -kv[1])[:top]:
+            lines.append(f"  {size / 1024:>10.1f} KB  {site}")
+    return lines
+
+
+def trace_tree(spans: List[Dict]) -> List[str]:
+    """span 树：相对最早 span 的开始偏移 + 耗时 + 主要属性"""
+    children: Dict[Optional[str], List[Dict]] = defaultdict(list)
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s.get("parent_span_id")
+        children[parent if parent in ids else None].append(s)
+    t0 = min(s["start_time_unix_nano"] for s in spans)
+    lines: List[str] = []
+
+    def walk(s: Dict, depth: int) -> None:
+        attrs = {k: v for k, v in s.get("attributes", {}).items()
+                 if not isinstance(v, (list, dict))}
+        status = s.get("status", {})
+        error = f"  ERROR {status.get('message', '')}" if status.get("code") == "ERROR" else ""
+        offset = (s["start_time_unix_nano"] - t0) / 1e6
+        name = f"{'  ' * depth}{s['name']:<{max(1, 18 - 2 * depth)}}"
+        lines.append(f"  {name} +{offset:>8.1f}ms {s['duration_ms']:>9.1f}ms"
+                     f"  {json.dumps(attrs, ensure_ascii=False)[:100] if attrs else ''}{error}")
+        for child in sorted(children[s["span_id"]], key=lambda c: c["start_time_unix_nano"]):
+            walk(child, depth + 1)
+
+    for root in sorted(children[None], key=lambda c: c["start_time_unix_nano"]):
+        walk(root, 0)
+    return lines
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="追踪 span 汇总报告")
+    parser.add_argument("paths", nargs="*", help="span 文件或目录（默认 TRACE_DIR）")
+    parser.add_argument("--root", default="",
+                        help="只统计根 span 为该名称的 trace（如 analysis / http_request）")
+    parser.add_argument("--since", type=float, default=0, help="只看最近多少小时")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的 trace 数")
+    parser.add_argument("--by", default="", help="各阶段按该属性再分组（如 task_type / engine / lane）")
+    parser.add_argument("--trace", default="", help="只展开这个 trace_id")
+    args = parser.parse_args(argv)
+
+    files = span_files(args.paths)
+    if not files:
+        print("no span files found", file=sys.stderr)
+        return 1
+    since_ns = int((time.time() - args.since * 3600) * 1e9) if args.since else 0
+    traces = group_traces(load_spans(files, since_ns))
+
+    if args.trace:
+        spans = traces.get(args.trace)
+        if not spans:
+            print(f"trace {args.trace} not found", file=sys.stderr)
+            return 1
+        print(f"trace {args.trace}  {trace_duration_ms(spans):.1f}ms  {len(spans)} spans")
+        print("\n".join(trace_tree(spans)))
+        return 0
+
+    if args.root:
+        traces = {tid: spans for tid, spans in traces.items()
+                  if (trace_root(spans) or {}).get("name") == args.root}
+    if not traces:
+        print("no matching traces", file=sys.stderr)
+        return 1
+
+    durations = [trace_duration_ms(spans) for spans in traces.values()]
+    n_spans = sum(len(s) for s in traces.values())
+    print(f"{len(traces)} traces, {n_spans} spans from {len(files)} file(s)")
+    print(f"trace latency  p50 {percentile(durations, 50):.1f}ms"
+          f"  p95 {percentile(durations, 95):.1f}ms  max {max(durations):.1f}ms")
+    print()
+    print("\n".join(stage_table(traces, args.by or None)))
+    memory = memory_table(traces)
+    if memory:
+        print("\nmemory by stage (MEMTRACE)")
+        print("\n".join(memory))
+
+    slowest = sorted(traces.items(), key=lambda kv: -trace_duration_ms(kv[1]))[:args.top]
+    print(f"\nslowest {len(slowest)} traces")
+    for trace_id, spans in slowest:
+        root = trace_root(spans) or {}
+        print(f"\n{trace_id}  {root.get('name', '?')}  {trace_duration_ms(spans):.1f}ms")
+        print("\n".join(trace_tree(spans)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
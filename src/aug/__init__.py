@@ -1,9 +1,27 @@
 # -*- coding: utf-8 -*-
 """
 增强模块：Web 搜索和验证
+
+导出的名字在第一次访问时才导入对应子模块（PEP 562），
+`from src.aug.prefetch import ...` 等不会顺带加载联网检索依赖。
 """
 
-from .web_search import search_snippets, fetch_readable
+import importlib
+
+_EXPORTS = {
+    "search_snippets": ".web_search",
+    "fetch_readable": ".web_search",
+    "read_pages": ".page_reader",
+    "pack_evidence": ".evidence_pack",
+    "EvidencePrefetcher": ".prefetch",
+}
+
+__all__ = list(_EXPORTS)
 
-__all__ = ["search_snippets", "fetch_readable"]
 
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
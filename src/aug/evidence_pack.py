@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+证据后处理：近重复去除 + 相关性排序 + Token 预算打包
+
+DDG、Wikipedia、百度百科返回的片段高度重叠，原样注入会让提示词膨胀、生成变慢。
+处理流程：
+1. 字符 5-gram 分片（shingling），MinHash 估计 Jaccard 相似度，去掉近重复片段
+2. 以候选标签为查询，在片段集合内做 BM25 打分排序
+3. 按相关性依次装入固定 token 预算，最后一条放不下时截断
+
+注意：当前识别流程只有一次视觉模型调用，证据在模型给出标签之后才检索，
+没有后续的提示词可注入。因此打包结果目前只用于展示：prefetch.finalize()
+把 text 写入 result["evidence"] 供界面显示，stats 写入 _meta["evidence"]。
+输出格式保持可直接拼进提示词，将来增加基于证据的二次生成时可原样使用。
+
+用法：
+    from src.aug.evidence_pack import pack_evidence
+
+    packed = pack_evidence(items, label="涤纶斜纹", budget_tokens=600)
+    st.markdown(packed["text"])
+    print(packed["stats"])  # {"raw_tokens": 2310, "packed_tokens": 587, ...}
+"""
+
+from __future__ import annotations
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from .fabric_kb import tokenize
+
+# MinHash 参数
+NUM_PERM = 32
+SHINGLE_SIZE = 5
+MAX_SHINGLE_CHARS = 1500
+_MERSENNE = (1 << 61) - 1
+_PERMS = [
+    (int.from_bytes(hashlib.blake2b(b"a%d" % i, digest_size=8).digest(), "little") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(b"b%d" % i, digest_size=8).digest(), "little") % _MERSENNE)
+    for i in range(NUM_PERM)
+]
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_WS_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日韩字符按 1 字 1 token，其余按 4 字符 1 token。
+
+    Args:
+        text: 任意文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _normalize(text: str) -> str:
+    return _WS_RE.sub(" ", (text or "").lower()).strip()
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """字符 n-gram 分片（对中英文都适用）"""
+    t = _normalize(text)[:MAX_SHINGLE_CHARS]
+    if len(t) <= size:
+        return {t} if t else set()
+    return {t[i:i + size] for i in range(len(t) - size + 1)}
+
+
+def minhash(sh: Set[str]) -> List[int]:
+    """计算 MinHash 签名"""
+    if not sh:
+        return [_MERSENNE] * NUM_PERM
+    base = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+            for s in sh]
+    return [min((a * h + b) % _MERSENNE for h in base) for a, b in _PERMS]
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """MinHash 签名估计的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _item_text(item: Dict[str, str]) -> str:
+    return item.get("content") or item.get("snippet") or ""
+
+
+def _bm25_rank(query: str, texts: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """在候选片段集合内部做 BM25 打分"""
+    q_terms = set(tokenize(query))
+    docs = [Counter(tokenize(t)) for t in texts]
+    n = len(docs)
+    if not q_terms or not n:
+        return [0.0] * n
+    lens = [sum(d.values()) for d in docs]
+    avgdl = (sum(lens) / n) or 1.0
+    scores = []
+    for d, dl in zip(docs, lens):
+        s = 0.0
+        for term in q_terms:
+            tf = d.get(term, 0)
+            if not tf:
+                continue
+            df = sum(1 for x in docs if term in x)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            s += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        scores.append(s)
+    return scores
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    """按估算 token 数截断文本"""
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…"
+
+
+def pack_evidence(
+    items: List[Dict[str, str]],
+    label: str,
+    budget_tokens: int = 600,
+    dup_threshold: float = 0.6,
+    min_chunk_tokens: int = 40,
+    aliases: Optional[List[str]] = None,
+) -> Dict[str, object]:
+    """
+    去重、排序并把证据打包进固定 token 预算。
+
+    Args:
+        items: web_evidence / kb_evidence 返回的证据列表
+        label: 候选面料标签（相关性排序的查询）
+        budget_tokens: 打包后的 token 上限
+        dup_threshold: MinHash 相似度 ≥ 该值视为近重复
+        min_chunk_tokens: 剩余预算小于该值时不再截断装入
+        aliases: 额外的查询词（如标签的中英文同义词）
+
+    Returns:
+        {
+            "items": [...],          # 装入的证据（按相关性排序，可能被截断）
+            "text": "...",           # 编号证据文本（目前用于界面展示，格式可直接注入提示词）
+            "stats": {"raw_items", "dedup_items", "packed_items",
+                      "raw_tokens", "dedup_tokens", "packed_tokens", "budget_tokens"}
+        }
+    """
+    items = [it for it in items if _item_text(it)]
+    texts = [_item_text(it) for it in items]
+    raw_tokens = sum(estimate_tokens(t) for t in texts)
+
+    # 1) 相关性排序（先排序再去重，重复组里保留最相关的一条）
+    query = " ".join([label] + list(aliases or []))
+    scores = _bm25_rank(query, texts)
+    order = sorted(range(len(items)), key=lambda i: scores[i], reverse=True)
+
+    # 2) MinHash 近重复过滤
+    kept: List[int] = []
+    sigs: Dict[int, List[int]] = {}
+    for i in order:
+        sig = minhash(shingles(texts[i]))
+        if any(similarity(sig, sigs[j]) >= dup_threshold for j in kept):
+            continue
+        sigs[i] = sig
+        kept.append(i)
+    dedup_tokens = sum(estimate_tokens(texts[i]) for i in kept)
+
+    # 3) 预算打包
+    packed: List[Dict[str, str]] = []
+    lines: List[str] = []
+    used = 0
+    for i in kept:
+        it = items[i]
+        head = f"[{len(packed) + 1}] {it.get('title', '')}: "
+        cost_head = estimate_tokens(head)
+        remaining = budget_tokens - used - cost_head
+        if remaining <= 0:
+            break
+        body = texts[i]
+        if estimate_tokens(body) > remaining:
+            if remaining < min_chunk_tokens:
+                break
+            body = _truncate_to_tokens(body, remaining)
+        line = head + body
+        used += estimate_tokens(line)
+        lines.append(line)
+        packed.append(dict(it, snippet=body, score=round(scores[i], 4)))
+
+    return {
+        "items": packed,
+        "text": "\n".join(lines),
+        "stats": {
+            "raw_items": len(items),
+            "dedup_items": len(kept),
+            "packed_items": len(packed),
+            "raw_tokens": raw_tokens,
+            "dedup_tokens": dedup_tokens,
+            "packed_tokens": used,
+            "budget_tokens": budget_tokens,
+        },
+    }
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+面料/组织名称规范化（中英同义词、大小写、常见缩写）
+
+web_evidence 直接用原始标签拼查询串，"涤纶"、"polyester"、"Polyester fabric"、
+"PES" 彼此都是缓存未命中。本模块把标签映射为统一的规范键，检索和缓存都基于
+规范键进行。
+
+规则：
+1. NFKC 归一、转小写、去掉"面料/fabric"等通用后缀
+2. 整串命中别名表 → 直接返回规范键（整串优先于切分）
+3. 否则按"纤维 + 组织"切分：在所有切分里取未识别部分最少、其次片段最少（最长匹配）的一种，
+   拼成复合键，如 "涤纶斜纹面料" → "polyester_twill"
+4. 切分后仍有未识别的部分（如 "羊毛混纺"、"真丝绒"）或完全无法识别时返回 None：
+   只认出一部分就归到某个纤维上，会把不同面料合并成同一个检索/缓存键
+5. 三个字母以内的英文缩写（"co"、"se"、"pan"、"net"）只在整串就是该缩写时生效，
+   不参与切分（"Pan Am" 不是腈纶）
+
+检索和缓存用 label_key()：可识别时为规范键，否则为归一化原串。
+
+别名来源：src/aug/data/fabric_aliases.json（纤维/组织/成品面料）
+以及内置词汇表 fabric_glossary.json 中的条目。
+
+用法：
+    from src.aug.fabric_alias import canonicalize, canonical_name
+
+    key = canonicalize("PES")            # "polyester"
+    canonical_name(key, "zh")            # "涤纶"
+    canonicalize("羊毛混纺")              # None（"混纺" 无法识别）
+    label_key("羊毛混纺")                 # "羊毛混纺"
+"""
+
+from __future__ import annotations
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+ALIAS_PATH = Path(__file__).parent / "data" / "fabric_aliases.json"
+GLOSSARY_PATH = Path(__file__).parent / "data" / "fabric_glossary.json"
+
+# 复合键中各部分的排列顺序
+_KIND_ORDER = {"fiber": 0, "weave": 1, "fabric": 2}
+
+# 通用后缀/修饰词（不影响面料身份）
+_GENERIC_EN = {"fabric", "fabrics", "cloth", "material", "materials", "textile", "textiles"}
+_GENERIC_ZH = ("面料", "布料", "材质", "织物", "材料")
+
+_SPLIT_RE = re.compile(r"[\s_\-/,，、;；:：()（）\[\]【】]+")
+_RUN_RE = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9%.]+(?: [a-z0-9%.]+)*")
+_MAX_PHRASE_WORDS = 3
+# 成分比例（"95%"、"100"）不算未识别部分
+_NEUTRAL_RE = re.compile(r"\d+(?:\.\d+)?%?")
+# 不超过该长度的纯字母别名视为缩写，只整串匹配
+_CODE_MAX_LEN = 3
+
+
+def normalize(label: str) -> str:
+    """NFKC 归一、转小写、统一分隔符并去掉通用后缀"""
+    s = unicodedata.normalize("NFKC", label or "").lower()
+    for suffix in _GENERIC_ZH:
+        s = s.replace(suffix, " ")
+    words = [w for w in _SPLIT_RE.split(s) if w and w not in _GENERIC_EN]
+    return " ".join(words)
+
+
+@lru_cache(maxsize=1)
+def _tables() -> Tuple[Dict[str, str], Dict[str, Dict[str, str]], Set[str]]:
+    """
+    加载别名表。
+
+    Returns:
+        (alias -> key, key -> {"zh", "en", "kind"}, 缩写集合)
+    """
+    alias_to_key: Dict[str, str] = {}
+    entries: Dict[str, Dict[str, str]] = {}
+
+    def _add(key: str, kind: str, zh: str, en: str, aliases: List[str]) -> None:
+        if key not in entries:
+            entries[key] = {"zh": zh, "en": en, "kind": kind}
+        for name in [zh, en, key.replace("_", " ")] + list(aliases):
+            norm = normalize(name)
+            if norm and norm not in alias_to_key:
+                alias_to_key[norm] = key
+
+    with open(ALIAS_PATH, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for kind in ("fiber", "weave", "fabric"):
+        for key, e in data.get(kind, {}).items():
+            _add(key, kind, e["zh"], e["en"], e.get("aliases", []))
+
+    # 词汇表条目作为成品面料补充（不覆盖上面的别名）
+    try:
+        with open(GLOSSARY_PATH, "r", encoding="utf-8") as f:
+            for e in json.load(f):
+                _add(e["id"], "fabric", e["zh"], e["en"], e.get("aliases", []))
+    except (OSError, ValueError):
+        pass
+
+    codes = {a for a, key in alias_to_key.items()
+             if a.isascii() and a.isalpha() and len(a) <= _CODE_MAX_LEN
+             and a not in (key, entries[key]["en"])}
+    return alias_to_key, entries, codes
+
+
+def _best_split(tokens: List[str], sep: str, max_len: int) -> Tuple[int, List[str]]:
+    """
+    把词元序列切分为别名：未识别的词元最少，其次片段最少（即尽量长的匹配）。
+
+    Args:
+        tokens: 中文为单字，英文为单词
+        sep: 拼接词元的分隔符（中文 ""，英文 " "）
+        max_len: 单个别名最多包含的词元数
+
+    Returns:
+        (未识别词元数, 规范键列表)
+    """
+    alias_to_key, _, codes = _tables()
+    n = len(tokens)
+    # best[i]：前 i 个词元的最优切分 (未识别数, 片段数, 键列表)
+    best: List[Tuple[int, int, List[str]]] = [(0, 0, [])] + [(n + 1, n + 1, [])] * n
+    for i in range(n):
+        miss, segs, keys = best[i]
+        neutral = sep == " " and _NEUTRAL_RE.fullmatch(tokens[i])
+        skip = (miss + (0 if neutral else 1), segs, keys)
+        if skip[:2] < best[i + 1][:2]:
+            best[i + 1] = skip
+        for j in range(i + 1, min(n, i + max_len) + 1):
+            alias = sep.join(tokens[i:j])
+            key = alias_to_key.get(alias)
+            if key and alias not in codes:
+                cand = (miss, segs + 1, keys + [key])
+                if cand[:2] < best[j][:2]:
+                    best[j] = cand
+    return best[n][0], best[n][2]
+
+
+def _segment(text: str) -> Optional[List[str]]:
+    """把归一化文本切分为已知别名对应的规范键；有无法识别的部分时返回 None"""
+    alias_to_key, _, _ = _tables()
+    keys: List[str] = []
+    for m in _RUN_RE.finditer(text):
+        run = m.group(0)
+        if run in alias_to_key:  # 整段命中优先（如 "真丝缎" 不拆成 真丝 + 缎）
+            keys.append(alias_to_key[run])
+            continue
+        if run[0] >= "\u4e00":
+            miss, run_keys = _best_split(list(run), "", len(run))
+        else:
+            # 英文按词组（最多 3 个词）匹配，避免 "co" 误匹配 "cotton"
+            miss, run_keys = _best_split(run.split(" "), " ", _MAX_PHRASE_WORDS)
+        if miss:
+            return None
+        keys.extend(run_keys)
+    return keys
+
+
+@lru_cache(maxsize=4096)
+def canonicalize(label: str) -> Optional[str]:
+    """
+    标签 → 规范键。
+
+    Args:
+        label: 模型输出或用户输入的面料名称（中/英/缩写均可）
+
+    Returns:
+        规范键，如 "polyester"、"silk_satin"；为空、无法识别或含无法识别的部分时返回 None
+    """
+    text = normalize(label)
+    if not text:
+        return None
+    alias_to_key, entries, _ = _tables()
+    if text in alias_to_key:
+        return alias_to_key[text]
+
+    parts = _segment(text)
+    if not parts:
+        return None
+    parts = list(dict.fromkeys(parts))
+    # 已是复合面料（如 denim）时直接返回，不再与其它部分拼接
+    fabrics = [p for p in parts if entries.get(p, {}).get("kind") == "fabric"]
+    if fabrics:
+        return fabrics[0]
+    parts.sort(key=lambda p: _KIND_ORDER.get(entries.get(p, {}).get("kind", "fabric"), 2))
+    return "_".join(parts)
+
+
+def canonical_name(key: str, lang: str = "zh") -> str:
+    """
+    规范键 → 用于检索的显示名称。
+
+    Args:
+        key: canonicalize() 返回的规范键
+        lang: 语言代码（"zh" 或 "en"）
+
+    Returns:
+        该语言下的名称，如 ("polyester_twill", "zh") → "涤纶斜纹"
+    """
+    _, entries, _ = _tables()
+    field = "zh" if lang.startswith("zh") else "en"
+    if key in entries:
+        return entries[key][field]
+    parts = key.split("_")
+    if len(parts) > 1 and all(p in entries for p in parts):
+        sep = "" if field == "zh" else " "
+        return sep.join(entries[p][field] for p in parts)
+    return key.replace("_", " ")
+
+
+def label_key(label: str) -> str:
+    """
+    检索 / 缓存用的键：可识别时为规范键，否则为归一化原串（不与其它面料合并）。
+
+    Args:
+        label: 面料名称
+
+    Returns:
+        规范键或归一化原串（空标签为 ""）
+    """
+    return canonicalize(label) or normalize(label)
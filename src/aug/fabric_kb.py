@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+离线面料知识库（BM25 倒排索引，中英双语）
+
+大多数证据查询集中在少数常见面料（涤纶斜纹、真丝缎、粘胶汗布……），
+每次都走 web_evidence 联网既慢又不稳定。本模块在进程内先查本地知识库，
+只有未命中时才回退到网络搜索。
+
+数据来源：
+- 内置词汇表：src/aug/data/fabric_glossary.json
+- 历史联网结果：web_evidence 命中后追加写入的 JSONL 缓存（按 URL 去重；比索引新时下次启动自动重建）
+
+索引格式（小端、4 字节对齐，可直接 mmap）：
+    header | doc_len[u32] | doc_off[u32] | doc_blob | term_off[u32] | term_blob
+           | post_off[u32] | postings[(doc u32, tf u32)]
+词项按字节序排序，查询时二分查找，不需要把整个索引反序列化到内存。
+
+用法：
+    python -m src.aug.fabric_kb build            # 重建索引
+    python -m src.aug.fabric_kb query 涤纶斜纹    # 调试查询
+
+    from src.aug.fabric_kb import kb_evidence
+    items = kb_evidence("polyester twill", lang="en")
+"""
+
+from __future__ import annotations
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# ==================== 路径配置 ====================
+GLOSSARY_PATH = Path(__file__).parent / "data" / "fabric_glossary.json"
+KB_DIR = Path(os.getenv("FABRIC_KB_DIR", "cache/fabric_kb"))
+INDEX_PATH = KB_DIR / "index.fkb"
+WEB_CACHE_PATH = KB_DIR / "web_cache.jsonl"
+
+MAGIC = b"FKB1"
+VERSION = 2  # 2: 文档侧中文同时保留单字词项
+# magic, version, n_docs, n_terms, avgdl, 7 个分区的起始偏移
+_HEADER = struct.Struct("<4sIIIf7Q")
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# ==================== 分词 ====================
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "the", "to", "with", "its", "be", "than",
+}
+
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """
+    中英混合分词：英文按单词小写，中文按字符二元组（单字词保留单字）。
+
+    Args:
+        text: 任意文本
+        unigrams: 中文连续片段额外输出单字词项。建索引时开启，
+            这样单字查询（如 "棉"）能命中只以多字形式出现的文档
+
+    Returns:
+        词项列表（保留重复，用于统计词频）
+    """
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        tok = m.group(0)
+        if tok[0] < "\u4e00":
+            if tok not in _STOPWORDS:
+                out.append(tok)
+        elif len(tok) == 1:
+            out.append(tok)
+        else:
+            out.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+            if unigrams:
+                out.extend(tok)
+    return out
+
+
+# ==================== 数据源 ====================
+def load_glossary(path: Path = GLOSSARY_PATH) -> List[Dict[str, str]]:
+    """内置词汇表 → 文档列表（每个条目拆成中英文两篇）"""
+    docs = []
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    for e in entries:
+        keywords = " ".join([e["zh"], e["en"]] + e.get("aliases", []))
+        url = f"kb://glossary/{e['id']}"
+        docs.append({
+            "title": f"{e['zh']}（{e['en']}）",
+            "url": url,
+            "snippet": e["text_zh"],
+            "lang": "zh",
+            "keywords": keywords,
+        })
+        docs.append({
+            "title": f"{e['en']} ({e['zh']})",
+            "url": url,
+            "snippet": e["text_en"],
+            "lang": "en",
+            "keywords": keywords,
+        })
+    return docs
+
+
+def load_web_cache(path: Path = WEB_CACHE_PATH) -> List[Dict[str, str]]:
+    """读取历史联网结果（同一 URL 只保留最新一条）"""
+    if not path.exists():
+        return []
+    by_url: Dict[str, Dict[str, str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except Exception:
+                continue
+            if not r.get("url") or not r.get("snippet"):
+                continue
+            by_url[r["url"]] = {
+                "title": r.get("title", ""),
+                "url": r["url"],
+                "snippet": r["snippet"],
+                "lang": r.get("lang", "zh"),
+                "keywords": r.get("label", ""),
+            }
+    return list(by_url.values())
+
+
+# 已写入联网缓存的 URL（按文件路径，首次写入时从文件加载）
+_recorded: Dict[Path, set] = {}
+_recorded_lock = threading.Lock()
+
+
+def _recorded_urls(path: Path) -> set:
+    urls = _recorded.get(path)
+    if urls is None:
+        urls = _recorded[path] = {d["url"] for d in load_web_cache(path)}
+    return urls
+
+
+def record_web_results(label: str, lang: str, items: Iterable[Dict[str, str]],
+                       path: Path = WEB_CACHE_PATH) -> None:
+    """
+    把联网检索结果追加到 JSONL 缓存，供下次构建索引时纳入。
+
+    同一 URL 只记录一次：重复查询（含检索函数 TTL 缓存命中）不会让缓存文件增长。
+    """
+    lines = []
+    with _recorded_lock:
+        seen = _recorded_urls(path)
+        for it in items:
+            url = it.get("url")
+            if not url or not it.get("snippet") or url.startswith("kb://") or url in seen:
+                continue
+            seen.add(url)
+            lines.append(json.dumps({
+                "label": label,
+                "lang": "zh" if lang.startswith("zh") else "en",
+                "title": it.get("title", ""),
+                "url": url,
+                "snippet": it["snippet"],
+            }, ensure_ascii=False))
+        if not lines:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            pass
+
+
+# ==================== 构建 ====================
+def _u32(values: Iterable[int]) -> bytes:
+    arr = array("I", values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _pad4(buf: bytearray) -> None:
+    buf.extend(b"\0" * (-len(buf) % 4))
+
+
+def build_index(docs: List[Dict[str, str]], path: Path = INDEX_PATH) -> Path:
+    """
+    从文档列表构建 BM25 倒排索引并写入二进制文件。
+
+    Args:
+        docs: [{"title", "url", "snippet", "lang", "keywords"}, ...]
+        path: 输出路径
+
+    Returns:
+        索引文件路径
+    """
+    doc_lens: List[int] = []
+    postings: Dict[str, List[tuple]] = {}
+    blobs: List[bytes] = []
+    for doc_id, d in enumerate(docs):
+        tf = Counter(tokenize(" ".join([d.get("title", ""), d.get("keywords", ""),
+                                        d.get("snippet", "")]), unigrams=True))
+        doc_lens.append(sum(tf.values()))
+        for term, n in tf.items():
+            postings.setdefault(term, []).append((doc_id, n))
+        stored = {k: d.get(k, "") for k in ("title", "url", "snippet", "lang")}
+        blobs.append(json.dumps(stored, ensure_ascii=False).encode("utf-8"))
+
+    terms = sorted(postings, key=lambda t: t.encode("utf-8"))
+    avgdl = (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0
+
+    body = bytearray()
+    offsets = []
+
+    def _section(data: bytes) -> None:
+        offsets.append(_HEADER.size + len(body))
+        body.extend(data)
+        _pad4(body)
+
+    doc_off = [0]
+    for b in blobs:
+        doc_off.append(doc_off[-1] + len(b))
+    term_bytes = [t.encode("utf-8") for t in terms]
+    term_off = [0]
+    for b in term_bytes:
+        term_off.append(term_off[-1] + len(b))
+    post_off = [0]
+    flat: List[int] = []
+    for t in terms:
+        for doc_id, n in postings[t]:
+            flat.extend((doc_id, n))
+        post_off.append(len(flat) // 2)
+
+    _section(_u32(doc_lens))
+    _section(_u32(doc_off))
+    _section(b"".join(blobs))
+    _section(_u32(term_off))
+    _section(b"".join(term_bytes))
+    _section(_u32(post_off))
+    _section(_u32(flat))
+
+    header = _HEADER.pack(MAGIC, VERSION, len(docs), len(terms), avgdl, *offsets)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 每次写入独立的临时文件：多个进程同时懒重建时不会互相覆盖半写的文件
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + ".", suffix=".tmp",
+                                     delete=False) as f:
+        tmp = f.name
+        try:
+            f.write(header)
+            f.write(body)
+        except BaseException:
+            f.close()
+            os.unlink(tmp)
+            raise
+    os.replace(tmp, path)
+    return path
+
+
+# ==================== 查询 ====================
+class FabricIndex:
+    """mmap 方式打开的只读 BM25 索引"""
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.n_docs, self.n_terms, self.avgdl,
+         *self._sec) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"不是有效的面料索引文件: {self.path}")
+        self._doc_len = self._array(0, self.n_docs)
+        self._doc_off = self._array(1, self.n_docs + 1)
+        self._term_off = self._array(3, self.n_terms + 1)
+        self._post_off = self._array(5, self.n_terms + 1)
+        self._postings = self._array(6, 2 * self._post_off[-1] if self.n_terms else 0)
+
+    def _array(self, section: int, count: int):
+        start = self._sec[section]
+        view = memoryview(self._mm)[start:start + 4 * count]
+        if sys.byteorder == "little":
+            return view.cast("I")
+        arr = array("I", view.tobytes())
+        arr.byteswap()
+        return arr
+
+    def close(self) -> None:
+        for name in ("_doc_len", "_doc_off", "_term_off", "_post_off", "_postings"):
+            v = getattr(self, name, None)
+            if isinstance(v, memoryview):
+                v.release()
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+        self._file.close()
+
+    def _term(self, i: int) -> bytes:
+        base = self._sec[4]
+        return self._mm[base + self._term_off[i]:base + self._term_off[i + 1]]
+
+    def _find(self, term: str) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self._term(lo) == key else -1
+
+    def doc(self, doc_id: int) -> Dict[str, str]:
+        base = self._sec[2]
+        raw = self._mm[base + self._doc_off[doc_id]:base + self._doc_off[doc_id + 1]]
+        return json.loads(raw.decode("utf-8"))
+
+    def search(self, query: str, k: int = 4, lang: Optional[str] = None) -> List[Dict[str, object]]:
+        """
+        BM25 检索。
+
+        Args:
+            query: 查询文本
+            k: 返回条数
+            lang: 只返回该语言（"zh"/"en"）的文档；None 表示不限
+
+        Returns:
+            [{"title", "url", "snippet", "lang", "score", "coverage"}, ...]
+            coverage 为文档命中的查询词项比例
+        """
+        q_terms = list(dict.fromkeys(tokenize(query)))
+        if not q_terms or not self.n_docs:
+            return []
+        scores: Dict[int, float] = {}
+        matched: Counter = Counter()
+        for term in q_terms:
+            ti = self._find(term)
+            if ti < 0:
+                continue
+            a, b = self._post_off[ti], self._post_off[ti + 1]
+            df = b - a
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            for j in range(a, b):
+                doc_id, tf = self._postings[2 * j], self._postings[2 * j + 1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc_id] / (self.avgdl or 1.0))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc_id] += 1
+
+        results = []
+        for doc_id in sorted(scores, key=scores.get, reverse=True):
+            d = self.doc(doc_id)
+            if lang and d.get("lang") != lang:
+                continue
+            d["score"] = round(scores[doc_id], 4)
+            d["coverage"] = round(matched[doc_id] / len(q_terms), 3)
+            results.append(d)
+            if len(results) >= k:
+                break
+        return results
+
+
+_index: Optional[FabricIndex] = None
+_index_lock = threading.Lock()
+
+
+def rebuild(index_path: Path = INDEX_PATH) -> Path:
+    """从内置词汇表 + 历史联网缓存重建索引"""
+    global _index
+    path = build_index(load_glossary() + load_web_cache(), index_path)
+    with _index_lock:
+        if _index is not None:
+            _index.close()
+        _index = None
+    return path
+
+
+def _index_stale(index_path: Path = INDEX_PATH) -> bool:
+    if not index_path.exists():
+        return True
+    try:
+        with open(index_path, "rb") as f:
+            if f.read(8) != MAGIC + struct.pack("<I", VERSION):
+                return True  # 旧版本格式
+    except OSError:
+        return True
+    built = index_path.stat().st_mtime
+    sources = [GLOSSARY_PATH] + ([WEB_CACHE_PATH] if WEB_CACHE_PATH.exists() else [])
+    return any(p.stat().st_mtime > built for p in sources)
+
+
+def get_index() -> Optional[FabricIndex]:
+    """获取进程内共享索引；索引文件不存在、或比词汇表 / 联网缓存旧时自动重建"""
+    global _index
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            try:
+                if _index_stale(INDEX_PATH):
+                    build_index(load_glossary() + load_web_cache(WEB_CACHE_PATH), INDEX_PATH)
+                _index = FabricIndex(INDEX_PATH)
+            except Exception:
+                _index = None
+    return _index
+
+
+def kb_evidence(label: str, lang: str = "zh", k: int = 4,
+                min_coverage: float = 0.6) -> List[Dict[str, str]]:
+    """
+    本地知识库证据查询（web_evidence 的进程内前置层）。
+
+    Args:
+        label: 面料名称
+        lang: 语言代码（"zh" 或 "en"）
+        k: 返回结果数量
+        min_coverage: 最佳结果需覆盖的查询词项比例，低于该值视为未命中
+
+    Returns:
+        [{"title": "...", "url": "...", "snippet": "...", "source": "kb"}, ...]；未命中返回 []
+    """
+    index = get_index()
+    if index is None:
+        return []
+    hits = index.search(label, k=k, lang="zh" if lang.startswith("zh") else "en")
+    if not hits or hits[0]["coverage"] < min_coverage:
+        return []
+    return [{"title": h["title"], "url": h["url"], "snippet": h["snippet"], "source": "kb"}
+            for h in hits if h["coverage"] >= min_coverage]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="离线面料知识库")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build", help="从词汇表和联网缓存重建索引")
+    q = sub.add_parser("query", help="查询索引")
+    q.add_argument("text")
+    q.add_argument("--lang", default="zh")
+    q.add_argument("-k", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        path = rebuild()
+        idx = FabricIndex(path)
+        print(f"{path}: {idx.n_docs} docs, {idx.n_terms} terms, {path.stat().st_size} bytes")
+        idx.close()
+        return 0
+
+    import time
+    index = get_index()
+    if index is None:
+        print("索引不可用")
+        return 1
+    t0 = time.perf_counter()
+    hits = index.search(args.text, k=args.k, lang=args.lang)
+    dt = (time.perf_counter() - t0) * 1000
+    for h in hits:
+        print(f"{h['score']:7.3f}  cov={h['coverage']:.2f}  {h['title']}  {h['url']}")
+    print(f"{len(hits)} hits in {dt:.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+并发网页正文读取（Top-k 结果全文）
+
+串行调用 fetch_readable 最坏需要 k × 8 秒。这里用线程池并发抓取，并提供：
+- 全局截止时间（deadline），到点立即返回已完成的结果
+- 按主机（host）的并发上限，避免同时压同一站点
+- 收集到足够文本（min_chars）后提前返回，剩余请求直接丢弃
+
+返回时进行中的请求不会被打断（线程无法强制终止），它们在后台线程里继续，直到各自的
+单请求时限（timeout，不超过派发时剩余的全局时间）到点后放弃；read_pages 本身按 deadline 返回。
+requests 的 timeout 只限制连接和每两次读之间的间隔，不限制总时长（慢慢吐字节的主机可以无限拖长），
+所以默认抓取函数流式读取正文并在每块之间检查总耗时；单次阻塞读仍可能多等一个 timeout。
+
+用法：
+    from src.aug.page_reader import read_pages
+
+    pages = read_pages(urls, deadline=10, per_host=2, min_chars=6000)
+    for p in pages:
+        print(p["url"], p["status"], len(p["text"]))
+"""
+
+from __future__ import annotations
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from src.utils.lazy_import import optional_import
+
+from .web_search import UA, html_to_text
+
+
+# 单个页面最多读取的字节数（正文只取前几千字，超大页面没必要读完）
+MAX_PAGE_BYTES = 2_000_000
+
+
+def _fetch_text(url: str, timeout: float) -> str:
+    """
+    默认抓取函数：流式 GET 页面并提取可读正文。
+
+    Args:
+        url: 页面地址
+        timeout: 总时限（秒），含连接与读取
+
+    Raises:
+        TimeoutError: 读取总耗时超过 timeout
+    """
+    requests = optional_import("requests")
+    if requests is None:
+        return ""
+    end = time.monotonic() + timeout
+    chunks: List[bytes] = []
+    size = 0
+    with requests.get(url, timeout=timeout, headers=UA, stream=True) as resp:
+        resp.raise_for_status()
+        # urllib3 >= 2.2 的 read1 有多少读多少；iter_content 会阻塞到凑满一块，慢速主机上检查不到总耗时
+        read1 = getattr(resp.raw, "read1", None)
+        if read1 is not None:
+            stream = iter(lambda: read1(16384, decode_content=True), b"")
+        else:
+            stream = resp.iter_content(1024)
+        for chunk in stream:
+            if time.monotonic() > end:
+                raise TimeoutError(f"read exceeded {timeout:.1f}s")
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= MAX_PAGE_BYTES:
+                break
+        encoding = resp.encoding or "utf-8"
+    return html_to_text(b"".join(chunks).decode(encoding, errors="replace"))
+
+
+def _host_of(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def read_pages(
+    urls: List[str],
+    deadline: float = 10.0,
+    per_host: int = 2,
+    max_workers: int = 6,
+    min_chars: int = 0,
+    timeout: float = 8.0,
+    fetch: Optional[Callable[[str, float], str]] = None,
+) -> List[Dict[str, object]]:
+    """
+    并发读取多个 URL 的正文。
+
+    Args:
+        urls: 待读取的 URL 列表（按优先级排序，越靠前越先派发）
+        deadline: 全局截止时间（秒），超时后不再等待未完成的请求
+        per_host: 同一主机的最大并发数
+        max_workers: 总并发数
+        min_chars: 累计正文达到该字符数后提前返回（0 表示读完全部）
+        timeout: 单个请求超时（秒），不会超过剩余的全局时间
+        fetch: 自定义抓取函数 fetch(url, timeout) -> text，便于测试/替换
+
+    Returns:
+        [{"url": "...", "text": "...", "status": "ok", "elapsed": 0.42}, ...]
+        仅包含已完成的 URL，顺序与输入一致。status 取值为 "ok"、"empty"（正文为空）
+        或 "error: <异常类型>"（如 "error: HTTPError"），判断失败请用 startswith("error")
+    """
+    fetch = fetch or _fetch_text
+    # 去重并保持顺序
+    pending = [u for u in dict.fromkeys(urls) if u]
+    if not pending:
+        return []
+
+    t0 = time.monotonic()
+    end = t0 + max(0.0, deadline)
+    host_load: Dict[str, int] = {}
+    running = {}
+    done_map: Dict[str, Dict[str, object]] = {}
+    collected = 0
+
+    def _task(url: str, budget: float) -> Dict[str, object]:
+        start = time.monotonic()
+        try:
+            text = fetch(url, budget) or ""
+            status = "ok" if text else "empty"
+        except Exception as e:
+            text, status = "", f"error: {type(e).__name__}"
+        return {"url": url, "text": text, "status": status,
+                "elapsed": round(time.monotonic() - start, 3)}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="page-reader")
+    try:
+        while pending or running:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+
+            # 派发：总并发和主机并发均未满时，按顺序取下一个可派发的 URL
+            i = 0
+            while i < len(pending) and len(running) < max_workers:
+                url = pending[i]
+                host = _host_of(url)
+                if host_load.get(host, 0) < per_host:
+                    pending.pop(i)
+                    host_load[host] = host_load.get(host, 0) + 1
+                    running[pool.submit(_task, url, min(timeout, remaining))] = (url, host)
+                else:
+                    i += 1
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running), timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                url, host = running.pop(fut)
+                host_load[host] -= 1
+                res = fut.result()
+                done_map[url] = res
+                collected += len(res["text"])
+
+            if min_chars and collected >= min_chars:
+                break
+    finally:
+        # 不等待慢请求：未开始的任务直接取消，进行中的由线程在各自的 timeout 内自行结束
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return [done_map[u] for u in dict.fromkeys(urls) if u in done_map]
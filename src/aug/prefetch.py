@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+推测式证据预取（与 VLM 调用重叠执行）
+
+证据检索依赖模型给出的面料名称，串行执行时检索延迟会直接叠加在 3-10 秒推理之上。
+EvidencePrefetcher 在模型调用进行中就开始检索"可能的标签"：
+- 流式输出中已经出现的 "material" / "weave_or_knit" 字段
+- 调用方提供的本地猜测（如同一张图上一次的分析结果）
+
+模型返回后按最终标签取用预取结果；未被用到的预取记为浪费，不进入结果。
+
+用法：
+    pf = EvidencePrefetcher(lang="zh", k=4)
+    pf.offer("涤纶")                 # 本地猜测
+    for text_so_far in stream:
+        pf.feed(text_so_far)        # 从部分输出中发现标签并预取
+    evidence = pf.finalize(["涤纶 斜纹"])
+    pf.close()
+"""
+
+from __future__ import annotations
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .evidence_pack import pack_evidence
+from .fabric_alias import label_key
+
+_MATERIAL_RE = re.compile(r'"material"\s*:\s*"([^"]+)"')
+_WEAVE_RE = re.compile(r'"weave_or_knit"\s*:\s*"([^"]+)"')
+
+
+def extract_partial_labels(text: str) -> List[str]:
+    """
+    从（可能不完整的）模型 JSON 输出中提取候选面料标签。
+
+    Args:
+        text: 目前为止收到的输出文本
+
+    Returns:
+        候选标签列表，如 ["涤纶", "涤纶 斜纹"]
+    """
+    labels = []
+    m = _MATERIAL_RE.search(text or "")
+    if m:
+        material = m.group(1).strip()
+        labels.append(material)
+        w = _WEAVE_RE.search(text)
+        if w:
+            labels.append(f"{material} {w.group(1).strip()}")
+    return labels
+
+
+def final_labels(data: Dict) -> List[str]:
+    """从解析后的统一 Schema 结果中取最终检索标签（材质 + 组织）"""
+    fabric = (data.get("details") or {}).get("fabric") or {}
+    material = str(fabric.get("material") or "").strip()
+    if not material or material.upper() == "N/A":
+        return []
+    weave = str(fabric.get("weave_or_knit") or "").strip()
+    return [f"{material} {weave}".strip()]
+
+
+class EvidencePrefetcher:
+    """按规范键去重的证据预取器"""
+
+    def __init__(
+        self,
+        lang: str = "zh",
+        k: int = 4,
+        fetch: Optional[Callable[[str], List[Dict[str, str]]]] = None,
+        max_workers: int = 3,
+        speculative: bool = True,
+    ):
+        """
+        Args:
+            lang: 检索语言
+            k: 每个标签的证据条数
+            fetch: 自定义检索函数 fetch(label) -> items，默认 web_evidence
+            max_workers: 并发检索线程数
+            speculative: False 时 offer/feed 不做任何事（串行模式）
+        """
+        self.lang = lang
+        self.k = k
+        self.speculative = speculative
+        self._fetch = fetch or self._web_fetch
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="evidence-prefetch")
+        self._futures: Dict[str, Future] = {}
+        self._speculated: set = set()
+        self._t0 = time.monotonic()
+        self.stats = {"offered": 0, "hits": 0, "misses": 0, "wasted": 0, "wait_s": 0.0}
+
+    def _web_fetch(self, label: str) -> List[Dict[str, str]]:
+        from .web_search import web_evidence
+
+        return web_evidence(label, lang=self.lang, k=self.k)
+
+    def _submit(self, key: str, label: str) -> Future:
+        fut = self._futures.get(key)
+        if fut is None:
+            fut = self._pool.submit(self._fetch, label)
+            self._futures[key] = fut
+        return fut
+
+    def offer(self, label: str) -> None:
+        """提交一个推测标签（已提交过的同义标签会被忽略）"""
+        if not self.speculative or not label:
+            return
+        key = label_key(label)
+        if key and key not in self._futures:
+            self.stats["offered"] += 1
+            self._speculated.add(key)
+            self._submit(key, label)
+
+    def feed(self, partial_text: str) -> None:
+        """流式回调：从部分输出中发现新标签并预取"""
+        if not self.speculative:
+            return
+        for label in extract_partial_labels(partial_text):
+            self.offer(label)
+
+    def get(self, label: str, timeout: Optional[float] = None) -> List[Dict[str, str]]:
+        """取用某个标签的证据；已预取则等待其完成，否则立即检索"""
+        key = label_key(label)
+        if key in self._speculated:
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+        fut = self._submit(key, label)
+        start = time.monotonic()
+        try:
+            return fut.result(timeout=timeout) or []
+        except Exception:
+            return []
+        finally:
+            self.stats["wait_s"] += time.monotonic() - start
+
+    def finalize(self, labels: List[str], budget_tokens: int = 600,
+                 timeout: Optional[float] = 15.0) -> Dict[str, object]:
+        """
+        按最终标签取用证据并打包。
+
+        Args:
+            labels: 模型最终给出的标签（第一个作为相关性排序的主查询）
+            budget_tokens: 证据打包的 token 预算
+            timeout: 等待单个检索的最长时间（秒）
+
+        Returns:
+            {"labels": [...], "items": [...], "text": "...", "stats": {...}}
+        """
+        items: List[Dict[str, str]] = []
+        for label in labels:
+            items.extend(self.get(label, timeout=timeout))
+        used = {label_key(x) for x in labels}
+        self.stats["wasted"] = len(self._speculated - used)
+        self.stats["wait_s"] = round(self.stats["wait_s"], 3)
+        packed = pack_evidence(items, labels[0], budget_tokens=budget_tokens) if labels else {
+            "items": [], "text": "", "stats": {}}
+        packed["labels"] = labels
+        packed["stats"] = dict(packed.get("stats", {}), prefetch=dict(self.stats))
+        return packed
+
+    def close(self) -> None:
+        """丢弃未用到的预取（未开始的直接取消，进行中的自行结束）"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -2,32 +2,77 @@
 """
 Web 搜索和内容提取模块（多引擎回退）
 用于开放集面料识别的联网验证
+
+检索依赖（duckduckgo_search / requests / lxml / readability）在第一次联网时才加载，
+结果缓存用进程内 TTL 缓存而不是 st.cache_data：未开启联网的会话、worker 和 CLI 进程
+导入本模块不会加载这些依赖，也不会加载 streamlit。
 """
 
 from __future__ import annotations
+import copy
+import functools
+import inspect
 import re
-import streamlit as st
+import threading
+import time
+from collections import OrderedDict
 from typing import List, Dict
 
-try:
-    from duckduckgo_search import DDGS
-except ImportError:
-    DDGS = None
-
-try:
-    import requests
-    import lxml.html
-    from readability import Document
-except ImportError:
-    requests = None
-    lxml = None
-    Document = None
+from src.utils.lazy_import import optional_import
 
 # User-Agent for web requests
 UA = {"User-Agent": "Mozilla/5.0"}
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
+def _cache_data(ttl: int, maxsize: int = 1024):
+    """
+    进程内 TTL + LRU 结果缓存（与 st.cache_data 一样跨会话共享、每次返回副本）。
+
+    Args:
+        ttl: 结果有效期（秒）
+        maxsize: 最多缓存的参数组合数
+    """
+    def decorate(fn):
+        entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        lock = threading.Lock()
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.items())
+            now = time.monotonic()
+            with lock:
+                hit = entries.get(key)
+                if hit is not None and hit[0] > now:
+                    entries.move_to_end(key)
+                    return copy.deepcopy(hit[1])
+            value = fn(*args, **kwargs)
+            with lock:
+                entries[key] = (now + ttl, value)
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return copy.deepcopy(value)
+
+        def clear() -> None:
+            with lock:
+                entries.clear()
+
+        wrapper.clear = clear
+        return wrapper
+    return decorate
+
+
+def _readability():
+    """(lxml.html, readability.Document)；任一缺失时为 (None, None)"""
+    lxml_html = optional_import("lxml.html")
+    Document = optional_import("readability", "Document")
+    return (lxml_html, Document) if lxml_html is not None and Document is not None else (None, None)
+
+
+@_cache_data(ttl=3600)
 def ddg_text(query: str, k: int = 5, region: str = "wt-wt") -> List[Dict[str, str]]:
     """
     使用 DuckDuckGo 搜索并返回文本结果。
@@ -40,6 +85,7 @@ def ddg_text(query: str, k: int = 5, region: str = "wt-wt") -> List[Dict[str, st
     Returns:
         [{"title": "...", "url": "...", "snippet": "..."}, ...]
     """
+    DDGS = optional_import("duckduckgo_search", "DDGS")
     if DDGS is None:
         return []
     
@@ -58,7 +104,7 @@ def ddg_text(query: str, k: int = 5, region: str = "wt-wt") -> List[Dict[str, st
     return out
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
+@_cache_data(ttl=3600)
 def wiki_search(q: str, lang: str = "zh") -> List[Dict[str, str]]:
     """
     Wikipedia API 搜索并获取首页摘要。
@@ -70,6 +116,7 @@ def wiki_search(q: str, lang: str = "zh") -> List[Dict[str, str]]:
     Returns:
         [{"title": "...", "url": "...", "snippet": "..."}, ...]
     """
+    requests = optional_import("requests")
     if requests is None:
         return []
     
@@ -124,7 +171,7 @@ def wiki_search(q: str, lang: str = "zh") -> List[Dict[str, str]]:
         return []
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
+@_cache_data(ttl=3600)
 def baike_read(q: str) -> List[Dict[str, str]]:
     """
     百度百科回退方案：抓取 HTML 并提取可读文本。
@@ -135,7 +182,9 @@ def baike_read(q: str) -> List[Dict[str, str]]:
     Returns:
         [{"title": "...", "url": "...", "snippet": "..."}, ...]
     """
-    if requests is None or Document is None or lxml is None:
+    requests = optional_import("requests")
+    lxml_html, Document = _readability()
+    if requests is None or Document is None:
         return []
     
     try:
@@ -144,7 +193,7 @@ def baike_read(q: str) -> List[Dict[str, str]]:
         
         # Extract readable text using readability
         text = Document(html).summary()
-        text = lxml.html.fromstring(text).text_content()
+        text = lxml_html.fromstring(text).text_content()
         text = re.sub(r"\s+", " ", text).strip()[:2000]
         
         return [{
@@ -157,23 +206,56 @@ def baike_read(q: str) -> List[Dict[str, str]]:
         return []
 
 
-def web_evidence(label: str, lang: str = "zh", k: int = 4) -> List[Dict[str, str]]:
+def web_evidence(
+    label: str,
+    lang: str = "zh",
+    k: int = 4,
+    read_full: bool = False,
+    deadline: float = 10.0,
+    use_kb: bool = True,
+    canonical: bool = True,
+) -> List[Dict[str, str]]:
     """
-    多引擎回退搜索：DuckDuckGo → Wikipedia → Baidu Baike。
+    多引擎回退搜索：本地知识库 → DuckDuckGo → Wikipedia → Baidu Baike。
     
     Args:
         label: 面料名称
         lang: 语言代码（"zh" 或 "en"）
         k: 返回结果数量
+        read_full: 是否并发读取 Top-k 结果页全文（写入 "content" 字段）
+        deadline: 全文读取的全局截止时间（秒）
+        use_kb: 是否先查询本地面料知识库（命中则不联网）
+        canonical: 是否先把标签规范化（"PES"/"Polyester fabric" → "polyester"），
+            使同义标签共享检索与缓存
     
     Returns:
-        [{"title": "...", "url": "...", "snippet": "..."}, ...]
+        [{"title": "...", "url": "...", "snippet": "...", "content": "..."}, ...]
     
     Fallback strategy:
+        0. Local fabric knowledge base (in-process BM25, no network)
         1. Try DuckDuckGo first (fastest, worldwide)
         2. If no results, try Wikipedia API (reliable, structured)
         3. If still no results and lang=zh, try Baidu Baike (Chinese specific)
     """
+    # 规范化标签：同义词/大小写/缩写统一为同一个检索词
+    if canonical:
+        from .fabric_alias import canonicalize, canonical_name
+
+        key = canonicalize(label)
+        if key:
+            label = canonical_name(key, lang)
+
+    # Try 0: 本地知识库
+    if use_kb:
+        try:
+            from .fabric_kb import kb_evidence
+
+            kb_items = kb_evidence(label, lang, k)
+            if kb_items:
+                return kb_items[:k]
+        except Exception:
+            pass
+
     # Build search query
     if lang.startswith("zh"):
         query = f"{label} 面料 特性 纤维 织法"
@@ -192,11 +274,25 @@ def web_evidence(label: str, lang: str = "zh", k: int = 4) -> List[Dict[str, str
     if not items and lang.startswith("zh"):
         items = baike_read(label)
     
-    return items[:k]
+    items = items[:k]
+    if items:
+        # 记录联网结果，供下次重建本地知识库
+        from .fabric_kb import record_web_results
+
+        record_web_results(label, lang, items)
+
+    if read_full and items:
+        from .page_reader import read_pages
+
+        pages = read_pages([it.get("url", "") for it in items], deadline=deadline)
+        texts = {p["url"]: p["text"] for p in pages}
+        items = [dict(it, content=texts.get(it.get("url", ""), "")) for it in items]
+
+    return items
 
 
 # Legacy compatibility - keep old function name
-@st.cache_data(show_spinner=False, ttl=3600)
+@_cache_data(ttl=3600)
 def search_snippets(query: str, k: int = 4, region: str = "cn") -> List[Dict[str, str]]:
     """
     Legacy compatibility wrapper for ddg_text.
@@ -234,7 +330,7 @@ def search_snippets(query: str, k: int = 4, region: str = "cn") -> List[Dict[str
     return []
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
+@_cache_data(ttl=3600)
 def fetch_readable(url: str, timeout: int = 8) -> str:
     """
     获取 URL 的可读文本内容。
@@ -246,26 +342,44 @@ def fetch_readable(url: str, timeout: int = 8) -> str:
     Returns:
         提取的文本内容（最多 3000 字符）
     """
-    if requests is None or lxml is None or Document is None:
+    requests = optional_import("requests")
+    if requests is None or _readability()[1] is None:
         return ""
     
     try:
         # 获取 HTML 内容
         resp = requests.get(url, timeout=timeout, headers=UA)
         resp.raise_for_status()
-        
-        # 使用 readability 提取主要内容
-        doc = Document(resp.text)
-        html_text = doc.summary(html_partial=True)
-        
-        # 转换为纯文本
-        text = lxml.html.fromstring(html_text).text_content()
-        
-        # 清理空白字符
-        text = re.sub(r"\s+", " ", text).strip()
-        
-        # 限制长度
-        return text[:3000]
+        return html_to_text(resp.text)
     
     except Exception:
         return ""
+
+
+def html_to_text(html: str, limit: int = 3000) -> str:
+    """
+    使用 readability 提取网页主体并转换为纯文本。
+
+    Args:
+        html: 原始 HTML
+        limit: 最大返回字符数
+
+    Returns:
+        清理空白后的正文文本；依赖缺失时返回空字符串
+    """
+    lxml_html, Document = _readability()
+    if Document is None or not html:
+        return ""
+
+    # 使用 readability 提取主要内容
+    doc = Document(html)
+    html_text = doc.summary(html_partial=True)
+
+    # 转换为纯文本
+    text = lxml_html.fromstring(html_text).text_content()
+
+    # 清理空白字符
+    text = re.sub(r"\s+", " ", text).strip()
+
+    # 限制长度
+    return text[:limit]
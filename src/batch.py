@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+批量分析（多图上传 / 多个选区）
+
+单图流程一次只能分析一个选区，打样间一次几十张图需要来回操作几十次。
+BatchRun 把多张图片（或同一张图上标记的多个选区）排队，按固定并发度提交到
+共享的 InferenceExecutor：
+- 排队的条目只保存原始字节（同一张图的多个选区共用一份），解码和选区裁剪在后台线程完成
+- 任一任务结束即补提交下一条，不依赖页面轮询
+- 批量任务使用独立的线程池和会话标识（<session>/batch），不占用单图分析的线程和在途配额
+- 后端调用走调度器的 bulk 通道：有交互请求时批量自动让出空位（见 src/scheduler.py）
+- 每个条目记录状态、排队等待和分析耗时，结束后保存结果供页面打开
+
+用法：
+    from src.batch import get_batch
+
+    batch = get_batch(session_id)
+    for f in uploaded_files:
+        batch.add(f.name, f.getvalue(), cloud_infer, engine="qwen-vl", lang="zh")
+    ...
+    batch.items()      # [BatchItem(status="running", ...), ...]
+    batch.progress()   # {"total": 12, "done": 5, "running": 3, ...}
+"""
+
+from __future__ import annotations
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from src.image_store import content_hash, get_image_store
+from src.jobs import CANCELLED, DONE, ERROR, QUEUED, RUNNING
+from src.jobs import InferenceExecutor, SessionBusy, get_bulk_executor
+from src.scheduler import BULK, get_scheduler
+from src.utils.tracing import span
+
+Box = Tuple[int, int, int, int]  # (x, y, w, h)，工作图坐标
+
+# 每个会话同时在分析的条目数
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+# 每个会话最多排队的条目数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "64"))
+# 进度格中的缩略图长边
+THUMB_SIDE = 160
+
+
+@dataclass
+class BatchItem:
+    """批量中的一张图或一个选区"""
+    id: str
+    name: str
+    image_key: str
+    box: Optional[Box] = None
+    fn: Optional[Callable] = field(default=None, repr=False)
+    kwargs: Dict[str, Any] = field(default_factory=dict, repr=False)
+    meta: Dict[str, Any] = field(default_factory=dict)
+    status: str = QUEUED
+    job_id: Optional[str] = None
+    queued_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = field(default=None, repr=False)
+    error: Optional[str] = None
+    thumb: Optional[Image.Image] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, ERROR, CANCELLED)
+
+    @property
+    def latency(self) -> Optional[float]:
+        """分析耗时（拿到后端空位到结束，不含排队）"""
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+    @property
+    def elapsed(self) -> float:
+        """排队以来的总耗时"""
+        return (self.finished_at or time.time()) - self.queued_at
+
+
+class BatchRun:
+    """一个会话的批量分析队列"""
+
+    def __init__(self, session_id: str, executor: Optional[InferenceExecutor] = None,
+                 concurrency: int = BATCH_CONCURRENCY, max_items: int = BATCH_MAX_ITEMS):
+        self.session_id = f"{session_id}/batch"
+        self.executor = executor or get_bulk_executor()
+        self.concurrency = max(1, concurrency)
+        self.max_items = max_items
+        self._items: Dict[str, BatchItem] = {}
+        self._blobs: Dict[str, bytes] = {}  # 内容哈希 -> 原始字节（多个选区共用）
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def add(self, name: str, data: bytes, fn: Callable, box: Optional[Box] = None,
+            meta: Optional[Dict[str, Any]] = None, **kwargs) -> Optional[BatchItem]:
+        """
+        加入一张图（或图上的一个选区）并尽快开始分析。
+
+        Args:
+            name: 显示名（文件名，选区时附坐标）
+            data: 上传文件的原始字节
+            fn: 分析函数，以 fn(image, **kwargs) 调用（通常是 cloud_infer）
+            box: 选区；为空时分析整张工作图
+            meta: 附加信息，原样保存在 item.meta
+
+        Returns:
+            BatchItem；队列已满时返回 None
+        """
+        key = content_hash(data)
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                return None
+            item = BatchItem(id=f"item-{next(self._ids)}", name=name, image_key=key,
+                             box=tuple(box) if box else None, fn=fn, kwargs=kwargs,
+                             meta=dict(meta or {}))
+            self._blobs.setdefault(key, data)
+            self._items[item.id] = item
+        self._pump()
+        return item
+
+    def _analyze(self, item: BatchItem) -> Any:
+        """后台线程：解码（共享解码缓存）→ 裁剪选区 → 生成缩略图 → 等后端空位 → 分析"""
+        with span("batch_item", root=True, item=item.id, roi=bool(item.box),
+                  engine=item.meta.get("engine"), task_type=item.kwargs.get("task_type")):
+            return self._analyze_item(item)
+
+    def _analyze_item(self, item: BatchItem) -> Any:
+        with self._lock:
+            if item.finished:  # 刚被取消
+                return None
+            data = self._blobs[item.image_key]
+        entry = get_image_store().get_or_decode(data, key=item.image_key)
+        if item.box:
+            x, y, w, h = item.box
+            image = entry.roi(item.box)
+            thumb = entry.image.crop((x, y, x + w, y + h))
+        else:
+            image = entry.image
+            thumb = entry.preview(THUMB_SIDE * 2).copy()
+        thumb.thumbnail((THUMB_SIDE, THUMB_SIDE), Image.BILINEAR)
+        item.thumb = thumb
+        with get_scheduler().slot(BULK):
+            with self._lock:
+                if item.finished:  # 排队期间被取消
+                    return None
+                item.status = RUNNING
+                item.started_at = time.time()
+            return item.fn(image, **item.kwargs)
+
+    def _pump(self) -> None:
+        """补足并发度：提交排队中的条目"""
+        submitted = []
+        with self._lock:
+            in_flight = sum(1 for i in self._items.values() if i.job_id and not i.finished)
+            for item in self._items.values():
+                if in_flight >= self.concurrency:
+                    break
+                if item.status != QUEUED or item.job_id:
+                    continue
+                try:
+                    job = self.executor.submit(self.session_id, self._analyze, item, replace=False,
+                                               meta=dict(item.meta, batch_item=item.id),
+                                               limit=self.concurrency)
+                except SessionBusy:
+                    # 已取消但仍在运行的旧任务占着配额：有在途任务时等它们结束再补，否则稍后重试
+                    if in_flight == 0:
+                        retry = threading.Timer(1.0, self._pump)
+                        retry.daemon = True
+                        retry.start()
+                    break
+                item.job_id = job.id
+                in_flight += 1
+                submitted.append((item, job))
+        # 在锁外挂回调：已结束的 future 会在当前线程立即回调
+        for item, job in submitted:
+            job.future.add_done_callback(lambda _f, item=item, job=job: self._on_done(item, job))
+
+    def _on_done(self, item: BatchItem, job) -> None:
+        with self._lock:
+            if not item.finished:
+                item.status = job.status if job.status in (DONE, ERROR) else CANCELLED
+                item.result = job.result
+                item.error = job.error
+                item.finished_at = job.finished_at or time.time()
+                item.fn = None  # 释放对分析函数参数的引用
+        self._pump()
+
+    def cancel(self) -> int:
+        """取消所有未结束的条目，返回取消数量"""
+        cancelled = 0
+        with self._lock:
+            for item in self._items.values():
+                if item.finished:
+                    continue
+                if item.job_id:
+                    self.executor.cancel(item.job_id)
+                item.status = CANCELLED
+                item.finished_at = time.time()
+                cancelled += 1
+        return cancelled
+
+    def clear(self) -> None:
+        """取消并清空队列"""
+        self.cancel()
+        with self._lock:
+            self._items.clear()
+            self._blobs.clear()
+
+    def get(self, item_id: Optional[str]) -> Optional[BatchItem]:
+        with self._lock:
+            return self._items.get(item_id) if item_id else None
+
+    def items(self) -> List[BatchItem]:
+        with self._lock:
+            return list(self._items.values())
+
+    @property
+    def active(self) -> bool:
+        """是否还有未结束的条目"""
+        with self._lock:
+            return any(not i.finished for i in self._items.values())
+
+    def progress(self) -> Dict[str, float]:
+        """各状态条目数 + 已结束条目的平均分析耗时"""
+        with self._lock:
+            items = list(self._items.values())
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0, CANCELLED: 0}
+        for i in items:
+            counts[i.status] += 1
+        latencies = [i.latency for i in items if i.latency is not None]
+        counts["total"] = len(items)
+        counts["finished"] = counts[DONE] + counts[ERROR] + counts[CANCELLED]
+        counts["avg_latency_s"] = round(sum(latencies) / len(latencies), 2) if latencies else 0.0
+        return counts
+
+
+_batches: Dict[str, BatchRun] = {}
+_batches_lock = threading.Lock()
+
+
+def get_batch(session_id: str) -> BatchRun:
+    """会话的批量队列（进程级登记，页面重跑和 fragment 重跑共用同一队列）"""
+    with _batches_lock:
+        batch = _batches.get(session_id)
+        if batch is None:
+            batch = _batches[session_id] = BatchRun(session_id)
+        return batch
+
+
+def drop_batch(session_id: str) -> None:
+    """会话结束时取消并移除其批量队列"""
+    with _batches_lock:
+        batch = _batches.pop(session_id, None)
+    if batch is not None:
+        batch.clear()
+
+
+def batch_snapshot() -> Dict[str, float]:
+    """所有会话批量队列的合计：会话数 + 各状态条目数"""
+    with _batches_lock:
+        batches = list(_batches.values())
+    total: Dict[str, float] = {"sessions": len(batches), QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0,
+                               CANCELLED: 0}
+    for batch in batches:
+        progress = batch.progress()
+        for status in (QUEUED, RUNNING, DONE, ERROR, CANCELLED):
+            total[status] += progress[status]
+    return total
@@ -59,20 +59,27 @@ Version: 2.0
 Last Updated: 2025-10
 """
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from PIL import Image
 import io
 import base64
 import os
 import json
 import re
+import sys
+from pathlib import Path
 
-try:
-    import dashscope
-    from dashscope import MultiModalConversation
-except Exception:
-    dashscope = None
-    MultiModalConversation = None
+# DashScope SDK 加载约半秒（连带 aiohttp / requests），第一次调用 cloud_infer 时才导入（见 _load_dashscope）
+dashscope = None
+MultiModalConversation = None
+
+from src.utils.lazy_import import optional_import
+from src.utils.stack_profiler import profiled
+from src.utils.tracing import span, traced
+
+# 联网证据的默认模式：sequential（模型返回后再检索）；设为 prefetch 时改为流式调用并推测预取。
+# 流式调用会改变请求方式（stream + incremental_output），因此只在显式开启时使用
+EVIDENCE_MODE = os.getenv("EVIDENCE_MODE", "sequential")
 
 # ==================== 模型映射 ====================
 MODEL_MAP = {
@@ -294,13 +301,51 @@ Output JSON following this schema (task="construction"):
 # 旧提示词已移除，使用上面的专业模板系统
 
 # ==================== 辅助函数 ====================
+def _load_dashscope() -> bool:
+    """首次调用时导入 DashScope SDK；未安装时返回 False"""
+    global dashscope, MultiModalConversation
+    if MultiModalConversation is None:
+        dashscope = optional_import("dashscope")
+        MultiModalConversation = optional_import("dashscope", "MultiModalConversation")
+    return dashscope is not None and MultiModalConversation is not None
+
+
+def _secret(name: str) -> Optional[str]:
+    """
+    从 Streamlit secrets 读取配置。
+
+    页面进程里直接用 st.secrets；worker / CLI 进程不为此加载 streamlit，
+    按 st.secrets 的查找顺序读 ~/.streamlit/secrets.toml 与 ./.streamlit/secrets.toml。
+    """
+    if "streamlit" not in sys.modules:
+        tomllib = optional_import("tomllib") or optional_import("tomli")
+        if tomllib is not None:
+            value = None
+            for path in (Path.home() / ".streamlit" / "secrets.toml",
+                         Path.cwd() / ".streamlit" / "secrets.toml"):
+                try:
+                    with open(path, "rb") as f:
+                        value = tomllib.load(f).get(name, value)
+                except (OSError, ValueError):
+                    continue
+            return value
+    try:
+        import streamlit as st
+        return st.secrets.get(name)
+    except Exception:
+        return None
+
+
 def image_to_base64_datauri(img: Image.Image) -> str:
     """将 PIL Image 转换为 DashScope 接受的 base64 data URI"""
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    img_bytes = buf.getvalue()
-    b64_str = base64.b64encode(img_bytes).decode('utf-8')
-    return f"data:image/png;base64,{b64_str}"
+    with span("png_encode") as s:
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        img_bytes = buf.getvalue()
+        s.set(bytes=len(img_bytes))
+    with span("base64"):
+        b64_str = base64.b64encode(img_bytes).decode('utf-8')
+        return f"data:image/png;base64,{b64_str}"
 
 def make_prompt(task_type: str, lang: str, budget: str, scene: str, constraints: str) -> str:
     """根据任务类型、语言和上下文生成提示词"""
@@ -408,7 +453,120 @@ def ensure_min_size(pil_img: Image.Image, tgt: int = 640) -> Image.Image:
     nw, nh = int(w * scale), int(h * scale)
     return pil_img.resize((nw, nh), Image.BICUBIC)
 
+def _extract_response_text(response, fallback: bool = True):
+    """
+    提取响应文本 - 兼容 DashScope 多种响应格式
+
+    Args:
+        response: MultiModalConversation.call 的返回值（或流式响应中的单个分片）
+        fallback: 未找到文本时是否退回 str(output)（流式分片应关闭）
+
+    Returns:
+        (raw_text, extraction_path)
+    """
+    raw_text = ""
+    extraction_path = "unknown"  # 调试：记录提取路径
+
+    if hasattr(response, 'output'):
+        output = response.output
+
+        # 情况1：output 是列表 [{'text': '...'}]
+        if isinstance(output, list) and len(output) > 0:
+            extraction_path = "list_branch"
+            first_item = output[0]
+            if isinstance(first_item, dict):
+                raw_text = (first_item.get('text', '') or first_item.get('content', '')
+                            or str(first_item))
+                extraction_path = "list_dict_branch"
+            else:
+                raw_text = str(first_item)
+                extraction_path = "list_str_branch"
+
+        # 情况2：output 是字典 {'choices': [...]}
+        elif isinstance(output, dict):
+            extraction_path = "dict_branch"
+            # 尝试从 choices 提取
+            choices = output.get('choices', [])
+            if choices and len(choices) > 0:
+                message = choices[0].get('message', {})
+                content = message.get('content', '')
+
+                # content 可能又是列表 [{'text': '...'}]
+                if isinstance(content, list) and len(content) > 0:
+                    first_content = content[0]
+                    if isinstance(first_content, dict):
+                        raw_text = first_content.get('text', '') or first_content.get('content', '')
+                        extraction_path = "dict_choices_list_branch"
+                    else:
+                        raw_text = str(first_content)
+                        extraction_path = "dict_choices_list_str_branch"
+                elif isinstance(content, str):
+                    raw_text = content
+                    extraction_path = "dict_choices_str_branch"
+                else:
+                    raw_text = str(content)
+                    extraction_path = "dict_choices_fallback"
+
+            # 兜底：直接提取 text 或 content 字段
+            if not raw_text:
+                raw_text = output.get('text', '') or output.get('content', '')
+                extraction_path = "dict_text_branch"
+
+        # 情况3：output 是字符串
+        elif isinstance(output, str):
+            raw_text = output
+            extraction_path = "str_branch"
+
+        # 最终兜底
+        if not raw_text and fallback:
+            raw_text = str(output)
+            extraction_path = "fallback_str"
+    elif fallback:
+        raw_text = str(response)
+        extraction_path = "no_output"
+
+    return raw_text, extraction_path
+
+def _call_streaming(model: str, messages: List[Dict], on_text=None):
+    """
+    流式调用模型，边接收边回调累计文本（用于证据预取）
+
+    使用 SDK 的增量输出模式（incremental_output=True）：每个分片只包含新增的文本，直接拼接。
+
+    Args:
+        model: 模型名称
+        messages: 对话消息
+        on_text: 回调 on_text(text_so_far)
+
+    Returns:
+        (raw_text, extraction_path, chunks)：累计全文、最后一个分片的提取路径、分片数
+    """
+    raw_text = ""
+    chunks = 0
+    path = "unknown"
+    for chunk in MultiModalConversation.call(
+        model=model,
+        messages=messages,
+        top_p=0.7,
+        temperature=0.2,
+        stream=True,
+        incremental_output=True,
+    ):
+        chunks += 1
+        status = getattr(chunk, "status_code", 200)
+        if status != 200:
+            raise RuntimeError(f"{status} {getattr(chunk, 'message', '')}")
+        piece, path = _extract_response_text(chunk, fallback=False)
+        if path == "dict_choices_fallback":
+            piece = ""
+        raw_text += piece
+        if on_text is not None and piece:
+            on_text(raw_text)
+    return raw_text, f"stream_{path}", chunks
+
 # ==================== 云端推理 ====================
+@traced("cloud_infer")
+@profiled("cloud_infer")
 def cloud_infer(
     pil_image: Image.Image,
     engine: str,
@@ -418,7 +576,9 @@ def cloud_infer(
     task_type: str = "auto",
     budget: str = "mid",
     scene: str = "casual",
-    constraints: str = "无特殊约束"
+    constraints: str = "无特殊约束",
+    evidence_mode: Optional[str] = None,
+    prefetch_labels: Optional[List[str]] = None,
 ) -> Dict:
     """
     云端生产分析 - 专业版
@@ -433,13 +593,17 @@ def cloud_infer(
         budget: 预算档位 ("low"|"mid"|"high")
         scene: 使用场景 (如"casual"|"evening"|"activewear"|"home")
         constraints: 约束条件 (如"环保,可水洗,四向弹")
+        evidence_mode: 联网证据模式 ("sequential": 模型返回后再检索 | "prefetch": 流式调用，输出期间推测预取)；
+            None 时取环境变量 EVIDENCE_MODE（默认 sequential）
+        prefetch_labels: 本地猜测的候选标签（如同一张图上一次的结果），调用开始即预取
     
     Returns:
         统一JSON Schema包含：
         - task, summary, details, recommendations, dfm_risks, next_actions
+        - evidence（启用联网时）：{"labels", "items", "text"}，统计见 _meta["evidence"]
     """
     # 检查依赖
-    if dashscope is None or MultiModalConversation is None:
+    if not _load_dashscope():
         return {
             "labels": [],
             "confidences": [],
@@ -453,11 +617,7 @@ def cloud_infer(
     api_key = os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
         # 尝试从 streamlit secrets 读取
-        try:
-            import streamlit as st
-            api_key = st.secrets.get("DASHSCOPE_API_KEY")
-        except Exception:
-            pass
+        api_key = _secret("DASHSCOPE_API_KEY")
     
     if not api_key:
         return {
@@ -476,10 +636,13 @@ def cloud_infer(
     model = MODEL_MAP.get(engine, "qwen-vl-plus")
     
     # 确保图片尺寸足够
-    pil_image = ensure_min_size(pil_image, 640)
+    with span("resize", size=list(pil_image.size)):
+        pil_image = ensure_min_size(pil_image, 640)
     
     # 转换为 base64 data URI
-    img_datauri = image_to_base64_datauri(pil_image)
+    with span("encode") as s:
+        img_datauri = image_to_base64_datauri(pil_image)
+        s.set(bytes=len(img_datauri))
     
     # 构建消息 - 使用新的提示词系统
     system_prompt = make_prompt(task_type, lang, budget, scene, constraints)
@@ -519,82 +682,52 @@ def cloud_infer(
         }
     ]
     
+    # 联网证据：模型调用期间即开始预取可能的标签
+    prefetcher = None
+    if enable_web:
+        try:
+            from src.aug.prefetch import EvidencePrefetcher
+
+            prefetcher = EvidencePrefetcher(
+                lang=lang,
+                k=k_per_query,
+                speculative=((evidence_mode or EVIDENCE_MODE) == "prefetch"),
+            )
+            for hint in prefetch_labels or []:
+                prefetcher.offer(hint)
+        except Exception:
+            prefetcher = None
+
     # 调用 API
     try:
-        response = MultiModalConversation.call(
-            model=model,
-            messages=messages,
-            top_p=0.7,
-            temperature=0.2,
-        )
-        
-        # 提取响应文本 - 兼容 DashScope 多种响应格式
-        raw_text = ""
-        extraction_path = "unknown"  # 调试：记录提取路径
-        
-        if hasattr(response, 'output'):
-            output = response.output
-            
-            # 情况1：output 是列表 [{'text': '...'}]
-            if isinstance(output, list) and len(output) > 0:
-                extraction_path = "list_branch"
-                first_item = output[0]
-                if isinstance(first_item, dict):
-                    raw_text = first_item.get('text', '') or first_item.get('content', '') or str(first_item)
-                    extraction_path = "list_dict_branch"
-                else:
-                    raw_text = str(first_item)
-                    extraction_path = "list_str_branch"
-            
-            # 情况2：output 是字典 {'choices': [...]}
-            elif isinstance(output, dict):
-                extraction_path = "dict_branch"
-                # 尝试从 choices 提取
-                choices = output.get('choices', [])
-                if choices and len(choices) > 0:
-                    message = choices[0].get('message', {})
-                    content = message.get('content', '')
-                    
-                    # content 可能又是列表 [{'text': '...'}]
-                    if isinstance(content, list) and len(content) > 0:
-                        first_content = content[0]
-                        if isinstance(first_content, dict):
-                            raw_text = first_content.get('text', '') or first_content.get('content', '')
-                            extraction_path = "dict_choices_list_branch"
-                        else:
-                            raw_text = str(first_content)
-                            extraction_path = "dict_choices_list_str_branch"
-                    elif isinstance(content, str):
-                        raw_text = content
-                        extraction_path = "dict_choices_str_branch"
-                    else:
-                        raw_text = str(content)
-                        extraction_path = "dict_choices_fallback"
-                
-                # 兜底：直接提取 text 或 content 字段
-                if not raw_text:
-                    raw_text = output.get('text', '') or output.get('content', '')
-                    extraction_path = "dict_text_branch"
-            
-            # 情况3：output 是字符串
-            elif isinstance(output, str):
-                raw_text = output
-                extraction_path = "str_branch"
-            
-            # 最终兜底
-            if not raw_text:
-                raw_text = str(output)
-                extraction_path = "fallback_str"
-        else:
-            raw_text = str(response)
-            extraction_path = "no_output"
+        streaming = prefetcher is not None and prefetcher.speculative
+        with span("backend_call", model=model, task_type=task_type, streaming=streaming) as s:
+            if streaming:
+                raw_text, extraction_path, chunks = _call_streaming(model, messages,
+                                                                    prefetcher.feed)
+                # 解析失败时的调试信息取累计全文（最后一个分片只有结尾几个字）
+                output = raw_text
+                output_type = f"stream ({chunks} chunks)"
+            else:
+                response = MultiModalConversation.call(
+                    model=model,
+                    messages=messages,
+                    top_p=0.7,
+                    temperature=0.2,
+                )
+                raw_text, extraction_path = _extract_response_text(response)
+                output = getattr(response, "output", "no output")
+                output_type = str(type(output)) if hasattr(response, "output") else "no output"
+            s.set(chars=len(raw_text or ""))
         
         # === 调试信息 ===
         # print(f"DEBUG: raw_text type = {type(raw_text)}")
         # print(f"DEBUG: raw_text[:200] = {raw_text[:200]}")
         
         # 解析 JSON
-        data = try_parse_json(raw_text)
+        with span("parse") as s:
+            data = try_parse_json(raw_text)
+            s.set(ok=bool(data))
         
         # print(f"DEBUG: parsed data keys = {list(data.keys()) if data else 'empty'}")
         
@@ -612,8 +745,8 @@ def cloud_infer(
                     "raw_text_type": str(type(raw_text)),
                     "raw_text_len": len(raw_text) if raw_text else 0,
                     "raw_text_preview": str(raw_text)[:500] if raw_text else "empty",
-                    "output_type": str(type(response.output)) if hasattr(response, 'output') else "no output",
-                    "output_preview": str(response.output)[:500] if hasattr(response, 'output') else "no output"
+                    "output_type": output_type,
+                    "output_preview": str(output)[:500]
                 }
             }
         
@@ -625,6 +758,15 @@ def cloud_infer(
                 "engine": "cloud",
                 "raw": raw_text
             }
+            if prefetcher is not None:
+                from src.aug.prefetch import final_labels
+
+                labels = final_labels(data)
+                if labels:
+                    with span("evidence", labels=len(labels)):
+                        evidence = prefetcher.finalize(labels)
+                    data["evidence"] = {k: evidence[k] for k in ("labels", "items", "text")}
+                    data["_meta"]["evidence"] = evidence["stats"]
             return data
         
         # 旧格式兼容逻辑
@@ -664,6 +806,10 @@ def cloud_infer(
             "engine": "error"
         }
 
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
 # ==================== 兼容接口 ====================
 def analyze_image(
     image: Image.Image,
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+异步 HTTP 推理服务（与 Streamlit 应用并行运行）
+
+PLM、工艺单生成器等内部工具需要面料/印花/工艺分析，但不应驱动浏览器界面。
+本模块用 aiohttp 把 cloud_infer 包装成 HTTP API，返回与 UI 相同的统一 JSON Schema：
+
+    GET  /healthz              服务状态 + 准入控制计数 + 结果缓存命中率
+    POST /v1/analyze           单张图片 -> 统一 Schema
+    POST /v1/analyze/batch     多张图片 -> {"results": [...]}（顺序与请求一致）
+    POST /v1/analyze/stream    多张图片 -> NDJSON 事件流，每张分析完成即输出一行
+
+请求格式（两种均可）：
+- multipart/form-data：一个或多个 "image" 文件字段，其余表单字段为参数
+- application/json：{"image": "<base64>", ...参数} 或 {"images": ["<base64>", ...], ...参数}
+
+参数与 cloud_infer 一致：engine / lang / task_type / budget / scene / constraints / enable_web /
+k_per_query。
+
+保护措施：
+- 请求体上限 SERVICE_MAX_BODY_MB（aiohttp client_max_size，超出返回 413）
+- 单图像素上限沿用 IMAGE_MAX_PIXELS（超出返回 413），批量张数上限 SERVICE_MAX_BATCH
+- 准入控制：同时分析 SERVICE_MAX_INFLIGHT 张，另有 SERVICE_MAX_QUEUE 张可排队；
+  再多的请求立即返回 429 + Retry-After，不在服务端堆积
+- 后端空位按通道分配（src/scheduler.py）：单张请求走 interactive，批量/流式走 bulk，
+  单张请求不会被大批量挡在后面
+
+启动：
+    python scripts/serve_api.py --port 8600
+    python scripts/serve_api.py --stub 0.8      # 假后端（压测用，不调用 API）
+"""
+
+from __future__ import annotations
+import asyncio
+import base64
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from src.image_store import ImageTooLarge, decode_working
+from src.result_cache import cached, get_result_cache
+from src.scheduler import BULK, INTERACTIVE, LaneScheduler
+from src.utils.metrics import counter
+from src.utils.tracing import span
+
+try:
+    from src.utils.logger import get_logger
+    log = get_logger("http_service")
+except Exception:
+    import logging
+    log = logging.getLogger("http_service")
+
+MAX_BODY_MB = float(os.getenv("SERVICE_MAX_BODY_MB", "20"))
+MAX_BATCH = int(os.getenv("SERVICE_MAX_BATCH", "16"))
+MAX_INFLIGHT = int(os.getenv("SERVICE_MAX_INFLIGHT", "4"))
+MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", "16"))
+
+# 允许透传给 cloud_infer 的参数及其类型
+PARAMS = {
+    "engine": str,
+    "lang": str,
+    "task_type": str,
+    "budget": str,
+    "scene": str,
+    "constraints": str,
+    "enable_web": bool,
+    "k_per_query": int,
+}
+DEFAULT_PARAMS = {"engine": "qwen-vl", "lang": "zh"}
+
+
+class BadRequest(ValueError):
+    """请求格式错误（400）"""
+
+
+class Rejected(Exception):
+    """准入控制拒绝（429）"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"server busy, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    在途 + 排队总数有上限的准入控制。
+
+    已接纳的请求在线程池中等待调度器按通道分配后端空位；在途与排队之和超过
+    scheduler.capacity + max_queue 时立即拒绝，避免过载时请求在服务端无限堆积、拖慢已接纳请求的尾延迟。
+    """
+
+    def __init__(self, scheduler: LaneScheduler, max_queue: int = MAX_QUEUE):
+        self.scheduler = scheduler
+        self.max_inflight = scheduler.capacity
+        self.max_queue = max_queue
+        self.outstanding = 0  # 已接纳未完成（事件循环内修改）
+        self._latency_ewma = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    def retry_after(self, lane: str = INTERACTIVE) -> float:
+        """预计多久后有空位（调度器按近期占用时长估算，尚无样本时按本服务的平均耗时）"""
+        eta = self.scheduler.eta(lane, self.scheduler.pending(lane))
+        if eta is None:
+            waiting = max(0, self.outstanding - self.max_inflight)
+            eta = self._latency_ewma * (waiting + 1) / max(1, self.max_inflight)
+        return max(1.0, eta)
+
+    def _call(self, lane: str, fn: Callable, args) -> Any:
+        with self.scheduler.slot(lane):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - t0
+                with self._lock:
+                    self._latency_ewma = (elapsed if not self._latency_ewma
+                                          else 0.8 * self._latency_ewma + 0.2 * elapsed)
+
+    async def run(self, fn: Callable, *args, lane: str = INTERACTIVE) -> Any:
+        """在指定通道内执行 fn(*args)（在线程池中）；在途 + 排队已满时抛出 Rejected"""
+        if self.outstanding >= self.max_inflight + self.max_queue:
+            self.stats["rejected"] += 1
+            counter("throttle_events").inc(kind="http_429")
+            raise Rejected(self.retry_after(lane))
+        self.outstanding += 1
+        self.stats["admitted"] += 1
+        try:
+            # 线程池不继承 contextvars：显式复制，线程内的 span 接在请求的 trace 下
+            ctx = contextvars.copy_context()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, ctx.run, self._call, lane, fn, args)
+        finally:
+            self.outstanding -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats, outstanding=self.outstanding, max_inflight=self.max_inflight,
+                    max_queue=self.max_queue, latency_ewma_s=round(self._latency_ewma, 3),
+                    lanes=self.scheduler.snapshot())
+
+
+def stub_backend(latency_s: float = 0.8) -> Callable:
+    """
+    假后端：固定耗时后返回统一 Schema 形状的结果（压测和联调用，不调用 API）。
+    """
+    def infer(image, engine: str = "stub", lang: str = "zh", task_type: str = "auto", **_):
+        time.sleep(latency_s)
+        return {
+            "task": task_type if task_type != "auto" else "fabric",
+            "summary": f"stub analysis of a {image.size[0]}x{image.size[1]} crop",
+            "details": {},
+            "recommendations": [],
+            "dfm_risks": [],
+            "next_actions": [],
+            "engine": engine,
+            "_meta": {"model": "stub", "lang": lang},
+        }
+    return infer
+
+
+def _parse_params(raw: Dict[str, Any]) -> Dict[str, Any]:
+    params = dict(DEFAULT_PARAMS)
+    for name, kind in PARAMS.items():
+        if name not in raw or raw[name] in (None, ""):
+            continue
+        value = raw[name]
+        try:
+            if kind is bool:
+                truthy = str(value).lower() in ("1", "true", "yes", "on")
+                params[name] = value if isinstance(value, bool) else truthy
+            else:
+                params[name] = kind(value)
+        except (TypeError, ValueError):
+            raise BadRequest(f"invalid parameter {name!r}")
+    return params
+
+
+async def _read_request(request) -> Tuple[List[bytes], Dict[str, Any]]:
+    """解析请求体，返回 (图片字节列表, 分析参数)"""
+    images: List[bytes] = []
+    raw: Dict[str, Any] = {}
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "image":
+                images.append(await part.read())
+            elif part.name:
+                raw[part.name] = await part.text()
+    elif request.content_type == "application/json":
+        try:
+            body = await request.json()
+        except ValueError:
+            raise BadRequest("invalid JSON body")
+        if not isinstance(body, dict):
+            raise BadRequest("JSON body must be an object")
+        encoded = body.pop("images", None) or ([body.pop("image")] if body.get("image") else [])
+        try:
+            images = [base64.b64decode(s, validate=True) for s in encoded]
+        except (TypeError, ValueError):
+            raise BadRequest("images must be base64 strings")
+        raw = body
+    else:
+        raise BadRequest("expected multipart/form-data or application/json")
+    if not images:
+        raise BadRequest("no image provided")
+    return images, _parse_params(raw)
+
+
+def _json_error(status: int, message: str, headers: Optional[Dict[str, str]] = None, **extra):
+    return web.json_response(dict(error=message, **extra), status=status, headers=headers)
+
+
+class InferenceService:
+    """HTTP 路由 + 后端调用"""
+
+    def __init__(self, infer_fn: Optional[Callable] = None, max_inflight: int = MAX_INFLIGHT,
+                 max_queue: int = MAX_QUEUE, max_batch: int = MAX_BATCH):
+        if infer_fn is None:
+            from src.fabric_api_infer import cloud_infer
+            infer_fn = cached(cloud_infer)
+        self.infer_fn = infer_fn
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.admission: Optional[Admission] = None  # 需在事件循环内创建
+        self.started_at = time.time()
+
+    def _analyze(self, data: bytes, params: Dict[str, Any]) -> Dict[str, Any]:
+        """线程池中执行：解码（受像素上限保护）→ 分析"""
+        with span("http_analyze", task_type=params.get("task_type", "auto")):
+            try:
+                image, _ = decode_working(data)
+            except ImageTooLarge:
+                raise
+            except Exception as e:
+                raise BadRequest(f"cannot decode image: {e}")
+            return self.infer_fn(image, **params)
+
+    async def analyze_one(self, data: bytes, params: Dict[str, Any],
+                          lane: str = INTERACTIVE) -> Dict[str, Any]:
+        return await self.admission.run(self._analyze, data, params, lane=lane)
+
+    # ==================== 路由 ====================
+    async def healthz(self, request):
+        return web.json_response({"status": "ok",
+                                  "uptime_s": round(time.time() - self.started_at, 1),
+                                  "admission": self.admission.snapshot(),
+                                  "result_cache": get_result_cache().snapshot()})
+
+    async def analyze(self, request):
+        images, params = await _read_request(request)
+        if len(images) != 1:
+            raise BadRequest("use /v1/analyze/batch for multiple images")
+        t0 = time.perf_counter()
+        result = await self.analyze_one(images[0], params)
+        latency_ms = (time.perf_counter() - t0) * 1000
+        return web.json_response(result, headers={"X-Latency-Ms": f"{latency_ms:.0f}"},
+                                 dumps=lambda o: json.dumps(o, ensure_ascii=False, default=str))
+
+    async def analyze_batch(self, request):
+        images, params = await _read_request(request)
+        self._check_batch(images)
+        outcomes = await asyncio.gather(*(self.analyze_one(d, params, BULK) for d in images),
+                                        return_exceptions=True)
+        results = [self._item(i, o) for i, o in enumerate(outcomes)]
+        return web.json_response({"results": results},
+                                 dumps=lambda o: json.dumps(o, ensure_ascii=False, default=str))
+
+    async def analyze_stream(self, request):
+        images, params = await _read_request(request)
+        self._check_batch(images)
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+        await response.prepare(request)
+
+        async def emit(event: Dict[str, Any]):
+            line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+            await response.write(line.encode("utf-8"))
+
+        await emit({"event": "accepted", "count": len(images)})
+        t0 = time.perf_counter()
+
+        async def run(index: int, data: bytes):
+            try:
+                return index, await self.analyze_one(data, params, BULK)
+            except Exception as e:
+                return index, e
+
+        for next_done in asyncio.as_completed([run(i, d) for i, d in enumerate(images)]):
+            index, outcome = await next_done
+            await emit(dict(self._item(index, outcome), event="result",
+                            latency_ms=round((time.perf_counter() - t0) * 1000)))
+        await emit({"event": "done"})
+        await response.write_eof()
+        return response
+
+    def _check_batch(self, images: List[bytes]) -> None:
+        if len(images) > self.max_batch:
+            raise BadRequest(f"too many images ({len(images)} > {self.max_batch})")
+
+    @staticmethod
+    def _item(index: int, outcome: Any) -> Dict[str, Any]:
+        """批量/流式结果中的一项：成功为 result，失败为 error + status"""
+        if isinstance(outcome, Rejected):
+            return {"index": index, "status": 429, "error": str(outcome),
+                    "retry_after": outcome.retry_after}
+        if isinstance(outcome, ImageTooLarge):
+            return {"index": index, "status": 413, "error": str(outcome)}
+        if isinstance(outcome, BadRequest):
+            return {"index": index, "status": 400, "error": str(outcome)}
+        if isinstance(outcome, Exception):
+            return {"index": index, "status": 500, "error": f"{type(outcome).__name__}: {outcome}"}
+        return {"index": index, "status": 200, "result": outcome}
+
+    # ==================== 应用 ====================
+    async def _on_startup(self, app):
+        self.admission = Admission(LaneScheduler(capacity=self.max_inflight), self.max_queue)
+        # 每个已接纳的请求一个线程：排队发生在调度器里（按通道），不在线程池里
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_inflight + self.max_queue,
+                               thread_name_prefix="service-infer"))
+
+    def build(self, max_body_mb: float = MAX_BODY_MB):
+        """创建 aiohttp 应用"""
+
+        @web.middleware
+        async def errors(request, handler):
+            """把异常映射为 JSON 错误响应；每个请求记录为一个 trace（根 span http_request）"""
+            with span("http_request", root=True, method=request.method, route=request.path,
+                      bytes=request.content_length or 0) as s:
+                response = await handle(request, handler)
+                s.set(status_code=response.status)
+                if response.status >= 500:
+                    s.fail(f"HTTP {response.status}")
+                return response
+
+        async def handle(request, handler):
+            try:
+                return await handler(request)
+            except BadRequest as e:
+                return _json_error(400, str(e))
+            except Rejected as e:
+                return _json_error(429, str(e), retry_after=e.retry_after,
+                                   headers={"Retry-After": str(max(1, round(e.retry_after)))})
+            except ImageTooLarge as e:
+                return _json_error(413, str(e))
+            except web.HTTPException:
+                raise
+            except Exception as e:
+                log.error(f"{request.method} {request.path} failed: {type(e).__name__}: {e}")
+                return _json_error(500, f"{type(e).__name__}: {e}")
+
+        app = web.Application(client_max_size=int(max_body_mb * 1024 * 1024), middlewares=[errors])
+        app.on_startup.append(self._on_startup)
+        app.add_routes([
+            web.get("/healthz", self.healthz),
+            web.post("/v1/analyze", self.analyze),
+            web.post("/v1/analyze/batch", self.analyze_batch),
+            web.post("/v1/analyze/stream", self.analyze_stream),
+        ])
+        return app
+
+
+def create_app(infer_fn: Optional[Callable] = None, **kwargs):
+    """
+    创建 HTTP 服务应用。
+
+    Args:
+        infer_fn: 分析函数，以 fn(image, **params) 调用；默认带共享结果缓存的 cloud_infer（可传 stub_backend()）
+        kwargs: max_inflight / max_queue / max_batch，默认取环境变量
+
+    Returns:
+        aiohttp.web.Application
+
+    Raises:
+        RuntimeError: 未安装 aiohttp
+    """
+    if web is None:
+        raise RuntimeError("aiohttp 未安装。请运行: pip install aiohttp")
+    max_body_mb = kwargs.pop("max_body_mb", MAX_BODY_MB)
+    return InferenceService(infer_fn, **kwargs).build(max_body_mb)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+跨会话共享的解码图片缓存（按上传内容哈希去重）
+
+Streamlit 每次重跑脚本都会对整张上传图执行 Image.open(...).convert("RGB")，
+拖动裁剪框时每个拖动事件都会触发一次。本模块让每个不同的上传内容只解码一次：
+- 以内容哈希（blake2b）为键，同一张图被多个会话上传也只解码一次
+- 只常驻"工作图"（长边 ≤ IMAGE_WORKING_MAX_SIDE）：JPEG 用 draft 模式按 1/2、1/4、1/8
+  缩小解码，不展开全分辨率栅格；其它格式解码后立即缩小并丢弃原图
+- 选区（ROI）按需从原始字节以全分辨率解码，全分辨率解码的并发数受限；
+  选区输出长边不超过 IMAGE_ROI_MAX_SIDE（整幅选区不会在 100 MP 原图上产出数百 MB 的裁剪图）
+- 像素数超过 IMAGE_MAX_PIXELS 时拒绝解码（ImageTooLarge）。Pillow 的 DecompressionBomb
+  警告只在本模块的打开/解码过程中屏蔽，不改动 Pillow 的全局设置；Pillow 在超过其阈值两倍
+  （默认约 179 MP）时直接拒绝打开，IMAGE_MAX_PIXELS 设得更高也以该值为准
+- 超出内存预算时按 LRU 淘汰
+
+用法：
+    from src.image_store import get_image_store
+
+    entry = get_image_store().get_or_decode(uploaded.getvalue())
+    img = entry.image                    # RGB 工作图（共享对象，只读，不要原地修改）
+    thumb = entry.preview(512)           # 长边 ≤ 512 的预览（按需缩放，不缓存）
+    patch = entry.roi((x, y, w, h))      # 工作图坐标的选区，按原图分辨率解码
+"""
+
+from __future__ import annotations
+import hashlib
+import io
+import math
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from src.utils.tracing import span
+
+# 默认内存预算（MB），可通过环境变量覆盖
+DEFAULT_BUDGET_MB = int(os.getenv("IMAGE_STORE_BUDGET_MB", "512"))
+# 常驻工作图的长边上限（像素）
+WORKING_MAX_SIDE = int(os.getenv("IMAGE_WORKING_MAX_SIDE", "2048"))
+# 允许的最大像素数（默认 150 MP）
+MAX_IMAGE_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "150000000"))
+# 选区输出长边上限（像素）：未指定 max_side 时 roi() 按此缩小
+ROI_MAX_SIDE = int(os.getenv("IMAGE_ROI_MAX_SIDE", "4096"))
+# 同时进行的全分辨率解码数（限制并发上传时的峰值内存）
+_FULL_DECODE_SLOTS = threading.BoundedSemaphore(int(os.getenv("IMAGE_DECODE_CONCURRENCY", "2")))
+
+
+
+class ImageTooLarge(ValueError):
+    """上传图片像素数超过 MAX_IMAGE_PIXELS"""
+
+    def __init__(self, size: Optional[Tuple[int, int]], limit: int = MAX_IMAGE_PIXELS):
+        self.size = size
+        self.limit = limit
+        if size:
+            w, h = size
+            msg = f"image is {w}x{h} ({w * h / 1e6:.1f} MP), limit is {limit / 1e6:.0f} MP"
+        else:
+            msg = f"image exceeds the limit of {limit / 1e6:.0f} MP"
+        super().__init__(msg)
+
+
+def content_hash(data: bytes) -> str:
+    """上传内容哈希（作为缓存键）"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+@contextmanager
+def _bomb_checked_here() -> Iterator[None]:
+    """像素上限由本模块检查并给出明确提示：只在这里屏蔽 Pillow 的 DecompressionBomb 警告"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        yield
+
+
+def _open(data: bytes, limit: int = MAX_IMAGE_PIXELS) -> Image.Image:
+    """只读文件头打开图片并检查像素数（不解码栅格）"""
+    try:
+        with _bomb_checked_here():
+            im = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        # PIL 在超过其阈值两倍时直接拒绝打开，拿不到尺寸
+        raise ImageTooLarge(None, limit) from None
+    if im.width * im.height > limit:
+        raise ImageTooLarge(im.size, limit)
+    return im
+
+
+def probe(data: bytes) -> Tuple[str, Tuple[int, int]]:
+    """
+    读取格式和原始尺寸（不解码）。
+
+    Raises:
+        ImageTooLarge: 像素数超过 MAX_IMAGE_PIXELS
+    """
+    im = _open(data)
+    return im.format or "", im.size
+
+
+def decode_working(data: bytes,
+                   max_side: int = WORKING_MAX_SIDE) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    解码为长边 ≤ max_side 的 RGB 工作图。
+
+    JPEG 通过 draft 直接以 1/2、1/4、1/8 缩小解码；其它格式需要完整解码（占用并发槽位），
+    缩小后立即释放原图栅格。
+
+    Returns:
+        (工作图, 原图尺寸)
+
+    Raises:
+        ImageTooLarge: 像素数超过 MAX_IMAGE_PIXELS
+    """
+    with span("decode", bytes=len(data)) as s:
+        im = _open(data)
+        full_size = im.size
+        s.set(format=im.format, size=list(full_size))
+        if max(full_size) <= max_side:
+            with _FULL_DECODE_SLOTS, _bomb_checked_here():
+                return im.convert("RGB"), full_size
+        if im.format == "JPEG":
+            # draft 选不小于目标尺寸的最大缩小比例（1/2、1/4、1/8），解码后再缩放到目标
+            k = max_side / max(full_size)
+            im.draft("RGB", (math.ceil(full_size[0] * k), math.ceil(full_size[1] * k)))
+            with _bomb_checked_here():
+                im.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+        else:
+            with _FULL_DECODE_SLOTS, _bomb_checked_here():
+                im.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+        return (im if im.mode == "RGB" else im.convert("RGB")), full_size
+
+
+@dataclass
+class DecodedImage:
+    """一张已解码的上传图（image 为工作图；原图尺寸较大时保留原始字节用于 ROI 解码）"""
+    key: str
+    image: Image.Image
+    data: Optional[bytes] = field(default=None, repr=False)
+    full_size: Optional[Tuple[int, int]] = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def original_size(self) -> Tuple[int, int]:
+        return self.full_size or self.image.size
+
+    @property
+    def nbytes(self) -> int:
+        return _image_nbytes(self.image) + len(self.data or b"")
+
+    def roi(self, box: Tuple[int, int, int, int], max_side: Optional[int] = None) -> Image.Image:
+        """
+        按原图分辨率解码选区。
+
+        Args:
+            box: (x, y, w, h)，工作图坐标
+            max_side: 选区长边上限（默认 ROI_MAX_SIDE）；JPEG 以能满足该尺寸的最小 draft 比例解码
+
+        Returns:
+            RGB 选区图片
+        """
+        with span("crop", box=list(box)) as s:
+            patch = self._roi(box, max_side or ROI_MAX_SIDE)
+            s.set(size=list(patch.size))
+            return patch
+
+    def _roi(self, box: Tuple[int, int, int, int], max_side: int) -> Image.Image:
+        x, y, w, h = box
+        if self.data is None or self.original_size == self.image.size:
+            patch = self.image.crop((x, y, x + w, y + h))
+            if max(patch.size) > max_side:
+                patch.thumbnail((max_side, max_side), Image.BILINEAR)
+            return patch
+
+        W, H = self.original_size
+        sx, sy = W / self.image.width, H / self.image.height
+        fx0, fy0 = max(0, math.floor(x * sx)), max(0, math.floor(y * sy))
+        fx1, fy1 = min(W, math.ceil((x + w) * sx)), min(H, math.ceil((y + h) * sy))
+
+        im = _open(self.data)
+        reduce = max(1.0, max(fx1 - fx0, fy1 - fy0) / max_side)
+        with _FULL_DECODE_SLOTS, _bomb_checked_here():
+            if im.format == "JPEG" and reduce >= 2:
+                im.draft("RGB", (math.ceil(W / reduce), math.ceil(H / reduce)))
+            ds = W / im.size[0]  # draft 实际缩小比例（1/2/4/8）
+            patch = im.crop((int(fx0 / ds), int(fy0 / ds), math.ceil(fx1 / ds),
+                             math.ceil(fy1 / ds)))
+            patch = patch if patch.mode == "RGB" else patch.convert("RGB")
+            del im  # 释放完整栅格，只保留选区
+        if max(patch.size) > max_side:
+            patch.thumbnail((max_side, max_side), Image.BILINEAR)
+        return patch
+
+    def preview(self, max_side: int) -> Image.Image:
+        """长边不超过 max_side 的预览：按需从工作图缩放（不缓存）；工作图足够小时直接返回工作图"""
+        if max(self.image.size) <= max_side:
+            return self.image
+        scale = max_side / max(self.image.size)
+        size = (max(1, round(self.image.width * scale)), max(1, round(self.image.height * scale)))
+        return self.image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+class DecodedImageStore:
+    """线程安全的 LRU 解码缓存，所有会话共享"""
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, DecodedImage]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.stats = {"hits": 0, "decodes": 0, "evictions": 0}
+
+    def _decode(self, key: str, data: bytes) -> DecodedImage:
+        img, full_size = decode_working(data)
+        # 工作图即原图时不需要保留原始字节
+        raw = data if full_size != img.size else None
+        return DecodedImage(key=key, image=img, data=raw, full_size=full_size)
+
+    def get(self, key: str) -> Optional[DecodedImage]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+            return entry
+
+    def peek_nbytes(self, key: str) -> int:
+        """条目占用字节数（不计命中、不调整 LRU 顺序；不存在时为 0）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.nbytes if entry is not None else 0
+
+    def get_or_decode(self, data: bytes, key: Optional[str] = None) -> DecodedImage:
+        """
+        按内容哈希取图，未缓存时解码并加入缓存。
+
+        Args:
+            data: 上传文件的原始字节
+            key: 已知的内容哈希（可省略，省去重复计算）
+
+        Returns:
+            DecodedImage
+
+        Raises:
+            ImageTooLarge: 像素数超过 MAX_IMAGE_PIXELS
+            PIL 解码异常（文件损坏/格式不支持）
+        """
+        key = key or content_hash(data)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    # 当前线程负责解码，其它会话等待同一结果
+                    self._inflight[key] = threading.Event()
+                    break
+            waiter.wait()
+
+        try:
+            entry = self._decode(key, data)
+            with self._lock:
+                self._entries[key] = entry
+                self._bytes += entry.nbytes
+                self.stats["decodes"] += 1
+                self._evict_locked(keep=key)
+            return entry
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def _evict_locked(self, keep: str) -> None:
+        while self._bytes > self.budget_bytes and len(self._entries) > 1:
+            old_key = next(iter(self._entries))
+            if old_key == keep:
+                self._entries.move_to_end(old_key)
+                continue
+            old = self._entries.pop(old_key)
+            self._bytes -= old.nbytes
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """缓存状态：条目数、占用字节、命中/解码/淘汰次数"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes,
+                        budget_bytes=self.budget_bytes)
+
+
+_store: Optional[DecodedImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> DecodedImageStore:
+    """进程级单例（Streamlit 所有会话共享同一个进程）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DecodedImageStore()
+    return _store
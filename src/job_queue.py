@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+本地持久化任务队列（SQLite）
+
+InferenceExecutor 的任务只存在于 Streamlit 进程内：服务重启即丢失，扩容推理只能扩容整个 UI。
+JobQueue 把 cloud_infer 任务（裁剪图 PNG + 参数）写入 SQLite，由独立的 worker 进程消费：
+- 租约：worker 领取任务时写入 lease_owner / lease_until，运行中定期续租；
+  worker 崩溃后租约过期，任务被其它 worker 重新领取
+- 重试：抛出异常或返回失败结果（engine == "error"）的任务按指数退避重新排队，超过 max_attempts 记为失败
+- 回写：结果以 JSON 写回同一行，UI / CLI 按任务 id 读取
+- 限速：QUEUE_RATE_PER_MIN > 0 时所有 worker 合计每分钟最多开始这么多次调用（含重试，
+  每次领取在 attempts_log 表记一行），worker 数增加时吞吐线性增长直到触及该上限
+
+UI 只在设置了 JOB_QUEUE_DB 时改走队列（见 app_new.py），worker 由 scripts/job_queue.py 启动。
+
+用法：
+    from src.job_queue import get_job_queue
+
+    q = get_job_queue()
+    job_id = q.enqueue(patch, {"engine": "qwen-vl", "lang": "zh"}, session_id="abc")
+    ...
+    job = q.get(job_id)
+    if job.status == "done":
+        render(job.result)
+"""
+
+from __future__ import annotations
+import io
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+from src.jobs import CANCELLED, DONE, ERROR, QUEUED, RUNNING
+from src.utils.tracing import record_span, span
+
+# 队列数据库路径；UI 仅在设置了该变量时使用持久化队列
+QUEUE_DB = os.getenv("JOB_QUEUE_DB", "")
+DEFAULT_DB = str(Path(__file__).resolve().parents[1] / "cache" / "job_queue.sqlite3")
+# 租约时长（秒）：worker 每 LEASE_S / 3 续租一次
+LEASE_S = float(os.getenv("QUEUE_LEASE_S", "60"))
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# 重试退避基数（秒）：第 n 次失败后等待 RETRY_BACKOFF_S * 2^(n-1)
+RETRY_BACKOFF_S = float(os.getenv("QUEUE_RETRY_BACKOFF_S", "2"))
+# 所有 worker 合计每分钟最多开始的调用数（0 为不限）
+RATE_PER_MIN = int(os.getenv("QUEUE_RATE_PER_MIN", "0"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            TEXT PRIMARY KEY,
+    session_id    TEXT,
+    status        TEXT NOT NULL,
+    image         BLOB,
+    params        TEXT NOT NULL,
+    meta          TEXT NOT NULL DEFAULT '{}',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL,
+    available_at  REAL NOT NULL,
+    lease_owner   TEXT,
+    lease_until   REAL,
+    submitted_at  REAL NOT NULL,
+    started_at    REAL,
+    finished_at   REAL,
+    result        TEXT,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_started ON jobs (started_at);
+-- 每次领取（含重试）一行：jobs.started_at 重试时会被覆盖，限速按这里计数
+CREATE TABLE IF NOT EXISTS attempts_log (
+    job_id        TEXT NOT NULL,
+    attempt       INTEGER NOT NULL,
+    started_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_started ON attempts_log (started_at);
+"""
+
+_FINISHED = (DONE, ERROR, CANCELLED)
+
+
+@dataclass
+class QueuedJob:
+    """队列中的一个任务（字段与 InferenceJob 对齐，页面可按同样方式轮询）"""
+    id: str
+    session_id: Optional[str]
+    status: str
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    attempts: int = 0
+    max_attempts: int = MAX_ATTEMPTS
+    lease_owner: Optional[str] = None
+    result: Any = None
+    error: Optional[str] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.submitted_at
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+
+def _encode_image(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=1)  # 无损；压缩级别低，写入快
+    return buf.getvalue()
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    im = Image.open(io.BytesIO(data))
+    return im if im.mode == "RGB" else im.convert("RGB")
+
+
+class JobQueue:
+    """SQLite 任务队列（每个线程一个连接，WAL 模式，多进程安全）"""
+
+    def __init__(self, path: str = DEFAULT_DB, lease_s: float = LEASE_S,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_s: float = RETRY_BACKOFF_S,
+                 rate_per_min: int = RATE_PER_MIN):
+        self.path = path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.rate_per_min = rate_per_min
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：手动 BEGIN IMMEDIATE，领取任务时整表写锁，避免两个 worker 领到同一行
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ==================== 生产端 ====================
+    def enqueue(self, image: Image.Image, params: Dict[str, Any], session_id: Optional[str] = None,
+                meta: Optional[Dict[str, Any]] = None, max_attempts: Optional[int] = None) -> str:
+        """
+        写入一个分析任务。
+
+        Args:
+            image: 要分析的图片（以 PNG 存入数据库）
+            params: cloud_infer 的关键字参数（需可 JSON 序列化）
+            session_id: 提交任务的会话（仅用于查询）
+            meta: 附加信息，原样保存
+
+        Returns:
+            任务 id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, session_id, status, image, params, meta, max_attempts,"
+            " available_at, submitted_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, session_id, QUEUED, _encode_image(image),
+             json.dumps(params, ensure_ascii=False),
+             json.dumps(meta or {}, ensure_ascii=False, default=str),
+             max_attempts or self.max_attempts, now, now))
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """取消未结束的任务；运行中的任务由 worker 照常跑完，但结果不再写回"""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, image = NULL"
+            " WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+        return cur.rowcount > 0
+
+    def get(self, job_id: Optional[str]) -> Optional[QueuedJob]:
+        if not job_id:
+            return None
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def recent(self, status: Optional[str] = None, limit: int = 50) -> List[QueuedJob]:
+        """最近提交的任务（可按状态过滤）"""
+        sql, args = "SELECT * FROM jobs", []
+        if status:
+            sql, args = sql + " WHERE status = ?", [status]
+        rows = self._conn().execute(sql + " ORDER BY submitted_at DESC LIMIT ?",
+                                    (*args, limit)).fetchall()
+        return [self._to_job(r) for r in rows]
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> QueuedJob:
+        return QueuedJob(
+            id=row["id"], session_id=row["session_id"], status=row["status"],
+            submitted_at=row["submitted_at"], started_at=row["started_at"],
+            finished_at=row["finished_at"], attempts=row["attempts"],
+            max_attempts=row["max_attempts"], lease_owner=row["lease_owner"],
+            result=json.loads(row["result"]) if row["result"] else None, error=row["error"],
+            params=json.loads(row["params"]), meta=json.loads(row["meta"]))
+
+    # ==================== 消费端 ====================
+    def claim(self, owner: str) -> Optional[tuple]:
+        """
+        领取一个可执行的任务（排队中且到了可执行时间，或租约已过期的运行中任务）。
+
+        Args:
+            owner: worker 标识
+
+        Returns:
+            (job_id, image, params)；没有可领取的任务或触及限速时返回 None
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 租约过期且已用完重试次数的任务直接判失败
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'lease expired', finished_at = ?, image = NULL"
+                " WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                (ERROR, now, RUNNING, now))
+            if self.rate_per_min > 0:
+                started = conn.execute("SELECT COUNT(*) FROM attempts_log WHERE started_at > ?",
+                                       (now - 60,)).fetchone()[0]
+                if started >= self.rate_per_min:
+                    conn.execute("COMMIT")
+                    return None
+            row = conn.execute(
+                "SELECT id, image, params, attempts FROM jobs"
+                " WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?)"
+                " ORDER BY submitted_at LIMIT 1",
+                (QUEUED, now, RUNNING, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_until = ?,"
+                " attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (RUNNING, owner, now + self.lease_s, now, row["id"]))
+            conn.execute("INSERT INTO attempts_log (job_id, attempt, started_at) VALUES (?, ?, ?)",
+                         (row["id"], row["attempts"] + 1, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row["id"], _decode_image(row["image"]), json.loads(row["params"])
+
+    def extend(self, job_id: str, owner: str) -> bool:
+        """续租；返回 False 表示租约已被他人接管或任务已取消"""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+            (time.time() + self.lease_s, job_id, owner, RUNNING))
+        return cur.rowcount > 0
+
+    def complete(self, job_id: str, owner: str, result: Any) -> bool:
+        """写回结果；租约已失效（被接管/取消）时丢弃并返回 False"""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ?,"
+            " lease_until = NULL, image = NULL WHERE id = ? AND lease_owner = ? AND status = ?",
+            (DONE, json.dumps(result, ensure_ascii=False, default=str), time.time(),
+             job_id, owner, RUNNING))
+        return cur.rowcount > 0
+
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        """记录一次失败：未用完重试次数时按指数退避重新排队，否则判失败"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs"
+                " WHERE id = ? AND lease_owner = ? AND status = ?",
+                (job_id, owner, RUNNING)).fetchone()
+            if row is not None:
+                if row["attempts"] < row["max_attempts"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, available_at = ?,"
+                        " lease_owner = NULL, lease_until = NULL WHERE id = ?",
+                        (QUEUED, error, now + self.backoff_s * 2 ** (row["attempts"] - 1), job_id))
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ?,"
+                        " lease_until = NULL, image = NULL WHERE id = ?",
+                        (ERROR, error, now, job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    # ==================== 维护 ====================
+    def purge(self, older_than_s: float) -> int:
+        """删除结束超过 older_than_s 秒的任务（及早于该时间的领取记录）"""
+        conn = self._conn()
+        cutoff = time.time() - older_than_s
+        cur = conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(_FINISHED))})"
+            " AND finished_at < ?",
+            (*_FINISHED, cutoff))
+        conn.execute("DELETE FROM attempts_log WHERE started_at < ?",
+                     (min(cutoff, time.time() - 60),))
+        return cur.rowcount
+
+    def snapshot(self) -> Dict[str, int]:
+        """各状态任务数 + 最近一分钟开始的调用数（含重试）"""
+        conn = self._conn()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0, CANCELLED: 0}
+        for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        counts["started_last_min"] = conn.execute(
+            "SELECT COUNT(*) FROM attempts_log WHERE started_at > ?",
+            (time.time() - 60,)).fetchone()[0]
+        return counts
+
+
+# ==================== Worker ====================
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def run_worker(queue: JobQueue, fn: Optional[Callable] = None,
+               stop: Optional[threading.Event] = None, poll_s: float = 0.5, log=None) -> int:
+    """
+    worker 主循环：领取 → 执行（运行中续租）→ 写回 / 重试，直到 stop 被设置。
+
+    cloud_infer 不抛异常，后端失败以 {"engine": "error", "reasoning": ...} 返回；
+    这类结果和异常一样记为一次失败（重试 / 判失败），不作为结果写回。
+
+    Args:
+        queue: 任务队列
+        fn: 分析函数，以 fn(image, **params) 调用；默认带共享结果缓存的 cloud_infer
+        stop: 停止信号（threading.Event 或 multiprocessing.Event）
+        poll_s: 队列为空时的轮询间隔
+
+    Returns:
+        本 worker 处理的任务数
+    """
+    if fn is None:
+        from src.fabric_api_infer import cloud_infer
+        from src.result_cache import cached
+        fn = cached(cloud_infer)  # 多个 worker / 实例共享已付费的结果
+    owner = worker_id()
+    handled = 0
+    while stop is None or not stop.is_set():
+        claimed = queue.claim(owner)
+        if claimed is None:
+            time.sleep(poll_s)
+            continue
+        job_id, image, params = claimed
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(queue.lease_s / 3):
+                if not queue.extend(job_id, owner):
+                    return
+
+        beat = threading.Thread(target=heartbeat, daemon=True, name=f"lease-{job_id[:8]}")
+        beat.start()
+        # 提交方在 meta["trace"] 中带上追踪上下文时，worker 的 span 接在同一 trace 下
+        job = queue.get(job_id)
+        parent = job.meta.get("trace") if job else None
+        with span("queue_job", parent=parent, root=not parent, job_id=job_id, worker=owner) as s:
+            if job is not None:
+                record_span("queue_wait", int(job.submitted_at * 1e9), queue="job_queue",
+                            attempts=job.attempts)
+            try:
+                result = fn(image, **params)
+                if isinstance(result, dict) and result.get("engine") == "error":
+                    error = str(result.get("reasoning") or "engine error")
+                    s.fail(error)
+                    ok = queue.fail(job_id, owner, error)
+                else:
+                    ok = queue.complete(job_id, owner, result)
+            except Exception as e:
+                s.fail(e)
+                ok = queue.fail(job_id, owner, f"{type(e).__name__}: {e}")
+            finally:
+                done.set()
+        handled += 1
+        if log is not None:
+            outcome = "written back" if ok else "lease lost, result dropped"
+            log.info(f"worker {owner} job {job_id} {outcome}")
+    return handled
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def queue_enabled() -> bool:
+    """UI 是否改走持久化队列（设置了 JOB_QUEUE_DB）"""
+    return bool(QUEUE_DB)
+
+
+def get_job_queue() -> JobQueue:
+    """进程级单例（路径取 JOB_QUEUE_DB，未设置时为 cache/job_queue.sqlite3）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(QUEUE_DB or DEFAULT_DB)
+    return _queue
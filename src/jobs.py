@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+后台推理执行器（可取消、可替换、按会话限流）
+
+分析按钮原先在 st.spinner 下同步调用 cloud_infer，整页冻结直到返回，
+重复点击还会发起第二个重叠请求。InferenceExecutor 把分析提交到后台线程池：
+- 页面轮询任务状态，不阻塞脚本线程
+- 可取消：排队中的任务直接取消；运行中的任务无法中断网络调用，结果会被丢弃
+- 可替换：同一会话提交新任务时取消旧任务
+- 每个会话的在途任务数有上限（已取消但仍在运行的任务也计入，它们仍占用后端）
+
+SpeculativeRunner 在选区停稳一段时间后预先提交分析（可选），用户点击时如果选区和参数
+都没变就直接取用这次预分析；选区变化时取消或丢弃，并统计命中率和浪费率。
+
+用法：
+    from src.jobs import get_executor, SessionBusy
+
+    job = get_executor().submit(session_id, cloud_infer, patch, engine="qwen-vl")
+    ...
+    job = get_executor().get(job.id)
+    if job.status == "done":
+        render(job.result)
+"""
+
+from __future__ import annotations
+import contextvars
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from src.utils.metrics import counter
+from src.utils.tracing import current_span, record_span
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+
+DEFAULT_WORKERS = int(os.getenv("INFER_WORKERS", "4"))
+# 批量任务独立线程池：排队等后端空位的批量任务不占用交互分析的线程
+BULK_WORKERS = int(os.getenv("BULK_INFER_WORKERS", "4"))
+# 选区停稳多久后开始预分析（秒）
+SPECULATIVE_IDLE_S = float(os.getenv("SPECULATIVE_IDLE_S", "1.5"))
+# 超过该时长没有调用的会话视为已离开，释放其预分析状态（秒）
+SPECULATIVE_SESSION_TTL = int(os.getenv("SPECULATIVE_SESSION_TTL", "3600"))
+DEFAULT_SESSION_LIMIT = int(os.getenv("INFER_SESSION_LIMIT", "2"))
+# 准入控制：整个进程在途 + 排队的交互任务上限（默认等于线程数，被接纳的任务都能立即进入后端排队）
+MAX_PENDING = int(os.getenv("INFER_MAX_PENDING", str(DEFAULT_WORKERS)))
+# 已结束任务的保留时间（秒）
+FINISHED_TTL = 600
+
+
+class SessionBusy(Exception):
+    """会话在途任务数已达上限"""
+
+
+class Overloaded(SessionBusy):
+    """进程在途 + 排队任务数已达上限（准入控制拒绝，调用方应稍后重试）"""
+
+
+@dataclass
+class InferenceJob:
+    """一次后台分析任务"""
+    id: str
+    session_id: str
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status: str = QUEUED
+    result: Any = None
+    error: Optional[str] = None
+    cancelled: bool = False
+    meta: Dict[str, Any] = field(default_factory=dict)
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def active(self) -> bool:
+        """是否仍需等待（已取消的任务对调用方而言不再活跃）"""
+        return self.status in (QUEUED, RUNNING) and not self.cancelled
+
+    @property
+    def occupying(self) -> bool:
+        """是否仍占用后端（含已取消但仍在运行的任务）"""
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at or time.time()
+        return end - self.submitted_at
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+
+class InferenceExecutor:
+    """线程池 + 会话级限流的后台执行器"""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS,
+                 per_session_limit: int = DEFAULT_SESSION_LIMIT, max_pending: Optional[int] = None):
+        self.max_workers = max_workers
+        self.per_session_limit = per_session_limit
+        self.max_pending = max_pending  # None 为不限
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="infer")
+        self._jobs: Dict[str, InferenceJob] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _run(self, job: InferenceJob, fn: Callable, args, kwargs):
+        with self._lock:
+            if job.cancelled:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                return None
+            job.status = RUNNING
+            job.started_at = time.time()
+        if current_span() is not None:  # 提交方在追踪中：补记线程池排队时间
+            record_span("queue_wait", int(job.submitted_at * 1e9), int(job.started_at * 1e9),
+                        queue="executor", job_id=job.id)
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                job.result = None if job.cancelled else result
+                job.status = CANCELLED if job.cancelled else DONE
+            return result
+        except Exception as e:
+            with self._lock:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = CANCELLED if job.cancelled else ERROR
+            return None
+        finally:
+            job.finished_at = time.time()
+
+    def submit(self, session_id: str, fn: Callable, *args, replace: bool = True,
+               meta: Optional[Dict[str, Any]] = None, limit: Optional[int] = None,
+               **kwargs) -> InferenceJob:
+        """
+        提交后台任务。
+
+        Args:
+            session_id: 会话标识（用于限流和替换）
+            fn: 要执行的函数（通常是 cloud_infer）
+            replace: 是否取消该会话尚未完成的任务（仅在新任务被接纳后取消；被拒绝时旧任务照常进行）
+            meta: 附加信息（如 ROI、参数），原样保存在 job.meta
+            limit: 覆盖该会话的在途任务上限（如批量分析按自身并发度提交）
+
+        Returns:
+            InferenceJob
+
+        Raises:
+            SessionBusy: 会话占用后端的任务数已达上限
+            Overloaded: 进程占用后端的任务数已达 max_pending（SessionBusy 的子类）
+        """
+        with self._lock:
+            self._prune_locked()
+            # 先做准入检查，被接纳后才取消旧任务：被拒绝的重新提交不能把正在进行的分析也丢掉。
+            # 被替换的排队任务会被直接撤销，不计入占用；运行中的被替换任务仍占用后端
+            replaced = [j for j in self._jobs.values()
+                        if replace and j.session_id == session_id and j.active]
+            freed = {j.id for j in replaced if j.status == QUEUED}
+            occupying = sum(1 for j in self._jobs.values()
+                            if j.session_id == session_id and j.occupying and j.id not in freed)
+            if occupying >= (self.per_session_limit if limit is None else limit):
+                counter("throttle_events").inc(kind="session_busy")
+                raise SessionBusy(f"session {session_id} has {occupying} jobs in flight")
+            if self.max_pending is not None:
+                pending = sum(1 for j in self._jobs.values() if j.occupying and j.id not in freed)
+                if pending >= self.max_pending:
+                    self.rejected += 1
+                    counter("throttle_events").inc(kind="overloaded")
+                    raise Overloaded(
+                        f"{pending} jobs in flight or queued (limit {self.max_pending})")
+            for old in replaced:
+                self._cancel_locked(old)
+            job = InferenceJob(id=f"job-{next(self._ids)}", session_id=session_id,
+                               meta=dict(meta or {}))
+            self._jobs[job.id] = job
+            # 复制提交方的上下文：工作线程中的追踪 span 接在提交方的 span 下
+            job.future = self._pool.submit(contextvars.copy_context().run, self._run,
+                                           job, fn, args, kwargs)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务；排队中的直接撤销，运行中的丢弃结果"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.occupying:
+                return False
+            self._cancel_locked(job)
+            return True
+
+    def _cancel_locked(self, job: InferenceJob) -> None:
+        job.cancelled = True
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.finished_at = time.time()
+
+    def get(self, job_id: Optional[str]) -> Optional[InferenceJob]:
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def session_jobs(self, session_id: str) -> List[InferenceJob]:
+        with self._lock:
+            return [j for j in self._jobs.values() if j.session_id == session_id]
+
+    def _prune_locked(self) -> None:
+        cutoff = time.time() - FINISHED_TTL
+        for job_id in [k for k, j in self._jobs.items()
+                       if not j.occupying and (j.finished_at or 0) < cutoff]:
+            del self._jobs[job_id]
+
+    def snapshot(self) -> Dict[str, int]:
+        """各状态的任务数 + 准入控制拒绝次数"""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, ERROR: 0, CANCELLED: 0}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            counts["rejected"] = self.rejected
+            return counts
+
+
+_executor: Optional[InferenceExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> InferenceExecutor:
+    """进程级单例（所有 Streamlit 会话共享线程池）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = InferenceExecutor(max_pending=MAX_PENDING)
+    return _executor
+
+
+_bulk_executor: Optional[InferenceExecutor] = None
+
+
+def get_bulk_executor() -> InferenceExecutor:
+    """批量任务的进程级单例（与 get_executor() 线程池分开，后端并发由 src.scheduler 统一分配）"""
+    global _bulk_executor
+    if _bulk_executor is None:
+        with _executor_lock:
+            if _bulk_executor is None:
+                _bulk_executor = InferenceExecutor(max_workers=BULK_WORKERS)
+    return _bulk_executor
+
+
+@dataclass
+class _Speculation:
+    key: str
+    timer: Optional[threading.Timer] = None
+    job_id: Optional[str] = None
+
+
+class SpeculativeRunner:
+    """
+    选区停稳后的预分析。
+
+    每个会话最多一个待定的预分析：schedule() 以新的键重新计时，旧的预分析若已提交则取消
+    （运行中的结果丢弃，记为浪费）；claim() 在键一致且已提交时返回该任务（命中）。
+    会话状态在 SPECULATIVE_SESSION_TTL 内无调用时清理（会话结束不会有通知）。
+    """
+
+    def __init__(self, executor: InferenceExecutor, idle_s: float = SPECULATIVE_IDLE_S):
+        self.executor = executor
+        self.idle_s = idle_s
+        self._pending: Dict[str, _Speculation] = {}
+        # 每个会话最近一次点击时的键：之后对同一键不再预分析（结果已由点击得到）
+        self._claimed: Dict[str, str] = {}
+        self._seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {"scheduled": 0, "started": 0, "hits": 0, "misses": 0, "wasted": 0,
+                      "skipped": 0}
+
+    def schedule(self, session_id: str, key: str, fn: Callable, *args,
+                 meta: Optional[Dict[str, Any]] = None, **kwargs) -> None:
+        """
+        选区（或参数）变化时调用；idle_s 内没有再次变化才真正提交。
+
+        Args:
+            session_id: 会话标识
+            key: 选区 + 参数的组合键，键不变时重复调用不重新计时
+            fn, args, kwargs: 要执行的分析（同 InferenceExecutor.submit）
+        """
+        with self._lock:
+            self._touch_locked(session_id)
+            current = self._pending.get(session_id)
+            if current is not None and current.key == key:
+                return
+            if self._claimed.get(session_id) == key:
+                if current is not None:
+                    self._discard_locked(self._pending.pop(session_id))
+                return
+            if current is not None:
+                self._discard_locked(current)
+            spec = _Speculation(key=key)
+            spec.timer = threading.Timer(self.idle_s, self._fire,
+                                         (session_id, spec, fn, args, kwargs, meta))
+            spec.timer.daemon = True
+            self._pending[session_id] = spec
+            self.stats["scheduled"] += 1
+        spec.timer.start()
+
+    def _fire(self, session_id: str, spec: _Speculation, fn: Callable, args, kwargs, meta) -> None:
+        with self._lock:
+            if self._pending.get(session_id) is not spec:
+                return
+            try:
+                job = self.executor.submit(session_id, fn, *args, replace=False,
+                                           meta=dict(meta or {}, speculative=True, key=spec.key),
+                                           **kwargs)
+            except SessionBusy:
+                self._pending.pop(session_id, None)
+                self.stats["skipped"] += 1
+                return
+            spec.job_id = job.id
+            self.stats["started"] += 1
+
+    def claim(self, session_id: str, key: str) -> Optional[InferenceJob]:
+        """
+        用户点击分析时调用：键一致且预分析已提交则返回该任务，否则丢弃预分析并返回 None。
+        """
+        with self._lock:
+            self._touch_locked(session_id)
+            self._claimed[session_id] = key
+            spec = self._pending.pop(session_id, None)
+            if spec is not None and spec.key == key and spec.job_id is not None:
+                job = self.executor.get(spec.job_id)
+                if job is not None and job.status != ERROR and not job.cancelled:
+                    self.stats["hits"] += 1
+                    return job
+            if spec is not None:
+                self._discard_locked(spec)
+            self.stats["misses"] += 1
+            return None
+
+    def discard(self, session_id: str) -> None:
+        """放弃会话的待定预分析（如关闭预分析、清空选区）"""
+        with self._lock:
+            self._seen.pop(session_id, None)
+            self._claimed.pop(session_id, None)
+            spec = self._pending.pop(session_id, None)
+            if spec is not None:
+                self._discard_locked(spec)
+
+    def _touch_locked(self, session_id: str) -> None:
+        now = time.time()
+        self._seen[session_id] = now
+        cutoff = now - SPECULATIVE_SESSION_TTL
+        for sid in [s for s, ts in self._seen.items() if ts < cutoff]:
+            self._seen.pop(sid, None)
+            self._claimed.pop(sid, None)
+            spec = self._pending.pop(sid, None)
+            if spec is not None:
+                self._discard_locked(spec)
+
+    def _discard_locked(self, spec: _Speculation) -> None:
+        if spec.job_id is None:
+            if spec.timer is not None:
+                spec.timer.cancel()
+            self.stats["skipped"] += 1
+        else:
+            self.executor.cancel(spec.job_id)
+            self.stats["wasted"] += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        """计数 + 命中率（命中/点击）和浪费率（浪费/已提交）"""
+        with self._lock:
+            s = dict(self.stats)
+        clicks = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / clicks, 3) if clicks else 0.0
+        s["waste_rate"] = round(s["wasted"] / s["started"], 3) if s["started"] else 0.0
+        s["idle_s"] = self.idle_s
+        return s
+
+
+_speculator: Optional[SpeculativeRunner] = None
+
+
+def get_speculator() -> SpeculativeRunner:
+    """进程级单例（共享 get_executor() 的线程池）"""
+    global _speculator
+    if _speculator is None:
+        executor = get_executor()
+        with _executor_lock:
+            if _speculator is None:
+                _speculator = SpeculativeRunner(executor)
+    return _speculator
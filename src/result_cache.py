@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+跨实例共享的 cloud_infer 结果缓存
+
+负载均衡后面的多个应用实例各自重复着别的实例已经付过费的分析。ResultCache 以
+"图片内容哈希 + 分析参数"为键缓存分析结果，分两层查找：
+- 本地层：进程内 LRU（无网络开销，命中直接返回）
+- 远程层：一个或多个共享节点，按一致性哈希环分配键（增减节点只迁移约 1/N 的键）；
+  节点可以是 Redis 协议服务（redis://，标准库 socket 实现的 RESP 客户端，不依赖 redis-py）
+  或本机 SQLite 文件（sqlite:，同一台机器上的多个进程共享）
+- 远程命中的结果回填本地层；新结果同时写入两层
+- 远程节点不可用时按未命中处理，并在 RESULT_CACHE_DOWN_S 秒内跳过该节点，不拖慢分析
+- 分别统计本地层、远程层和整体的命中率
+
+失败结果（engine == "error"）和无法解析的模型输出不缓存。
+
+配置（环境变量）：
+    RESULT_CACHE=0                        关闭缓存
+    RESULT_CACHE_REMOTE=redis://10.0.0.5:6379/0,redis://10.0.0.6:6379/0
+    RESULT_CACHE_REMOTE=sqlite:cache/result_cache.sqlite3
+    RESULT_CACHE_TTL=604800               结果保存秒数
+    RESULT_CACHE_LOCAL_ITEMS=256          本地层条目上限
+
+本地测试可用 scripts/resp_server.py 启动 Redis 协议的替身服务。
+
+用法：
+    from src.result_cache import cached, get_result_cache
+
+    infer = cached(cloud_infer)            # 先查缓存，未命中再调用并写回
+    result = infer(patch, engine="qwen-vl", lang="zh")
+    get_result_cache().snapshot()          # {"local": {"hit_ratio": ...}, "remote": {...}, ...}
+"""
+
+from __future__ import annotations
+import bisect
+import functools
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlsplit
+
+from PIL import Image
+
+from src.utils.tracing import current_span, span
+
+try:
+    from src.utils.logger import get_logger
+    log = get_logger("result_cache")
+except Exception:
+    import logging
+    log = logging.getLogger("result_cache")
+
+ENABLED = os.getenv("RESULT_CACHE", "1") != "0"
+# 远程节点列表（逗号分隔）；为空时只用本地层
+REMOTE_SPEC = os.getenv("RESULT_CACHE_REMOTE", "")
+TTL_S = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+LOCAL_ITEMS = int(os.getenv("RESULT_CACHE_LOCAL_ITEMS", "256"))
+# 远程节点的连接/读写超时（秒）与故障后的跳过时长（秒）
+TIMEOUT_S = float(os.getenv("RESULT_CACHE_TIMEOUT_S", "0.5"))
+DOWN_S = float(os.getenv("RESULT_CACHE_DOWN_S", "10"))
+# 一致性哈希环上每个节点的虚拟节点数
+VNODES = 64
+# 键前缀：结果格式变化时递增，旧缓存自然失效
+KEY_PREFIX = "fpe:result:v1:"
+# 不影响结果的参数（只是加速手段），不参与缓存键
+_VOLATILE_PARAMS = ("prefetch_labels", "evidence_mode")
+# 只描述某一次调用的 _meta 字段（剖析文件路径、联网取证耗时统计），不写入缓存，命中时不会返回过期值
+_PER_CALL_META = ("profile", "evidence")
+
+
+def cache_key(image: Image.Image, params: Dict[str, Any]) -> str:
+    """图片像素内容 + 分析参数 -> 缓存键（与文件编码、来源实例无关）"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{image.mode}|{image.size}|".encode())
+    h.update(image.tobytes())
+    stable = {k: v for k, v in params.items() if k not in _VOLATILE_PARAMS}
+    h.update(json.dumps(stable, sort_keys=True, ensure_ascii=False, default=str).encode())
+    return KEY_PREFIX + h.hexdigest()
+
+
+def cacheable(result: Any) -> bool:
+    """只缓存成功的结果：调用失败（engine == "error"）和解析失败（带 _debug）的不缓存"""
+    return isinstance(result, dict) and result.get("engine") != "error" and "_debug" not in result
+
+
+def _storable(result: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉 _meta 中只属于本次调用的字段（浅拷贝，不修改调用方拿到的结果）"""
+    meta = result.get("_meta")
+    if not isinstance(meta, dict) or not any(k in meta for k in _PER_CALL_META):
+        return result
+    return {**result, "_meta": {k: v for k, v in meta.items() if k not in _PER_CALL_META}}
+
+
+# ==================== 存储后端 ====================
+class LRUBackend:
+    """进程内 LRU（线程安全）；值为序列化后的 bytes，取出即是新对象，调用方修改结果不会污染缓存"""
+
+    def __init__(self, max_items: int = LOCAL_ITEMS):
+        self.name = f"lru:{max_items}"
+        self.max_items = max_items
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: int = TTL_S) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """本机 SQLite 文件（每个线程一个连接，WAL 模式；同一台机器上的多个进程共享）"""
+
+    _PURGE_EVERY = 256  # 每写入这么多次清理一次过期条目
+
+    def __init__(self, path: str):
+        self.name = f"sqlite:{path}"
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS result_cache"
+            " (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value, expires FROM result_cache WHERE key = ?",
+                                   (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: int = TTL_S) -> None:
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO result_cache (key, value, expires) VALUES (?, ?, ?)",
+                     (key, value, time.time() + ttl))
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % self._PURGE_EVERY == 0
+        if purge:
+            conn.execute("DELETE FROM result_cache WHERE expires < ?", (time.time(),))
+
+
+class RespError(Exception):
+    """Redis 协议服务返回的错误（-ERR ...）"""
+
+
+class NodeDown(ConnectionError):
+    """节点处于故障跳过期（上一次连接失败后 down_s 秒内）"""
+
+
+class RedisBackend:
+    """
+    Redis 协议节点（RESP2，标准库 socket 实现）：只用 GET / SET EX / AUTH / SELECT / PING。
+
+    连接按节点复用（小型连接池）；网络故障时关闭连接并在 down_s 秒内直接报错，
+    由 ResultCache 按未命中处理。
+    """
+
+    def __init__(self, host: str, port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 timeout: float = TIMEOUT_S, down_s: float = DOWN_S, pool_size: int = 8):
+        self.name = f"redis://{host}:{port}/{db}"
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.timeout = timeout
+        self.down_s = down_s
+        self.pool_size = pool_size
+        self._pool: List[Tuple[socket.socket, Any]] = []
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisBackend":
+        """redis://[:password@]host[:port][/db]"""
+        parts = urlsplit(url)
+        db = int(parts.path.lstrip("/") or 0)
+        password = unquote(parts.password) if parts.password else None
+        return cls(parts.hostname or "127.0.0.1", parts.port or 6379, db, password, **kwargs)
+
+    # ---------- 协议 ----------
+    @staticmethod
+    def _encode(*args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    @classmethod
+    def _read_reply(cls, reader) -> Any:
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RespError(body.decode(errors="replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("connection closed")
+            return data[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [cls._read_reply(reader) for _ in range(size)]
+        raise ConnectionError(f"bad reply: {line[:40]!r}")
+
+    # ---------- 连接 ----------
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            self._roundtrip(conn, "AUTH", self.password)
+        if self.db:
+            self._roundtrip(conn, "SELECT", self.db)
+        return conn
+
+    def _roundtrip(self, conn, *args) -> Any:
+        conn[0].sendall(self._encode(*args))
+        return self._read_reply(conn[1])
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn[1].close()
+            conn[0].close()
+        except OSError:
+            pass
+
+    def command(self, *args) -> Any:
+        """
+        执行一条命令。
+
+        Raises:
+            ConnectionError: 节点不可达（NodeDown：处于故障跳过期）
+            RespError: 服务端返回错误
+        """
+        if time.monotonic() < self._down_until:
+            raise NodeDown(f"{self.name} marked down")
+        with self._lock:
+            pooled = self._pool.pop() if self._pool else None
+        # 池中的连接可能已被服务端关闭（重启、空闲超时）：失败后用新连接重试一次
+        for conn in ([pooled] if pooled else []) + [None]:
+            try:
+                conn = conn or self._connect()
+                reply = self._roundtrip(conn, *args)
+            except (OSError, ValueError) as e:  # socket.timeout / ConnectionError 都是 OSError
+                if conn is not None:
+                    self._close(conn)
+                error = e
+                continue
+            except RespError:
+                self._checkin(conn)
+                raise
+            self._checkin(conn)
+            return reply
+        self._down_until = time.monotonic() + self.down_s
+        raise ConnectionError(f"{self.name}: {error}") from error
+
+    def _checkin(self, conn) -> None:
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        self._close(conn)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: int = TTL_S) -> None:
+        self.command("SET", key, value, "EX", max(1, int(ttl)))
+
+    def ping(self) -> bool:
+        return self.command("PING") == "PONG"
+
+
+def backend_from_spec(spec: str):
+    """
+    按配置创建后端。
+
+    Args:
+        spec: "redis://host:port/db"、"sqlite:path" 或 "lru" / "lru:N"
+
+    Raises:
+        ValueError: 无法识别的配置
+    """
+    spec = spec.strip()
+    if spec.startswith(("redis://", "rediss://")):
+        if spec.startswith("rediss://"):
+            raise ValueError("TLS (rediss://) is not supported by the built-in RESP client")
+        return RedisBackend.from_url(spec)
+    if spec.startswith("sqlite:"):
+        path = spec[len("sqlite:"):]
+        return SQLiteBackend(path[2:] if path.startswith("//") else path)
+    if spec == "lru" or spec.startswith("lru:"):
+        return LRUBackend(int(spec.partition(":")[2] or LOCAL_ITEMS))
+    raise ValueError(f"unknown cache backend: {spec!r}")
+
+
+# ==================== 一致性哈希 ====================
+class HashRing:
+    """一致性哈希环：每个节点 vnodes 个虚拟点，键落到顺时针方向第一个点所属的节点"""
+
+    def __init__(self, nodes: Sequence[Any] = (), vnodes: int = VNODES):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: List[Any] = []
+        self.nodes: List[Any] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def add(self, node: Any) -> None:
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = self._hash(f"{node.name}#{i}")
+            idx = bisect.bisect(self._points, point)
+            self._points.insert(idx, point)
+            self._owners.insert(idx, node)
+
+    def remove(self, node: Any) -> None:
+        self.nodes.remove(node)
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o is not node]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def node_for(self, key: str) -> Optional[Any]:
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+# ==================== 两层缓存 ====================
+class ResultCache:
+    """本地 LRU + 远程一致性哈希节点的两层结果缓存（线程安全）"""
+
+    def __init__(self, local: Optional[LRUBackend] = None, remotes: Sequence[Any] = (),
+                 ttl: int = TTL_S):
+        self.local = local if local is not None else LRUBackend()
+        self.ring = HashRing(remotes)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "local_hits": 0, "remote_lookups": 0, "remote_hits": 0,
+                      "stores": 0, "remote_errors": 0}
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for name, n in deltas.items():
+                self.stats[name] += n
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """先查本地层，再查键所在的远程节点；远程命中回填本地层"""
+        self._count(lookups=1)
+        data = self.local.get(key)
+        if data is not None:
+            self._count(local_hits=1)
+            return json.loads(data)
+        node = self.ring.node_for(key)
+        if node is None:
+            return None
+        self._count(remote_lookups=1)
+        try:
+            data = node.get(key)
+        except (ConnectionError, RespError, sqlite3.Error) as e:
+            self._count(remote_errors=1)
+            if not isinstance(e, NodeDown):  # 跳过期内不重复告警
+                log.warning(f"result cache get failed on {node.name}: {e}")
+            return None
+        if data is None:
+            return None
+        self._count(remote_hits=1)
+        self.local.set(key, data, self.ttl)
+        return json.loads(data)
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        """写入本地层和键所在的远程节点（远程失败只记日志；_meta 中的单次调用字段不写入）"""
+        data = json.dumps(_storable(result), ensure_ascii=False, default=str).encode()
+        self._count(stores=1)
+        self.local.set(key, data, self.ttl)
+        node = self.ring.node_for(key)
+        if node is None:
+            return
+        try:
+            node.set(key, data, self.ttl)
+        except (ConnectionError, RespError, sqlite3.Error) as e:
+            self._count(remote_errors=1)
+            if not isinstance(e, NodeDown):  # 跳过期内不重复告警
+                log.warning(f"result cache set failed on {node.name}: {e}")
+
+    def lookup(self, image: Image.Image,
+               params: Dict[str, Any]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """按图片和参数查找：返回 (键, 结果或 None)，键可直接用于 set"""
+        key = cache_key(image, params)
+        return key, self.get(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各层查找数 / 命中数 / 命中率，以及远程节点列表"""
+        with self._lock:
+            s = dict(self.stats)
+        ratio = lambda hits, total: round(hits / total, 3) if total else 0.0  # noqa: E731
+        return {
+            "local": {"lookups": s["lookups"], "hits": s["local_hits"],
+                      "hit_ratio": ratio(s["local_hits"], s["lookups"]), "items": len(self.local)},
+            "remote": {"lookups": s["remote_lookups"], "hits": s["remote_hits"],
+                       "hit_ratio": ratio(s["remote_hits"], s["remote_lookups"]),
+                       "errors": s["remote_errors"], "nodes": [n.name for n in self.ring.nodes]},
+            "overall_hit_ratio": ratio(s["local_hits"] + s["remote_hits"], s["lookups"]),
+            "stores": s["stores"],
+        }
+
+
+def cached(fn: Callable, cache: Optional[ResultCache] = None) -> Callable:
+    """
+    把分析函数 fn(image, **params) 包装成先查缓存、未命中再调用并写回。
+
+    缓存关闭（RESULT_CACHE=0）时原样返回 fn。fn 可以是 in_lane(...) 包装过的函数：
+    缓存命中不占用后端空位。
+    """
+    if cache is None and not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(image, **params):
+        # 调用方不在追踪中时（如 worker 直接调用）开一个根 span，让查找和分析落在同一 trace
+        with (nullcontext() if current_span() is not None else span("infer")):
+            return _cached_call(fn, cache or get_result_cache(), image, params)
+    return wrapper
+
+
+def _cached_call(fn: Callable, store: ResultCache, image, params: Dict[str, Any]) -> Any:
+    with span("cache_lookup") as s:
+        key, result = store.lookup(image, params)
+        s.set(hit=result is not None)
+    if result is not None:
+        return result
+    result = fn(image, **params)
+    if cacheable(result):
+        store.set(key, result)
+    return result
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """进程级单例（RESULT_CACHE_REMOTE / RESULT_CACHE_TTL / RESULT_CACHE_LOCAL_ITEMS）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                remotes = [backend_from_spec(s) for s in REMOTE_SPEC.split(",") if s.strip()]
+                _cache = ResultCache(LRUBackend(LOCAL_ITEMS), remotes, TTL_S)
+                names = [n.name for n in remotes] or "none"
+                log.info(f"result cache: local lru:{LOCAL_ITEMS}, remote {names}")
+    return _cache
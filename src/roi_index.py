@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+按选区几何复用分析结果
+
+把裁剪框挪动几个像素就会得到新的 patch 和一次全新的云端调用，而分析结论并不会变。
+RoiResultIndex 以"图片内容哈希 + 分析参数"分组保存每次分析的选区矩形和结果：
+新请求的选区与已有选区的 IoU 不低于阈值时直接复用结果。
+
+索引跨会话共享（同一张图、同样参数的结果对所有会话都成立），按组 LRU 淘汰。
+
+用法：
+    from src.roi_index import get_roi_index
+
+    match = get_roi_index().lookup(image_key, (x, y, w, h), params_key)
+    if match:
+        render(match.result)        # match.iou 为重叠度
+    else:
+        result = cloud_infer(...)
+        get_roi_index().store(image_key, (x, y, w, h), params_key, result)
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+Box = Tuple[int, int, int, int]  # (x, y, w, h)
+
+# 复用所需的最小 IoU
+DEFAULT_IOU_THRESHOLD = float(os.getenv("ROI_REUSE_IOU", "0.85"))
+# 每组（图片 + 参数）最多保存的选区数 / 最多保存的组数
+MAX_PER_IMAGE = 32
+MAX_GROUPS = 128
+
+
+def iou(a: Box, b: Box) -> float:
+    """两个 (x, y, w, h) 矩形的交并比"""
+    ax1, ay1, ax2, ay2 = a[0], a[1], a[0] + a[2], a[1] + a[3]
+    bx1, by1, bx2, by2 = b[0], b[1], b[0] + b[2], b[1] + b[3]
+    iw = max(0, min(ax2, bx2) - max(ax1, bx1))
+    ih = max(0, min(ay2, by2) - max(ay1, by1))
+    inter = iw * ih
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+@dataclass
+class RoiMatch:
+    """一次命中：被复用的结果及其原选区"""
+    box: Box
+    result: Any
+    iou: float
+    created_at: float = field(default_factory=time.time)
+
+
+class RoiResultIndex:
+    """线程安全的 (图片, 参数) -> [(选区, 结果)] 索引"""
+
+    def __init__(self, iou_threshold: float = DEFAULT_IOU_THRESHOLD,
+                 max_per_image: int = MAX_PER_IMAGE, max_groups: int = MAX_GROUPS):
+        self.iou_threshold = iou_threshold
+        self.max_per_image = max_per_image
+        self.max_groups = max_groups
+        self._index: "OrderedDict[Tuple[str, str], List[RoiMatch]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "stored": 0}
+
+    def lookup(self, image_key: str, box: Box, params_key: str,
+               threshold: Optional[float] = None) -> Optional[RoiMatch]:
+        """
+        查找与 box 重叠度最高且不低于阈值的已有结果。
+
+        Args:
+            image_key: 图片内容哈希
+            box: 选区 (x, y, w, h)，与存入时同一坐标系
+            params_key: 分析参数键（语言、任务类型、模型等），不同参数互不复用
+            threshold: 覆盖默认 IoU 阈值
+
+        Returns:
+            RoiMatch（iou 为与本次选区的重叠度）或 None
+        """
+        threshold = self.iou_threshold if threshold is None else threshold
+        with self._lock:
+            self.stats["lookups"] += 1
+            entries = self._index.get((image_key, params_key))
+            if not entries:
+                return None
+            self._index.move_to_end((image_key, params_key))
+            best, best_iou = None, 0.0
+            for entry in entries:
+                score = iou(box, entry.box)
+                if score > best_iou:
+                    best, best_iou = entry, score
+            if best is None or best_iou < threshold:
+                return None
+            self.stats["hits"] += 1
+            return RoiMatch(box=best.box, result=best.result, iou=best_iou,
+                            created_at=best.created_at)
+
+    def store(self, image_key: str, box: Box, params_key: str, result: Any) -> None:
+        """保存一次分析结果（同一选区的旧结果被替换）"""
+        group = (image_key, params_key)
+        with self._lock:
+            entries = [e for e in self._index.pop(group, []) if e.box != tuple(box)]
+            entries.append(RoiMatch(box=tuple(box), result=result, iou=1.0))
+            self._index[group] = entries[-self.max_per_image:]
+            self.stats["stored"] += 1
+            while len(self._index) > self.max_groups:
+                self._index.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            s = dict(self.stats, groups=len(self._index), iou_threshold=self.iou_threshold)
+        s["hit_rate"] = round(s["hits"] / s["lookups"], 3) if s["lookups"] else 0.0
+        return s
+
+
+_index: Optional[RoiResultIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_roi_index() -> RoiResultIndex:
+    """进程级单例"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RoiResultIndex()
+    return _index
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+双通道后端调度：交互请求优先，批量任务让路
+
+夜间的整目录批量分析和白天的交互分析共用同一份 DashScope 配额，大批量一跑 UI 就像卡死。
+LaneScheduler 在后端调用前加一道闸：同时调用后端的数量不超过 capacity，按通道权重划分份额：
+- interactive（页面点击、预分析、HTTP 单张）和 bulk（批量、HTTP 批量/流式）两个通道
+- 有空位时优先放行未用满份额的通道，同等条件下交互优先；只有一个通道有需求时可以用满全部空位
+- 批量任务无法中断进行中的调用，但交互请求到来后，释放出的空位先给交互，批量自动退到自己的份额
+- 每个通道记录排队等待时间（平均 / p95）和占用时长，供运维页与排队预估使用
+- 调用方可预先创建 Ticket 随任务提交，页面据此查询排队位置和预计等待（按近期占用时长估算）
+
+用法：
+    from src.scheduler import get_scheduler, INTERACTIVE, BULK
+
+    with get_scheduler().slot(INTERACTIVE):
+        result = cloud_infer(patch, ...)
+
+    fn = in_lane(BULK, cloud_infer)   # 包装成在指定通道内执行的函数
+
+    ticket = Ticket(INTERACTIVE)
+    executor.submit(sid, in_lane(INTERACTIVE, cloud_infer, ticket=ticket), patch)
+    pos = get_scheduler().position(ticket)          # 0 为下一个；已开始调用时为 None
+    eta = get_scheduler().eta(INTERACTIVE, pos)     # 秒；还没有耗时样本时为 None
+"""
+
+from __future__ import annotations
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from src.utils.tracing import current_span, record_span
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)  # 顺序即同等条件下的优先级
+
+# 同时调用后端的数量（整个进程）
+BACKEND_CONCURRENCY = int(os.getenv("BACKEND_CONCURRENCY", "4"))
+# 通道权重，如 "interactive=3,bulk=1"
+LANE_WEIGHTS = os.getenv("LANE_WEIGHTS", "interactive=3,bulk=1")
+# 每个通道保留的最近等待样本数（用于 p95）
+_WAIT_SAMPLES = 512
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """解析 "interactive=3,bulk=1"；缺失或非法的通道权重记为 1"""
+    weights = {lane: 1.0 for lane in LANES}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        try:
+            if name.strip() in weights and float(value) > 0:
+                weights[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return weights
+
+
+# Ticket 状态
+NEW = "new"          # 已创建，尚未进入调度器（还在线程池队列里）
+WAITING = "waiting"  # 在通道中排队
+ACTIVE = "active"    # 已拿到后端空位
+FINISHED = "finished"
+
+
+class Ticket:
+    """一次后端调用的排队凭证"""
+    __slots__ = ("lane", "state", "waited")
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.state = NEW
+        self.waited: Optional[float] = None
+
+
+class _Lane:
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.running = 0
+        self.waiters: Deque[Ticket] = deque()
+        self.waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.admitted = 0
+        self.hold_s_total = 0.0
+        self.hold_ewma = 0.0  # 近期占用时长（用于预计等待）
+        self.released = 0
+
+
+class LaneScheduler:
+    """按权重分配后端并发份额的双通道调度器（线程安全）"""
+
+    def __init__(self, capacity: int = BACKEND_CONCURRENCY,
+                 weights: Optional[Dict[str, float]] = None):
+        self.capacity = max(1, capacity)
+        weights = weights or parse_weights(LANE_WEIGHTS)
+        self._lanes = {lane: _Lane(weights.get(lane, 1.0)) for lane in LANES}
+        self._cond = threading.Condition()
+
+    def share(self, lane: str) -> int:
+        """通道的保证份额（至少 1 个空位）"""
+        total = sum(l.weight for l in self._lanes.values())
+        return max(1, int(self.capacity * self._lanes[lane].weight / total))
+
+    def _next_lane_locked(self) -> Optional[str]:
+        """下一个空位给哪个通道：未用满份额的优先，其次按 running/weight 最小；同等条件下按 LANES 顺序"""
+        waiting = [lane for lane in LANES if self._lanes[lane].waiters]
+        if not waiting:
+            return None
+        under = [lane for lane in waiting if self._lanes[lane].running < self.share(lane)]
+        if under:
+            return under[0]
+        return min(waiting, key=lambda lane: self._lanes[lane].running / self._lanes[lane].weight)
+
+    def acquire(self, lane: str, timeout: Optional[float] = None,
+                ticket: Optional[Ticket] = None) -> float:
+        """
+        等待一个后端空位。
+
+        Args:
+            lane: INTERACTIVE 或 BULK
+            timeout: 最长等待秒数（None 为一直等）
+            ticket: 预先创建的排队凭证（用于查询排队位置），省略时内部创建
+
+        Returns:
+            排队等待的秒数
+
+        Raises:
+            TimeoutError: 超时仍未轮到
+        """
+        state = self._lanes[lane]
+        ticket = ticket or Ticket(lane)
+        t0 = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            state.waiters.append(ticket)
+            ticket.state = WAITING
+            try:
+                while not (self._running_total_locked() < self.capacity
+                           and self._next_lane_locked() == lane and state.waiters[0] is ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"no backend slot for lane {lane} within {timeout}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                state.waiters.remove(ticket)
+                ticket.state = FINISHED
+                self._cond.notify_all()  # 队首变化，其它等待者重新判断
+                raise
+            state.waiters.popleft()
+            state.running += 1
+            state.admitted += 1
+            waited = time.perf_counter() - t0
+            state.waits.append(waited)
+            ticket.state, ticket.waited = ACTIVE, waited
+            self._cond.notify_all()  # 可能还有空位，让下一个等待者判断
+        return waited
+
+    def release(self, lane: str, held_s: float = 0.0) -> None:
+        with self._cond:
+            state = self._lanes[lane]
+            state.running -= 1
+            state.released += 1
+            state.hold_s_total += held_s
+            ewma = state.hold_ewma
+            state.hold_ewma = held_s if not ewma else 0.8 * ewma + 0.2 * held_s
+            self._cond.notify_all()
+
+    def _running_total_locked(self) -> int:
+        return sum(l.running for l in self._lanes.values())
+
+    @contextmanager
+    def slot(self, lane: str, timeout: Optional[float] = None,
+             ticket: Optional[Ticket] = None) -> Iterator[float]:
+        """在通道内占用一个后端空位；as 的值为排队等待秒数"""
+        waited = self.acquire(lane, timeout, ticket)
+        if current_span() is not None:
+            record_span("queue_wait", time.time_ns() - int(waited * 1e9), queue="lane", lane=lane)
+        t0 = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            if ticket is not None:
+                ticket.state = FINISHED
+            self.release(lane, time.perf_counter() - t0)
+
+    def position(self, ticket: Ticket) -> Optional[int]:
+        """
+        排队位置：0 为下一个拿到空位；尚未进入调度器时按排在队尾计算；已开始或已结束时为 None
+        """
+        with self._cond:
+            waiters = self._lanes[ticket.lane].waiters
+            if ticket.state == NEW:
+                return len(waiters)
+            if ticket.state == WAITING:
+                try:
+                    return waiters.index(ticket)
+                except ValueError:
+                    return None
+            return None
+
+    def pending(self, lane: str) -> int:
+        """通道中排队等空位的数量"""
+        with self._cond:
+            return len(self._lanes[lane].waiters)
+
+    def eta(self, lane: str, position: Optional[int]) -> Optional[float]:
+        """
+        预计等待秒数：前面还有 position 个请求时，按近期平均占用时长和该通道可用空位数估算。
+
+        Returns:
+            秒数；position 为 None 或尚无耗时样本时为 None
+        """
+        if position is None:
+            return None
+        with self._cond:
+            state = self._lanes[lane]
+            hold = state.hold_ewma or max(l.hold_ewma for l in self._lanes.values())
+            if not hold:
+                return None
+            free = self.capacity - self._running_total_locked()
+            if position < free:
+                return 0.0
+            others_waiting = any(l.waiters for name, l in self._lanes.items() if name != lane)
+            slots = self.share(lane) if others_waiting else self.capacity
+            # 每轮 slots 个空位各释放一次约需一个占用时长；正在运行的调用平均已过半
+            return hold * (0.5 + (position - max(free, 0)) // slots)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """各通道：运行数、排队数、份额、权重、放行数、等待 avg/p95（毫秒）、平均占用（毫秒）"""
+        with self._cond:
+            out = {}
+            for name, lane in self._lanes.items():
+                waits = sorted(lane.waits)
+                out[name] = {
+                    "running": lane.running,
+                    "waiting": len(lane.waiters),
+                    "share": self.share(name),
+                    "weight": lane.weight,
+                    "admitted": lane.admitted,
+                    "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                    "wait_p95_ms": (round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1)
+                                    if waits else 0.0),
+                    "hold_avg_ms": (round(lane.hold_s_total / lane.released * 1000, 1)
+                                    if lane.released else 0.0),
+                    "hold_recent_ms": round(lane.hold_ewma * 1000, 1),
+                }
+            return out
+
+
+_scheduler: Optional[LaneScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LaneScheduler:
+    """进程级单例（BACKEND_CONCURRENCY / LANE_WEIGHTS）"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LaneScheduler()
+    return _scheduler
+
+
+def in_lane(lane: str, fn: Callable, scheduler: Optional[LaneScheduler] = None,
+            ticket: Optional[Ticket] = None) -> Callable:
+    """把 fn 包装成在指定通道内执行（调用时才取调度器单例）；ticket 用于查询排队位置"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with (scheduler or get_scheduler()).slot(lane, ticket=ticket):
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+会话图片状态（有界、可落盘）
+
+每个会话原先在 st.session_state 里直接持有原图和裁剪图（PIL 对象），
+20-50 MP 的效果图在多会话下内存无上限增长。SessionImageStore 改为：
+- 原图只记录对共享解码缓存（src/image_store.py）的键引用，不另存副本
+- 裁剪图等会话自有的图按内容键存放，多个会话相同内容共用一份
+- 常驻内存超出会话配额或全局预算时，最久未用的图压缩（无损 PNG）落盘，用到时再读回
+- 单张图本身就超过会话配额时，放入前等比缩小到配额以内（否则刚用到的图不落盘，配额形同虚设）
+- 原图引用不固定共享缓存中的条目，由共享缓存自己的预算约束；被淘汰后 get 返回 None，页面重跑时重新解码
+- 可按会话查看常驻字节数，并报告进程 RSS
+
+用法：
+    from src.session_images import get_session_image_store
+
+    lease = get_session_image_store().lease(session_id)   # 放进 st.session_state，会话回收时自动释放
+    lease.ref("image", entry.key)                          # 引用共享解码缓存中的原图
+    lease.put("patch", patch, key=f"{entry.key}:{box}")    # 会话自有图片
+    patch = lease.get("patch")
+    lease.usage()   # {"resident_bytes": ..., "spilled_bytes": ..., ...}
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from PIL import Image
+
+from src.image_store import get_image_store
+from src.utils.memtrace import process_rss
+
+DEFAULT_BUDGET_MB = int(os.getenv("SESSION_IMAGE_BUDGET_MB", "256"))
+DEFAULT_SESSION_QUOTA_MB = int(os.getenv("SESSION_IMAGE_QUOTA_MB", "64"))
+DEFAULT_SPILL_DIR = Path(os.getenv("SESSION_IMAGE_SPILL_DIR", "cache/session_images"))
+# 超过该时长未访问的会话视为已离开，释放其引用（兜底，正常由 lease 回收释放）
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IMAGE_IDLE_TTL", "3600"))
+
+
+def _nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+@dataclass
+class _Blob:
+    """一张会话自有图片（常驻或已落盘）"""
+    key: str
+    nbytes: int
+    image: Optional[Image.Image] = None
+    path: Optional[Path] = None
+    disk_bytes: int = 0
+    refs: Set[str] = field(default_factory=set)
+    last_used: float = field(default_factory=time.time)
+
+
+class SessionLease:
+    """单个会话的图片槽位句柄；对象被回收（会话结束）时自动释放全部引用"""
+
+    def __init__(self, store: "SessionImageStore", session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self._finalizer = weakref.finalize(self, store.release_session, session_id)
+
+    def put(self, slot: str, image: Optional[Image.Image],
+            key: Optional[str] = None) -> Optional[str]:
+        return self.store.put(self.session_id, slot, image, key=key)
+
+    def ref(self, slot: str, shared_key: Optional[str]) -> None:
+        self.store.ref(self.session_id, slot, shared_key)
+
+    def get(self, slot: str) -> Optional[Image.Image]:
+        return self.store.get(self.session_id, slot)
+
+    def clear(self, slot: Optional[str] = None) -> None:
+        self.store.clear(self.session_id, slot)
+
+    def usage(self) -> Dict[str, int]:
+        return self.store.session_usage(self.session_id)
+
+
+class SessionImageStore:
+    """会话图片槽位 + 内容寻址的自有图片池，带会话配额、全局预算和落盘"""
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024,
+                 session_quota_bytes: int = DEFAULT_SESSION_QUOTA_MB * 1024 * 1024,
+                 spill_dir: Path = DEFAULT_SPILL_DIR):
+        self.budget_bytes = budget_bytes
+        self.session_quota_bytes = session_quota_bytes
+        self.spill_dir = Path(spill_dir)
+        self._blobs: Dict[str, _Blob] = {}
+        # session_id -> slot -> ("own", blob_key) | ("shared", image_store_key)
+        self._slots: Dict[str, Dict[str, tuple]] = {}
+        self._seen: Dict[str, float] = {}
+        # 可重入：lease 的回收回调可能在本线程持锁期间由 GC 触发
+        self._lock = threading.RLock()
+        self._resident = 0
+        self.stats = {"spills": 0, "reloads": 0, "released_sessions": 0, "downscaled": 0}
+
+    # ---------- 会话接口 ----------
+    def lease(self, session_id: str) -> SessionLease:
+        return SessionLease(self, session_id)
+
+    def put(self, session_id: str, slot: str, image: Optional[Image.Image],
+            key: Optional[str] = None) -> Optional[str]:
+        """
+        把会话自有图片放入槽位（替换槽位里原有的图）。
+
+        Args:
+            session_id: 会话标识
+            slot: 槽位名（如 "patch"）
+            image: 图片；None 等同于 clear。超过会话配额时等比缩小后存放（get 取回的是缩小后的图）
+            key: 内容键（如 "<原图哈希>:<选区>"）；省略时按原始像素计算
+
+        Returns:
+            实际使用的内容键
+        """
+        if image is None:
+            self.clear(session_id, slot)
+            return None
+        key = key or "px:" + hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()
+        fitted = self._fit_quota(image)  # 缩放较慢，在锁外做
+        with self._lock:
+            self._touch_session_locked(session_id)
+            if self._slots.get(session_id, {}).get(slot) == ("own", key):
+                self._blobs[key].last_used = time.time()
+                return key
+            blob = self._blobs.get(key)
+            if blob is None:
+                if fitted is not image:
+                    self.stats["downscaled"] += 1
+                blob = _Blob(key=key, nbytes=_nbytes(fitted), image=fitted)
+                self._blobs[key] = blob
+                self._resident += blob.nbytes
+            self._assign_locked(session_id, slot, ("own", key))
+            blob.refs.add(session_id)
+            blob.last_used = time.time()
+            self._enforce_locked(session_id, keep=key)
+            self._sweep_idle_locked()
+        return key
+
+    def ref(self, session_id: str, slot: str, shared_key: Optional[str]) -> None:
+        """槽位引用共享解码缓存中的图片（不复制）"""
+        with self._lock:
+            self._touch_session_locked(session_id)
+            if shared_key is None:
+                self._assign_locked(session_id, slot, None)
+            else:
+                self._assign_locked(session_id, slot, ("shared", shared_key))
+
+    def get(self, session_id: str, slot: str) -> Optional[Image.Image]:
+        """取槽位图片；已落盘的读回内存，共享图片已被淘汰时返回 None"""
+        with self._lock:
+            self._touch_session_locked(session_id)
+            entry = self._slots.get(session_id, {}).get(slot)
+            if entry is None:
+                return None
+            kind, key = entry
+            if kind == "shared":
+                shared = get_image_store().get(key)
+                return shared.image if shared is not None else None
+            blob = self._blobs[key]
+            blob.last_used = time.time()
+            if blob.image is None:
+                self._reload_locked(blob)
+                self._enforce_locked(session_id, keep=key)
+            return blob.image
+
+    def clear(self, session_id: str, slot: Optional[str] = None) -> None:
+        """清空一个槽位（slot 为 None 时清空该会话全部槽位）"""
+        with self._lock:
+            slots = list(self._slots.get(session_id, {})) if slot is None else [slot]
+            for s in slots:
+                self._assign_locked(session_id, s, None)
+
+    def release_session(self, session_id: str) -> None:
+        """释放会话的全部引用（会话结束时由 lease 回收触发）"""
+        with self._lock:
+            if session_id in self._slots:
+                for s in list(self._slots[session_id]):
+                    self._assign_locked(session_id, s, None)
+                self._slots.pop(session_id, None)
+                self.stats["released_sessions"] += 1
+            self._seen.pop(session_id, None)
+
+    # ---------- 观测 ----------
+    def session_usage(self, session_id: str) -> Dict[str, int]:
+        """
+        会话占用：resident_bytes 为会话自有且常驻内存的图片字节数（多会话共用的图各自全额计入），
+        shared_bytes 为其引用的共享解码图片，spilled_bytes 为已落盘的压缩字节数。
+        """
+        with self._lock:
+            usage = {"slots": 0, "resident_bytes": 0, "shared_bytes": 0, "spilled_bytes": 0}
+            for kind, key in self._slots.get(session_id, {}).values():
+                usage["slots"] += 1
+                if kind == "shared":
+                    usage["shared_bytes"] += get_image_store().peek_nbytes(key)
+                    continue
+                blob = self._blobs[key]
+                if blob.image is not None:
+                    usage["resident_bytes"] += blob.nbytes
+                else:
+                    usage["spilled_bytes"] += blob.disk_bytes
+            return usage
+
+    def snapshot(self) -> Dict[str, object]:
+        """全局状态：常驻/落盘字节、会话数、各会话常驻字节、进程 RSS"""
+        with self._lock:
+            sessions = list(self._slots)
+            snap = dict(self.stats,
+                        blobs=len(self._blobs),
+                        resident_bytes=self._resident,
+                        spilled_bytes=sum(b.disk_bytes for b in self._blobs.values()
+                                          if b.image is None),
+                        budget_bytes=self.budget_bytes,
+                        session_quota_bytes=self.session_quota_bytes,
+                        sessions=len(sessions))
+        snap["per_session"] = {sid: self.session_usage(sid)["resident_bytes"] for sid in sessions}
+        snap["process_rss"] = process_rss()
+        return snap
+
+    # ---------- 内部 ----------
+    def _touch_session_locked(self, session_id: str) -> None:
+        self._seen[session_id] = time.time()
+        self._slots.setdefault(session_id, {})
+
+    def _assign_locked(self, session_id: str, slot: str, entry: Optional[tuple]) -> None:
+        slots = self._slots.setdefault(session_id, {})
+        old = slots.pop(slot, None)
+        if entry is not None:
+            slots[slot] = entry
+        if old is None or old[0] != "own" or old == entry:
+            return
+        # 会话不再在任何槽位引用旧图时解除引用，无人引用则删除
+        if any(e == old for e in slots.values()):
+            return
+        blob = self._blobs.get(old[1])
+        if blob is None:
+            return
+        blob.refs.discard(session_id)
+        if not blob.refs:
+            self._drop_locked(blob)
+
+    def _drop_locked(self, blob: _Blob) -> None:
+        self._blobs.pop(blob.key, None)
+        if blob.image is not None:
+            self._resident -= blob.nbytes
+        if blob.path is not None:
+            try:
+                blob.path.unlink()
+            except OSError:
+                pass
+
+    def _session_resident_locked(self, session_id: str) -> int:
+        keys = {key for kind, key in self._slots.get(session_id, {}).values() if kind == "own"}
+        return sum(self._blobs[k].nbytes for k in keys if self._blobs[k].image is not None)
+
+    def _enforce_locked(self, session_id: str, keep: str) -> None:
+        """先按会话配额、再按全局预算，把最久未用的常驻图落盘（keep 为刚用到的图，不动）"""
+        if self._session_resident_locked(session_id) > self.session_quota_bytes:
+            own = sorted((self._blobs[key] for kind, key in self._slots[session_id].values()
+                          if kind == "own" and key != keep and self._blobs[key].image is not None),
+                         key=lambda b: b.last_used)
+            for blob in own:
+                self._spill_locked(blob)
+                if self._session_resident_locked(session_id) <= self.session_quota_bytes:
+                    break
+        if self._resident > self.budget_bytes:
+            hot = sorted((b for b in self._blobs.values() if b.image is not None and b.key != keep),
+                         key=lambda b: b.last_used)
+            for blob in hot:
+                self._spill_locked(blob)
+                if self._resident <= self.budget_bytes:
+                    break
+
+    def _fit_quota(self, image: Image.Image) -> Image.Image:
+        """单张图超过会话配额时等比缩小到配额以内"""
+        nbytes = _nbytes(image)
+        if nbytes <= self.session_quota_bytes:
+            return image
+        scale = (self.session_quota_bytes / nbytes) ** 0.5
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        return image.resize(size, Image.LANCZOS)
+
+    def _spill_locked(self, blob: _Blob) -> None:
+        if blob.image is None:
+            return
+        if blob.path is None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            name = hashlib.blake2b(blob.key.encode("utf-8"), digest_size=16).hexdigest()
+            path = self.spill_dir / f"{name}.png"
+            blob.image.save(path, format="PNG", compress_level=1)
+            blob.path = path
+            blob.disk_bytes = path.stat().st_size
+        blob.image = None
+        self._resident -= blob.nbytes
+        self.stats["spills"] += 1
+
+    def _reload_locked(self, blob: _Blob) -> None:
+        with Image.open(blob.path) as f:
+            blob.image = f.copy()
+        self._resident += blob.nbytes
+        self.stats["reloads"] += 1
+
+    def _sweep_idle_locked(self) -> None:
+        cutoff = time.time() - SESSION_IDLE_TTL
+        for sid in [s for s, ts in self._seen.items() if ts < cutoff]:
+            for s in list(self._slots.get(sid, {})):
+                self._assign_locked(sid, s, None)
+            self._slots.pop(sid, None)
+            self._seen.pop(sid, None)
+            self.stats["released_sessions"] += 1
+
+
+_store: Optional[SessionImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_image_store() -> SessionImageStore:
+    """进程级单例"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionImageStore()
+    return _store
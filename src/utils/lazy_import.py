@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+可选依赖的延迟导入
+
+联网检索（duckduckgo_search / requests / lxml / readability）、DashScope SDK 等依赖加载要几百毫秒，
+而很多进程根本用不到（未开启联网、worker 只跑缓存命中、CLI 只读日志）。
+optional_import 在第一次真正用到时才导入，结果（含"未安装"）按进程缓存，之后只是一次字典查找。
+
+用法：
+    from src.utils.lazy_import import optional_import
+
+    requests = optional_import("requests")                    # 未安装时为 None
+    DDGS = optional_import("duckduckgo_search", "DDGS")      # 取模块里的属性
+
+冷启动导入耗时检查见 scripts/check_import_budget.py。
+"""
+
+from __future__ import annotations
+import importlib
+from typing import Any, Dict, Optional, Tuple
+
+_MISSING = object()
+_loaded: Dict[Tuple[str, Optional[str]], Any] = {}
+
+
+def optional_import(module: str, attr: Optional[str] = None) -> Any:
+    """
+    导入可选依赖（首次调用时加载）。
+
+    Args:
+        module: 模块名（如 "lxml.html"）
+        attr: 要取的模块属性（如 "Document"），None 返回模块本身
+
+    Returns:
+        模块或属性；依赖缺失或导入失败时返回 None（不重复尝试）
+    """
+    key = (module, attr)
+    value = _loaded.get(key, _MISSING)
+    if value is _MISSING:
+        try:
+            value = importlib.import_module(module)
+            if attr is not None:
+                value = getattr(value, attr)
+        except Exception:
+            value = None
+        _loaded[key] = value
+    return value
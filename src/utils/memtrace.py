@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+按阶段的内存追踪（可选开启）
+
+偶发的 OOM 需要知道峰值出在哪一步：解码、ensure_min_size 放大、PNG 编码还是 base64 拼串。
+开启后，每个 tracing.span(...) 阶段结束时把内存数据写进该 span 的属性（随 trace 导出），
+并计入进程内指标 mem_peak_bytes（按阶段，运维页可见）：
+
+- MEMTRACE=tracemalloc：Python 分配追踪（PNG 字节、base64 字符串等 Python 对象；
+  Pillow 的像素缓冲区不经过 Python 分配器，解码 / 放大的像素内存要看 rss）
+  - mem_peak_bytes：阶段内分配峰值相对开始时的增量（嵌套阶段的峰值向外层传递）
+  - mem_delta_bytes：阶段结束时仍存活的分配增量
+  - MEMTRACE_SITES 中的阶段另做快照对比，mem_top 记录增长最多的分配位置 [[文件:行, 字节, 块数], ...]，
+    同时按阶段累计，top_sites() 汇总
+- MEMTRACE=rss：只读进程 RSS（开销更小，含 Pillow 等 C 扩展的分配）
+  - rss_delta_bytes：阶段前后 RSS 之差
+  - rss_hwm_growth_bytes：阶段内进程 RSS 历史峰值的上涨量（非 0 说明这一步刷新了进程峰值）
+- MEMTRACE=all：两者都记录
+
+tracemalloc 的峰值是进程级的：并发请求会互相影响，排查时建议单并发复现。
+分配位置快照每次约数百毫秒（随已追踪的分配块数增长），会计入该阶段耗时，开启期间阶段耗时不可参考。
+未开启时 span 只多一次布尔判断。
+
+环境变量：MEMTRACE（"" / tracemalloc / rss / all）、MEMTRACE_FRAMES（分配栈深度，默认 1）、
+MEMTRACE_TOP（每个阶段记录的分配位置数，默认 5）、
+MEMTRACE_SITES（做快照对比的阶段，默认 decode,crop,resize,png_encode,base64）。
+汇总报告见 scripts/trace_report.py（span 带内存属性时输出各阶段内存表和分配位置）。
+"""
+
+from __future__ import annotations
+import collections
+import contextvars
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from src.utils.metrics import BYTES_BUCKETS, histogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MEMTRACE_FRAMES = int(os.getenv("MEMTRACE_FRAMES", "1"))
+MEMTRACE_TOP = int(os.getenv("MEMTRACE_TOP", "5"))
+_DEFAULT_SITES = "decode,crop,resize,png_encode,base64"
+MEMTRACE_SITES = {s.strip() for s in os.getenv("MEMTRACE_SITES", _DEFAULT_SITES).split(",")
+                  if s.strip()}
+
+MODES = ("tracemalloc", "rss", "all")
+
+_mode = ""
+_frame: contextvars.ContextVar[Optional["_Frame"]] = contextvars.ContextVar(
+    "memtrace_frame", default=None)
+_sites: Dict[str, Dict[str, List[int]]] = defaultdict(dict)  # stage -> site -> [bytes, count, 次数]
+_sites_lock = threading.Lock()
+_process = None  # psutil.Process（可选依赖，首次用到时加载；False 表示不可用）
+
+
+def process_rss() -> int:
+    """当前进程常驻内存（字节）；psutil 可选，否则读 /proc，均不可用时返回 0"""
+    global _process
+    if _process is None:
+        try:
+            import psutil
+
+            _process = psutil.Process()
+        except Exception:
+            _process = False
+    if _process:
+        try:
+            return int(_process.memory_info().rss)
+        except Exception:
+            pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+def peak_rss() -> int:
+    """进程 RSS 历史峰值（字节）；不支持时返回 0"""
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024  # Linux 单位为 KB
+
+
+def enable(mode: str) -> None:
+    """
+    开启 / 切换内存追踪。
+
+    Args:
+        mode: "tracemalloc" / "rss" / "all"；其它值（含空串）关闭
+    """
+    global _mode
+    mode = mode if mode in MODES else ""
+    uses_tracemalloc = mode in ("tracemalloc", "all")
+    if uses_tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start(MEMTRACE_FRAMES)
+    elif not uses_tracemalloc and _mode in ("tracemalloc", "all") and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _mode = mode
+
+
+def mode() -> str:
+    return _mode
+
+
+class _Frame:
+    __slots__ = ("stage", "mode", "parent", "start", "max_peak", "rss0", "hwm0", "snapshot")
+
+    def __init__(self, stage: str, mode: str, parent: Optional["_Frame"]):
+        self.stage = stage
+        self.mode = mode
+        self.parent = parent
+        self.start = self.max_peak = 0
+        self.rss0 = self.hwm0 = 0
+        self.snapshot = None
+
+
+def begin(stage: str) -> Optional[Tuple["_Frame", contextvars.Token]]:
+    """阶段开始（tracing.span 调用）；未开启时返回 None"""
+    if not _mode:
+        return None
+    parent = _frame.get()
+    f = _Frame(stage, _mode, parent)
+    if f.mode != "rss" and tracemalloc.is_tracing():
+        if stage in MEMTRACE_SITES:  # 先拍快照：快照本身的内存计入起点，不算作本阶段的分配
+            f.snapshot = _take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None:  # 重置全局峰值前先把外层到目前为止的峰值记下
+            parent.max_peak = max(parent.max_peak, peak)
+        tracemalloc.reset_peak()
+        f.start = f.max_peak = current
+    if f.mode != "tracemalloc":
+        f.rss0, f.hwm0 = process_rss(), peak_rss()
+    return f, _frame.set(f)
+
+
+def finish(state: Tuple["_Frame", contextvars.Token], span) -> None:
+    """阶段结束：把内存数据写入 span 属性并计入指标"""
+    f, token = state
+    _frame.reset(token)
+    if f.mode != "tracemalloc":
+        growth = max(0, peak_rss() - f.hwm0)
+        span.set(rss_delta_bytes=process_rss() - f.rss0, rss_hwm_growth_bytes=growth)
+        histogram("mem_peak_bytes", BYTES_BUCKETS).observe(growth, stage=f.stage, mode="rss")
+    if f.mode == "rss" or not tracemalloc.is_tracing():
+        return  # 未用 tracemalloc，或阶段进行中被关闭
+    current, peak = tracemalloc.get_traced_memory()
+    peak = max(peak, f.max_peak)
+    if f.parent is not None:
+        f.parent.max_peak = max(f.parent.max_peak, peak)
+    span.set(mem_peak_bytes=peak - f.start, mem_delta_bytes=current - f.start)
+    histogram("mem_peak_bytes", BYTES_BUCKETS).observe(peak - f.start, stage=f.stage,
+                                                       mode="tracemalloc")
+    if f.snapshot is not None:
+        top = _top_growth(f.snapshot, _take_snapshot())
+        span.set(mem_top=top)
+        with _sites_lock:
+            stage_sites = _sites[f.stage]
+            for site, size, count in top:
+                s = stage_sites.setdefault(site, [0, 0, 0])
+                s[0] += size
+                s[1] += count
+                s[2] += 1
+
+
+# 追踪本身的分配（指标、span 属性、快照计数表）不计入分配位置
+_OWN_FILES = {tracemalloc.__file__, __file__, collections.__file__} | \
+    {os.path.join(os.path.dirname(__file__), name) for name in ("metrics.py", "tracing.py")}
+
+
+def _raw_traces(snapshot: tracemalloc.Snapshot) -> Optional[list]:
+    """
+    快照里的原始 trace 元组列表 [(domain, size, ((文件, 行), ...), nframe), ...]。
+
+    读的是 CPython 的私有属性 Snapshot.traces._traces，结构不符或不存在时返回 None（走公开 API）。
+    """
+    raw = getattr(snapshot.traces, "_traces", None)
+    if not isinstance(raw, list):
+        return None
+    if raw:
+        t = raw[0]
+        if not (isinstance(t, tuple) and len(t) >= 3
+                and isinstance(t[1], int) and isinstance(t[2], tuple)
+                and (not t[2] or (isinstance(t[2][0], tuple) and len(t[2][0]) == 2))):
+            return None
+    return raw
+
+
+def _take_snapshot() -> Union[Counter, tracemalloc.Snapshot]:
+    """
+    当前所有存活分配块：能读到原始 trace 时为其多重集合，否则为 Snapshot 本身。
+
+    Snapshot.compare_to / filter_traces 在纯 Python 里逐块分组，十几万个块要数秒；
+    快路径直接对原始 trace 元组计数（C 实现），再只对新增的块分组。
+    """
+    snapshot = tracemalloc.take_snapshot()
+    raw = _raw_traces(snapshot)
+    return Counter(raw) if raw is not None else snapshot
+
+
+def _top_growth(before, after) -> List[List[Any]]:
+    """阶段内新增且仍存活的分配块，按分配位置（最内层帧）汇总：[[文件:行, 字节, 块数], ...]"""
+    by_site: Dict[Tuple[str, int], List[int]] = {}
+    if isinstance(before, Counter) and isinstance(after, Counter):
+        for trace, n in (after - before).items():
+            filename, lineno = trace[2][0] if trace[2] else ("<unknown>", 0)
+            if filename in _OWN_FILES:
+                continue
+            site = by_site.setdefault((filename, lineno), [0, 0])
+            site[0] += trace[1] * n
+            site[1] += n
+    else:  # 公开 API：按行号分组的快照对比（慢，只在原始 trace 不可用时使用）
+        for stat in after.compare_to(before, "lineno"):
+            frame = stat.traceback[0]
+            if stat.size_diff <= 0 or frame.filename in _OWN_FILES:
+                continue
+            by_site[(frame.filename, frame.lineno)] = [stat.size_diff, max(0, stat.count_diff)]
+    top = sorted(by_site.items(), key=lambda kv: -kv[1][0])[:MEMTRACE_TOP]
+    return [[f"{os.path.basename(f)}:{line}", size, count] for (f, line), (size, count) in top]
+
+
+def top_sites(n: int = 10) -> Dict[str, List[Dict[str, Any]]]:
+    """各阶段累计增长最多的分配位置：{stage: [{"site", "bytes", "blocks", "seen"}]}"""
+    with _sites_lock:
+        return {stage: [{"site": site, "bytes": v[0], "blocks": v[1], "seen": v[2]}
+                        for site, v in sorted(sites.items(), key=lambda kv: -kv[1][0])[:n]]
+                for stage, sites in _sites.items()}
+
+
+def reset_sites() -> None:
+    with _sites_lock:
+        _sites.clear()
+
+
+enable(os.getenv("MEMTRACE", ""))
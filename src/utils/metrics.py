@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+进程内指标：直方图与计数器（运维页读取）
+
+请求路径上只做一次加锁的计数：按固定桶累加直方图、按标签累加计数器，不分配、不做 IO。
+每个指标同时保留两份统计：
+- 累计值（进程启动以来）
+- 最近窗口（METRICS_WINDOW_S，默认 15 分钟）：按分钟分槽的环形缓冲，读取时合并仍在窗口内的槽
+
+分位数按桶上界估算（落在最后一个桶时取窗口内的最大值）。
+
+各阶段耗时和载荷大小由 src/utils/tracing.py 在 span 结束时记录（stage_latency_ms / payload_bytes），
+限流事件由执行器和 HTTP 服务记录（throttle_events）；队列深度、在途数、缓存命中率等瞬时值
+由运维页直接读取各组件的 snapshot()，不经过这里。
+
+用法：
+    from src.utils.metrics import counter, histogram, metrics_snapshot
+
+    histogram("stage_latency_ms").observe(123.4, stage="backend_call", task_type="fabric")
+    counter("throttle_events").inc(kind="overloaded")
+
+    # {"stage_latency_ms": [{"labels": {...}, "count": ..., "p95": ...}, ...], ...}
+    metrics_snapshot()
+"""
+
+from __future__ import annotations
+import bisect
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 最近窗口长度（秒）与分槽宽度（秒）
+WINDOW_S = int(os.getenv("METRICS_WINDOW_S", "900"))
+SLOT_S = 60
+# 默认桶：毫秒耗时（大致按 1-2-5 递增，覆盖到 1 分钟）与字节数
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                                         10000, 20000, 60000)
+BYTES_BUCKETS: Tuple[float, ...] = tuple(float(1024 * 4 ** i) for i in range(10))  # 1KB … 256MB
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _slot_now() -> int:
+    return int(time.time() // SLOT_S)
+
+
+class _HistSeries:
+    __slots__ = ("slot_ids", "counts", "sums", "maxes", "total_count", "total_sum", "total_max")
+
+    def __init__(self, nslots: int, nbuckets: int):
+        self.slot_ids = [-1] * nslots
+        self.counts = [[0] * nbuckets for _ in range(nslots)]
+        self.sums = [0.0] * nslots
+        self.maxes = [0.0] * nslots
+        self.total_count = 0
+        self.total_sum = 0.0
+        self.total_max = 0.0
+
+
+class Histogram:
+    """按标签分组的固定桶直方图（线程安全）"""
+
+    def __init__(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._nslots = max(1, WINDOW_S // SLOT_S)
+        self._series: Dict[Labels, _HistSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels_key(labels)
+        slot = _slot_now()
+        idx = slot % self._nslots
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = _HistSeries(self._nslots, len(self.buckets) + 1)
+            if s.slot_ids[idx] != slot:  # 槽位已过期：清零后复用
+                s.slot_ids[idx] = slot
+                s.counts[idx] = [0] * (len(self.buckets) + 1)
+                s.sums[idx] = 0.0
+                s.maxes[idx] = 0.0
+            s.counts[idx][bucket] += 1
+            s.sums[idx] += value
+            s.maxes[idx] = max(s.maxes[idx], value)
+            s.total_count += 1
+            s.total_sum += value
+            s.total_max = max(s.total_max, value)
+
+    def _quantile(self, counts: List[int], total: int, q: float, vmax: float) -> float:
+        target = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= target and n:
+                return min(self.buckets[i], vmax) if i < len(self.buckets) else vmax
+        return vmax
+
+    def snapshot(self, window: bool = True) -> List[Dict[str, Any]]:
+        """
+        各标签组的统计。
+
+        Args:
+            window: True 为最近窗口，False 为进程启动以来的累计值（累计值不含分桶）
+
+        Returns:
+            [{"labels", "count", "sum", "avg", "max", "p50", "p95", "p99",
+              "buckets": [(上界, 次数), ...]}]
+        """
+        oldest = _slot_now() - self._nslots + 1
+        out = []
+        with self._lock:
+            items = list(self._series.items())
+            for key, s in items:
+                if not window:
+                    out.append({"labels": dict(key), "count": s.total_count,
+                                "sum": round(s.total_sum, 3),
+                                "avg": (round(s.total_sum / s.total_count, 3)
+                                        if s.total_count else 0.0),
+                                "max": round(s.total_max, 3)})
+                    continue
+                live = [i for i, sid in enumerate(s.slot_ids) if sid >= oldest]
+                counts = [sum(s.counts[i][b] for i in live) for b in range(len(self.buckets) + 1)]
+                total = sum(counts)
+                if not total:
+                    continue
+                vsum = sum(s.sums[i] for i in live)
+                vmax = max(s.maxes[i] for i in live)
+                out.append({
+                    "labels": dict(key), "count": total, "sum": round(vsum, 3),
+                    "avg": round(vsum / total, 3), "max": round(vmax, 3),
+                    "p50": self._quantile(counts, total, 0.50, vmax),
+                    "p95": self._quantile(counts, total, 0.95, vmax),
+                    "p99": self._quantile(counts, total, 0.99, vmax),
+                    "buckets": [(le, n) for le, n in zip(self.buckets + (float("inf"),), counts)],
+                })
+        return out
+
+
+class Counter:
+    """按标签分组的计数器（线程安全），同样保留累计值和最近窗口"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._nslots = max(1, WINDOW_S // SLOT_S)
+        self._series: Dict[Labels, List[Any]] = {}  # [slot_ids, counts, total]
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1, **labels: Any) -> None:
+        key = _labels_key(labels)
+        slot = _slot_now()
+        idx = slot % self._nslots
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[-1] * self._nslots, [0] * self._nslots, 0]
+            if s[0][idx] != slot:
+                s[0][idx] = slot
+                s[1][idx] = 0
+            s[1][idx] += n
+            s[2] += n
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """[{"labels", "total", "window"}]"""
+        oldest = _slot_now() - self._nslots + 1
+        with self._lock:
+            return [{"labels": dict(key), "total": s[2],
+                     "window": sum(c for sid, c in zip(s[0], s[1]) if sid >= oldest)}
+                    for key, s in self._series.items()]
+
+
+_registry: Dict[str, Any] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name: str, buckets: Optional[Sequence[float]] = None) -> Histogram:
+    """取（首次调用时创建）直方图；buckets 只在创建时生效"""
+    metric = _registry.get(name)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(name)
+            if metric is None:
+                metric = _registry[name] = Histogram(name, buckets or LATENCY_BUCKETS_MS)
+    return metric
+
+
+def counter(name: str) -> Counter:
+    """取（首次调用时创建）计数器"""
+    metric = _registry.get(name)
+    if metric is None:
+        with _registry_lock:
+            metric = _registry.get(name)
+            if metric is None:
+                metric = _registry[name] = Counter(name)
+    return metric
+
+
+def metrics_snapshot(window: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    """所有已注册指标的快照（直方图按 window 取最近窗口或累计值）"""
+    with _registry_lock:
+        metrics = dict(_registry)
+    return {name: m.snapshot(window) if isinstance(m, Histogram) else m.snapshot()
+            for name, m in metrics.items()}
+
+
+def reset_metrics() -> None:
+    with _registry_lock:
+        _registry.clear()
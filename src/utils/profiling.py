@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+面板级 CPU 耗时统计
+
+Streamlit 每次交互都会在脚本线程上重跑整页或某个 fragment。panel_timer 记录每个面板
+在脚本线程上消耗的 CPU 时间（time.thread_time，不含后台线程）和墙钟时间，
+按面板名累计到进程级统计中，用于对比开启 fragment 前后每次交互的服务端开销。
+
+用法：
+    from src.utils.profiling import panel_timer, panel_stats
+
+    with panel_timer("image"):
+        render_image_panel()      # fragment 重跑时只记这一块；整页重跑另记 "page"
+
+    panel_stats()   # {"image": {"runs": 12, "cpu_ms": 340.5, "wall_ms": 410.2, ...}}
+"""
+
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def panel_timer(name: str, log=None) -> Iterator[None]:
+    """
+    统计一个面板的一次渲染。
+
+    Args:
+        name: 面板名（如 "image" / "result" / "settings" / "page"）
+        log: 可选日志对象，传入时以 debug 级别输出本次耗时
+    """
+    cpu0, wall0 = time.thread_time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        record_panel(name, cpu0, wall0, log)
+
+
+def record_panel(name: str, cpu0: float, wall0: float, log=None) -> None:
+    """
+    记录一次从 (cpu0, wall0) 开始的渲染；用于无法包进 with 块的场景（如整页脚本）。
+
+    Args:
+        cpu0: 开始时的 time.thread_time()
+        wall0: 开始时的 time.perf_counter()
+    """
+    cpu_ms = (time.thread_time() - cpu0) * 1000
+    wall_ms = (time.perf_counter() - wall0) * 1000
+    with _lock:
+        s = _stats.setdefault(name, {"runs": 0, "cpu_ms": 0.0, "wall_ms": 0.0, "last_cpu_ms": 0.0})
+        s["runs"] += 1
+        s["cpu_ms"] += cpu_ms
+        s["wall_ms"] += wall_ms
+        s["last_cpu_ms"] = cpu_ms
+    if log is not None:
+        log.debug(f"panel {name}: cpu {cpu_ms:.1f}ms wall {wall_ms:.1f}ms")
+
+
+def panel_stats() -> Dict[str, Dict[str, float]]:
+    """各面板累计统计（含平均每次 CPU 毫秒数 avg_cpu_ms）"""
+    with _lock:
+        out = {}
+        for name, s in _stats.items():
+            out[name] = dict(s, cpu_ms=round(s["cpu_ms"], 1), wall_ms=round(s["wall_ms"], 1),
+                             last_cpu_ms=round(s["last_cpu_ms"], 1),
+                             avg_cpu_ms=round(s["cpu_ms"] / s["runs"], 1) if s["runs"] else 0.0)
+        return out
+
+
+def reset_panel_stats() -> None:
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+按需采样剖析（单次调用级，输出可直接画火焰图的 collapsed stacks）
+
+某一类请求变慢时，不用重新部署就能在线上剖析它：被 @profiled 装饰的函数（cloud_infer）
+在选中时由后台线程按固定间隔采样调用线程的栈（sys._current_frames），调用结束后把
+"frame;frame;frame count" 格式的折叠栈写到 PROFILE_DIR，路径同时写入：
+- 当前 span 的 profile 属性（trace_report / 运维页可见）
+- 结果的 _meta["profile"]（新格式结果）
+
+选中方式（满足任一即剖析，且需匹配 PROFILE_MATCH）：
+- PROFILE_SAMPLE：按比例随机抽样（默认 0 = 关闭）
+- profile_next(n)：接下来 n 次匹配的调用（运维页按钮；再点一次"重新分析"即可剖析一次重跑）
+- configure(...)：运行时修改比例 / 匹配条件 / 采样间隔（运维页开关）
+
+未开启时每次调用只多一次属性判断，不绑定参数、不起线程。
+采样只覆盖调用线程；流式推测预取等后台线程里的耗时体现为调用线程的等待。
+
+环境变量：
+- PROFILE_SAMPLE：抽样比例（0~1）
+- PROFILE_MATCH：匹配条件，逗号分隔的 参数名=值（如 "task_type=print,engine=qwen-vl"）
+- PROFILE_INTERVAL_MS：采样间隔（默认 5ms）
+- PROFILE_DIR：输出目录（默认 logs/profiles），只保留最近 PROFILE_KEEP 个文件（默认 200）
+
+查看：
+    speedscope logs/profiles/<file>.collapsed                # https://www.speedscope.app 直接拖入
+    flamegraph.pl logs/profiles/<file>.collapsed > out.svg   # 或 inferno-flamegraph
+    cat logs/profiles/*-cloud_infer.collapsed | flamegraph.pl > all.svg   # 多次合并
+"""
+
+from __future__ import annotations
+import functools
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.utils.tracing import current_span
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "logs/profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+try:
+    from src.utils.logger import get_logger
+    log = get_logger("stack_profiler")
+except Exception:  # pragma: no cover
+    import logging
+    log = logging.getLogger("stack_profiler")
+
+
+def _parse_match(spec: str) -> Dict[str, str]:
+    pairs = [p.split("=", 1) for p in spec.split(",") if "=" in p]
+    return {k.strip(): v.strip() for k, v in pairs if k.strip()}
+
+
+class ProfileConfig:
+    """进程级剖析开关（运维页和环境变量共用）"""
+
+    def __init__(self):
+        self.rate = float(os.getenv("PROFILE_SAMPLE", "0") or 0)
+        self.match = _parse_match(os.getenv("PROFILE_MATCH", ""))
+        self.interval_s = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+        self.pending = 0  # profile_next 剩余次数
+        self.profiled = 0
+        self.recent: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.rate > 0 or self.pending > 0
+
+    def select(self, arguments: Dict[str, Any]) -> bool:
+        """本次调用是否剖析（匹配条件不满足时不消耗 pending）"""
+        if any(str(arguments.get(k)) != v for k, v in self.match.items()):
+            return False
+        with self._lock:
+            if self.pending > 0:
+                self.pending -= 1
+                return True
+        return self.rate > 0 and random.random() < self.rate
+
+
+_config = ProfileConfig()
+
+
+def configure(rate: Optional[float] = None, match: Optional[str] = None,
+              interval_ms: Optional[float] = None) -> None:
+    """
+    运行时修改剖析开关。
+
+    Args:
+        rate: 抽样比例（0 关闭）
+        match: 匹配条件（"参数名=值,..."，空串为不限）
+        interval_ms: 采样间隔
+    """
+    if rate is not None:
+        _config.rate = max(0.0, min(1.0, float(rate)))
+    if match is not None:
+        _config.match = _parse_match(match)
+    if interval_ms is not None:
+        _config.interval_s = max(0.001, float(interval_ms) / 1000)
+
+
+def profile_next(n: int = 1) -> None:
+    """剖析接下来 n 次匹配的调用"""
+    with _config._lock:
+        _config.pending += max(0, int(n))
+
+
+def profiler_snapshot() -> Dict[str, Any]:
+    return {"rate": _config.rate, "match": ",".join(f"{k}={v}" for k, v in _config.match.items()),
+            "interval_ms": round(_config.interval_s * 1000, 1), "pending": _config.pending,
+            "profiled": _config.profiled, "recent": list(_config.recent)}
+
+
+class StackSampler:
+    """后台线程按间隔采样目标线程的栈，累计为折叠栈计数"""
+
+    def __init__(self, thread_id: int, root_frame, root_name: str, interval_s: float):
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.root_name = root_name
+        self.interval_s = interval_s
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            # 只取被剖析函数以内的栈：根帧（装饰器 wrapper）以上是执行器 / 追踪等固定外层
+            while frame is not None and frame is not self.root_frame:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if frame is None or self._stop.is_set():
+                continue  # 采样时调用已经返回（或正在停止采样）
+            stack.append(self.root_name)
+            self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+def _write(counts: Counter, name: str, trace_id: str) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{trace_id[:16]}-{name}.collapsed"
+    path.write_text("".join(f"{stack} {n}\n" for stack, n in counts.most_common()),
+                    encoding="utf-8")
+    old = sorted(PROFILE_DIR.glob("*.collapsed"),
+                 key=lambda p: p.stat().st_mtime)[:-PROFILE_KEEP or None]
+    for p in old:
+        p.unlink(missing_ok=True)
+    return path
+
+
+def profiled(name: str):
+    """
+    装饰器：被选中的调用在采样剖析下运行。
+
+    Args:
+        name: 折叠栈的根帧名与文件名后缀（如 "cloud_infer"）
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _config.active:
+                return fn(*args, **kwargs)
+            try:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                selected = _config.select(bound.arguments)
+            except TypeError:
+                selected = False
+            if not selected:
+                return fn(*args, **kwargs)
+
+            sampler = StackSampler(threading.get_ident(), sys._getframe(), name,
+                                   _config.interval_s).start()
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                counts = sampler.stop()
+                wall_ms = (time.perf_counter() - t0) * 1000
+            s = current_span()
+            try:
+                path = _write(counts, name,
+                              s.trace_id if s is not None else f"{random.getrandbits(64):016x}")
+            except OSError as e:
+                log.warning(f"profile write failed: {e}")
+                return result
+            with _config._lock:
+                _config.profiled += 1
+                _config.recent = ([str(path)] + _config.recent)[:20]
+            log.info(f"profiled {name}: {sampler.samples} samples over {wall_ms:.0f}ms -> {path}")
+            if s is not None:
+                s.set(profile=str(path), profile_samples=sampler.samples)
+            if isinstance(result, dict) and isinstance(result.get("_meta"), dict):
+                result["_meta"]["profile"] = str(path)
+            return result
+        return wrapper
+    return decorate
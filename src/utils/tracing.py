@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+结构化调用链追踪（trace / span）
+
+日志只有自由文本，无法还原"这次分析为什么花了 14 秒"。本模块按 OpenTelemetry 的概念记录 span：
+- 每个 span 有 trace_id（16 字节）/ span_id（8 字节）/ parent_span_id、开始结束时间（unix 纳秒）、
+  属性和状态（OK / ERROR），同一 trace 内的 span 组成一棵树
+- 当前 span 存在 contextvars 中：嵌套的 span(...) 自动成为子节点；后台执行器提交任务时复制上下文，
+  工作线程中的 span 接在提交方的 span 下面
+- 导出在后台线程中批量写入 JSONL（TRACE_DIR/spans.jsonl，超过 TRACE_FILE_MAX_MB 轮转，
+  保留 TRACE_BACKUPS 个旧文件）；请求路径上只做一次入队，队列满时丢弃并计数
+- TRACE_SAMPLE 按 trace 采样（根 span 决定，子 span 继承）；TRACE_ENABLED=0 关闭导出
+- 每个 span 结束时（不论是否采样）把耗时计入进程内指标 stage_latency_ms（按阶段和 task_type），
+  带 bytes 属性的计入 payload_bytes，供运维页读取（见 src/utils/metrics.py）；
+  task_type 作为 baggage 从父 span 传给子 span
+- MEMTRACE 开启时，span(...) 阶段额外记录内存峰值 / 增量（见 src/utils/memtrace.py）
+
+每行一个 span，字段名与 OTLP JSON 对齐（trace_id / span_id / parent_span_id / name /
+start_time_unix_nano / end_time_unix_nano / attributes / status / resource），可直接转给 OTel 工具链。
+汇总报告见 scripts/trace_report.py。
+
+常用 span 名：decode / crop / queue_wait / cache_lookup / cloud_infer / resize /
+encode（png_encode / base64）/ backend_call / parse / evidence / render。
+
+用法：
+    from src.utils.tracing import span, start_span, use_span
+
+    with span("decode", bytes=len(data)):
+        entry = store.get_or_decode(data)
+
+    root = start_span("analysis", engine="qwen-vl")   # 跨多次重跑的根 span，手动结束
+    with use_span(root):
+        executor.submit(...)                          # 工作线程里的 span 都挂在 root 下
+    ...
+    with use_span(root), span("render"):
+        render(result)
+    root.end()
+"""
+
+from __future__ import annotations
+import atexit
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from src.utils import memtrace
+from src.utils.metrics import BYTES_BUCKETS, histogram
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+TRACE_DIR = Path(os.getenv("TRACE_DIR", "logs/traces"))
+TRACE_FILE_MAX_MB = float(os.getenv("TRACE_FILE_MAX_MB", "20"))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+# 采样比例（按 trace）：1.0 全部记录
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "1.0"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "fashion-prompt-extractor")
+# 导出队列上限：写盘跟不上时丢弃新 span，不阻塞请求
+_QUEUE_MAX = 10000
+# 从父 span 传给子 span 的属性（用于按任务类型拆分各阶段指标）
+BAGGAGE_KEYS = ("task_type",)
+
+_RESOURCE = {"service.name": SERVICE_NAME, "host.name": socket.gethostname(),
+             "process.pid": os.getpid()}
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None)
+_rand = random.SystemRandom() if os.getenv("TRACE_SECURE_IDS") else random.Random()
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{_rand.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+class Span:
+    """一个计时区间；end() 后交给导出器（未采样的 span 只计时不导出）"""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "sampled", "baggage")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 start_ns: Optional[int] = None, attributes: Optional[Dict[str, Any]] = None,
+                 baggage: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "UNSET"
+        self.status_message = ""
+        self.baggage = dict(baggage or {})
+        self.baggage.update((k, self.attributes[k]) for k in BAGGAGE_KEYS if self.attributes.get(k))
+
+    @property
+    def ended(self) -> bool:
+        return self.end_ns is not None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, error: Union[BaseException, str]) -> "Span":
+        """标记为失败（异常类型写入 exception.type 属性）"""
+        self.status = "ERROR"
+        if isinstance(error, BaseException):
+            self.attributes["exception.type"] = type(error).__name__
+            self.status_message = str(error)[:300]
+        else:
+            self.status_message = str(error)[:300]
+        return self
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        """结束并导出（重复调用无效）"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.status == "UNSET":
+            self.status = "OK"
+        task_type = self.attributes.get("task_type") or self.baggage.get("task_type") or "-"
+        histogram("stage_latency_ms").observe(self.duration_ms, stage=self.name,
+                                              task_type=task_type)
+        if isinstance(self.attributes.get("bytes"), int):
+            histogram("payload_bytes", BYTES_BUCKETS).observe(self.attributes["bytes"],
+                                                              stage=self.name)
+        if self.sampled:
+            get_exporter().export(self)
+
+    def context(self) -> Dict[str, str]:
+        """可序列化的上下文（跨进程传递后作为 parent 传入 start_span）"""
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "sampled": self.sampled,
+                "baggage": self.baggage}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": "INTERNAL",
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.status_message} if self.status_message
+            else {"code": self.status},
+            "resource": _RESOURCE,
+        }
+
+
+Parent = Union[Span, Dict[str, Any], None]
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(name: str, parent: Parent = None, root: bool = False,
+               start_ns: Optional[int] = None, **attributes: Any) -> Span:
+    """
+    创建一个 span（不设为当前 span，需手动 end()）。
+
+    Args:
+        name: span 名（阶段名）
+        parent: 父 span 或 context() 字典；省略时取当前 span
+        root: True 时忽略当前 span，开始新 trace
+        start_ns: 开始时间（unix 纳秒），用于补记已经发生的区间
+        attributes: span 属性
+
+    Returns:
+        Span
+    """
+    if parent is None and not root:
+        parent = _current.get()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, start_ns, attributes,
+                    parent.baggage)
+    if isinstance(parent, dict) and parent.get("trace_id"):
+        return Span(name, parent["trace_id"], parent.get("span_id"),
+                    bool(parent.get("sampled", True)), start_ns, attributes, parent.get("baggage"))
+    sampled = TRACE_ENABLED and (TRACE_SAMPLE >= 1.0 or _rand.random() < TRACE_SAMPLE)
+    return Span(name, _new_id(16), None, sampled, start_ns, attributes)
+
+
+@contextmanager
+def use_span(s: Optional[Span]) -> Iterator[Optional[Span]]:
+    """把 s 设为当前 span（不结束它）；s 为 None 时不改变上下文"""
+    if s is None:
+        yield None
+        return
+    token = _current.set(s)
+    try:
+        yield s
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, parent: Parent = None, root: bool = False, **attributes: Any) -> Iterator[Span]:
+    """
+    记录一个阶段：with 块内为当前 span，退出时结束；块内抛出的异常记为 ERROR 后继续抛出。
+    """
+    s = start_span(name, parent, root, **attributes)
+    token = _current.set(s)
+    mem = memtrace.begin(name) if memtrace.mode() else None
+    try:
+        yield s
+    except BaseException as e:
+        s.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        if mem is not None:
+            memtrace.finish(mem, s)
+        s.end()
+
+
+def traced(name: str, **attributes: Any):
+    """装饰器：每次调用记录为一个 span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None, parent: Parent = None,
+                **attributes: Any) -> Span:
+    """补记一个已经结束的区间（如排队等待：开始时还不知道要等多久）"""
+    s = start_span(name, parent, start_ns=start_ns, **attributes)
+    s.end(end_ns)
+    return s
+
+
+# ==================== 导出 ====================
+class JsonlExporter:
+    """后台线程批量写 JSONL，按大小轮转（多进程可写同一文件：追加写，检测到被别的进程轮转后重新打开）"""
+
+    def __init__(self, directory: Path = TRACE_DIR,
+                 max_bytes: int = int(TRACE_FILE_MAX_MB * 1024 * 1024),
+                 backups: int = TRACE_BACKUPS):
+        self.path = Path(directory) / "spans.jsonl"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=_QUEUE_MAX)
+        self._fh = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, s: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(s)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="trace-exporter",
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 512:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            spans = [s for s in batch if s is not None]
+            try:
+                if spans:
+                    self._write([json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n"
+                                 for s in spans])
+            except OSError:
+                self.dropped += len(spans)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _open(self):
+        if self._fh is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._fh.fileno()).st_ino:
+                    return self._fh
+            except FileNotFoundError:
+                pass
+            self._fh.close()  # 已被轮转（可能是别的进程）
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def _write(self, lines: List[str]) -> None:
+        fh = self._open()
+        fh.write("".join(lines))
+        fh.flush()
+        self.written += len(lines)
+        if os.fstat(fh.fileno()).st_size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self._fh.close()
+        self._fh = None
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+
+    def flush(self, timeout: float = 2.0) -> None:
+        """等待队列中的 span 写完（最多 timeout 秒）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"path": str(self.path), "written": self.written, "dropped": self.dropped,
+                "queued": self._queue.qsize()}
+
+
+_exporter: Optional[JsonlExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> JsonlExporter:
+    """进程级单例（TRACE_DIR / TRACE_FILE_MAX_MB / TRACE_BACKUPS）"""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = JsonlExporter()
+    return _exporter
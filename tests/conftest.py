@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""pytest 公共配置：把仓库根目录加入 sys.path（与 scripts/ 下的入口一致）"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""app_new.py 冒烟：上传图片 + 开启预分析时图片面板完整渲染并登记预分析（不发出网络请求）"""
+
+import io
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("streamlit")
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from src.jobs import get_speculator  # noqa: E402
+
+APP = Path(__file__).resolve().parents[1] / "app_new.py"
+
+
+def _png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (400, 400), (120, 80, 40)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def speculator(monkeypatch):
+    """预分析计时拉长到不会触发，测试结束后丢弃登记的预分析"""
+    spec = get_speculator()
+    monkeypatch.setattr(spec, "idle_s", 3600)
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "sk-smoke-test")
+    yield spec
+    for session_id in list(spec._pending):
+        spec.discard(session_id)
+
+
+def test_speculative_branch_renders(speculator):
+    scheduled = speculator.stats["scheduled"]
+    at = AppTest.from_file(str(APP), default_timeout=60)
+    at.session_state["speculative"] = True
+    at.run()
+    at.file_uploader[0].set_value(("fabric.png", _png(), "image/png"))
+    at.run()
+
+    assert not at.exception
+    assert speculator.stats["scheduled"] == scheduled + 1  # 选区（数值裁剪默认框）已登记预分析
+    assert speculator.stats["started"] == 0
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""证据打包：近重复去除、相关性排序、预算截断与前后 token 统计"""
+
+from src.aug.evidence_pack import estimate_tokens, pack_evidence
+
+POLY = ("Polyester twill is a durable woven fabric with diagonal ribs, "
+        "widely used for workwear, uniforms and trousers because it resists creasing.")
+ITEMS = [
+    {"title": "Weather", "url": "u1", "snippet": "Sunny with light winds across the region today."},
+    {"title": "Poly A", "url": "u2", "snippet": POLY},
+    {"title": "Poly B", "url": "u3", "snippet": POLY.replace("durable", "very durable")},
+    {"title": "Twill", "url": "u4", "snippet": "Twill weaves show diagonal lines; polyester "
+                                               "twill dries quickly."},
+    {"title": "Empty", "url": "u5", "snippet": ""},
+]
+
+
+def test_near_duplicates_are_dropped():
+    packed = pack_evidence(ITEMS, "polyester twill", budget_tokens=1000)
+    urls = [it["url"] for it in packed["items"]]
+    assert len({"u2", "u3"} & set(urls)) == 1  # 两条近重复只保留一条
+    stats = packed["stats"]
+    assert (stats["raw_items"], stats["dedup_items"]) == (4, 3)  # 空片段不计入
+
+
+def test_ranked_by_relevance_to_label():
+    packed = pack_evidence(ITEMS, "polyester twill", budget_tokens=1000)
+    assert packed["items"][-1]["url"] == "u1"
+    assert packed["text"].startswith("[1] ")
+    scores = [it["score"] for it in packed["items"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_budget_truncates_last_item_and_reports_tokens():
+    packed = pack_evidence(ITEMS, "polyester twill", budget_tokens=45, min_chunk_tokens=5)
+    stats = packed["stats"]
+    raw = sum(estimate_tokens(it["snippet"]) for it in ITEMS)
+
+    assert stats["raw_tokens"] == raw
+    assert stats["dedup_tokens"] < stats["raw_tokens"]
+    assert stats["packed_tokens"] <= stats["budget_tokens"] == 45
+    assert stats["packed_items"] == 2
+    assert stats["packed_tokens"] == sum(map(estimate_tokens, packed["text"].splitlines()))
+    assert packed["items"][-1]["snippet"].endswith("…")
+
+
+def test_empty_input():
+    packed = pack_evidence([], "棉")
+    assert packed["text"] == "" and packed["items"] == []
+    assert packed["stats"]["raw_tokens"] == packed["stats"]["packed_tokens"] == 0
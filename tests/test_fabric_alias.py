@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""面料名称规范化：同义词合并、整串优先、歧义缩写与无法识别部分"""
+
+import pytest
+
+from src.aug.fabric_alias import canonical_name, canonicalize, label_key
+
+
+@pytest.mark.parametrize("label, key", [
+    ("涤纶", "polyester"),
+    ("Polyester fabric", "polyester"),
+    ("PES", "polyester"),
+    ("涤纶斜纹面料", "polyester_twill"),
+    ("poly twill", "polyester_twill"),
+    ("真丝缎", "silk_satin"),          # 整串命中，不拆成 真丝 + 缎
+    ("毛圈布", "terry"),               # 最长匹配，不是 毛(羊毛) + 圈布
+    ("棉涤斜纹", "cotton_polyester_twill"),
+    ("95% cotton 5% spandex", "cotton_spandex"),
+    ("cotton denim", "denim"),
+])
+def test_synonyms_share_a_key(label, key):
+    assert canonicalize(label) == key
+
+
+@pytest.mark.parametrize("label", [
+    "真丝绒",     # 丝绒 / 真丝 + 绒：不能归为 silk
+    "羊毛混纺",   # 混纺不能归为 wool
+    "Pan Am",    # pan 是腈纶缩写，但不参与切分
+    "cotton co",
+    "N/A",
+    "",
+])
+def test_unmatched_residue_is_none(label):
+    assert canonicalize(label) is None
+
+
+def test_codes_only_match_whole_label():
+    assert canonicalize("pan") == "acrylic"
+    assert canonicalize("CO") == "cotton"
+    assert canonicalize("tulle net") is None
+
+
+def test_label_key_keeps_unknown_labels_apart():
+    assert label_key("羊毛混纺") == "羊毛混纺"
+    assert label_key("真丝绒") != label_key("真丝")
+    assert label_key("N/A") == "n a"
+    assert label_key("Polyester") == label_key("涤纶")
+
+
+def test_canonical_name():
+    assert canonical_name("polyester_twill", "zh") == "涤纶斜纹"
+    assert canonical_name("cotton_spandex", "en") == "cotton spandex"
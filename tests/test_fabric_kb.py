@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""离线面料知识库：分词、索引构建与 mmap 读取、BM25 排序、过期重建、单字 / 双字查询"""
+
+import json
+import os
+import time
+
+import pytest
+
+from src.aug import fabric_kb
+from src.aug.fabric_kb import FabricIndex, build_index, kb_evidence, tokenize
+
+DOCS = [
+    {"title": "棉斜纹（Cotton twill）", "url": "kb://a", "snippet": "棉斜纹结实耐磨", "lang": "zh",
+     "keywords": "棉斜纹 卡其"},
+    {"title": "涤纶（Polyester）", "url": "kb://b", "snippet": "涤纶挺括易打理", "lang": "zh",
+     "keywords": "涤纶 聚酯纤维"},
+    {"title": "Polyester twill (涤纶斜纹)", "url": "kb://c", "snippet": "Durable polyester twill",
+     "lang": "en", "keywords": "polyester twill"},
+]
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    """把进程内共享索引和联网缓存指向临时目录"""
+    monkeypatch.setattr(fabric_kb, "INDEX_PATH", tmp_path / "index.fkb")
+    monkeypatch.setattr(fabric_kb, "WEB_CACHE_PATH", tmp_path / "web_cache.jsonl")
+    monkeypatch.setattr(fabric_kb, "_index", None)
+    yield tmp_path
+    if fabric_kb._index is not None:
+        fabric_kb._index.close()
+
+
+@pytest.mark.parametrize("text, unigrams, expected", [
+    ("The Polyester twill", False, ["polyester", "twill"]),
+    ("棉", False, ["棉"]),
+    ("涤纶斜纹", False, ["涤纶", "纶斜", "斜纹"]),
+    ("涤纶斜纹", True, ["涤纶", "纶斜", "斜纹", "涤", "纶", "斜", "纹"]),
+    ("", False, []),
+])
+def test_tokenize(text, unigrams, expected):
+    assert tokenize(text, unigrams=unigrams) == expected
+
+
+def test_build_and_mmap_roundtrip(tmp_path):
+    path = build_index(DOCS, tmp_path / "index.fkb")
+    idx = FabricIndex(path)
+    try:
+        assert (idx.n_docs, idx.doc(2)["url"]) == (3, "kb://c")
+        assert idx.doc(0)["lang"] == "zh"
+    finally:
+        idx.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["index.fkb"]  # 临时文件已替换掉
+
+
+def test_bm25_ranks_and_filters_language(tmp_path):
+    idx = FabricIndex(build_index(DOCS, tmp_path / "index.fkb"))
+    try:
+        hits = idx.search("涤纶", lang="zh")
+        assert [h["url"] for h in hits] == ["kb://b"]
+        assert hits[0]["coverage"] == 1.0
+        assert [h["url"] for h in idx.search("棉")] == ["kb://a"]  # 单字命中多字文档
+        assert idx.search("polyester twill", lang="en")[0]["url"] == "kb://c"
+        assert idx.search("丝绒") == []
+    finally:
+        idx.close()
+
+
+@pytest.mark.parametrize("label, url", [
+    ("棉", "kb://glossary/cotton_poplin"),
+    ("涤纶", "kb://glossary/polyester"),
+])
+def test_kb_evidence_single_and_double_char_labels(kb, label, url):
+    assert url in [h["url"] for h in kb_evidence(label, lang="zh")]
+
+
+def test_stale_index_is_rebuilt(kb):
+    assert kb_evidence("平纹府绸样卡") == []
+    fabric_kb._index.close()
+    fabric_kb._index = None
+
+    cache = kb / "web_cache.jsonl"
+    cache.write_text(json.dumps({"label": "样卡", "lang": "zh", "title": "平纹府绸样卡",
+                                 "url": "https://example.com/card", "snippet": "平纹府绸样卡"},
+                                ensure_ascii=False) + "\n", encoding="utf-8")
+    future = time.time() + 10
+    os.utime(cache, (future, future))  # 缓存比索引新
+
+    assert kb_evidence("平纹府绸样卡")[0]["url"] == "https://example.com/card"
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""按阶段内存追踪：分配位置快照对比（原始 trace 快路径与公开 API 回退路径结果一致）"""
+
+import os
+import tracemalloc
+
+import pytest
+
+from src.utils import memtrace
+
+HERE = os.path.basename(__file__)
+
+
+@pytest.fixture
+def tracing():
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(1)
+    yield
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def _allocate():
+    return [bytes(4096) for _ in range(256)]  # 约 1 MB，都在这一行分配
+
+
+def _growth_here(top):
+    return [row for row in top if row[0].startswith(HERE + ":")]
+
+
+def test_raw_traces_layout_is_supported(tracing):
+    """读取的是 CPython 私有结构：解释器升级后结构变化时这里会失败，提示回退路径将被使用"""
+    raw = memtrace._raw_traces(tracemalloc.take_snapshot())
+    assert raw is not None
+    assert isinstance(memtrace._take_snapshot(), memtrace.Counter)
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_top_growth_finds_allocation_site(tracing, monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(memtrace, "_raw_traces", lambda snapshot: None)
+    before = memtrace._take_snapshot()
+    kept = _allocate()
+    top = memtrace._top_growth(before, memtrace._take_snapshot())
+
+    assert isinstance(before, memtrace.Counter) is fast
+    rows = _growth_here(top)
+    assert rows, top
+    site, size, blocks = rows[0]
+    assert size >= 256 * 4096
+    assert blocks >= 256
+    del kept
+
+
+def test_freed_allocations_are_not_growth(tracing):
+    before = memtrace._take_snapshot()
+    _allocate()
+    assert not _growth_here(memtrace._top_growth(before, memtrace._take_snapshot()))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""read_pages 对慢速 / 失败 / 挂起主机的行为（本地 http.server 模拟，每个回环地址算一个主机）"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.aug import page_reader
+from src.aug.page_reader import read_pages
+
+HOSTS = ("127.0.0.1", "127.0.0.2", "127.0.0.3")
+ARTICLE = "<html><body><article>" + "".join(
+    f"<p>Silk charmeuse is a lightweight satin weave fabric, paragraph {i}.</p>" for i in range(20)
+) + "</article></body></html>"
+SLOW_S = 0.6
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+        try:
+            kind = self.path.split("/")[1]
+            if kind == "fail":
+                self.send_error(500)
+                return
+            if kind == "hang":
+                server.release.wait(10)
+                return
+            if kind == "slow":
+                time.sleep(SLOW_S)
+            if kind == "trickle":
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.end_headers()
+                for _ in range(50):
+                    if server.release.wait(0.1):
+                        return
+                    self.wfile.write(b" ")
+                    self.wfile.flush()
+                return
+            body = ARTICLE.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+
+@pytest.fixture(scope="module")
+def hosts():
+    """{地址: (server, 基础 URL)}，三个主机共用同一套路由"""
+    release = threading.Event()
+    servers = {}
+    for addr in HOSTS:
+        try:
+            server = ThreadingHTTPServer((addr, 0), _Handler)
+        except OSError:
+            pytest.skip(f"cannot bind {addr}")
+        server.daemon_threads = True
+        server.lock = threading.Lock()
+        server.inflight = server.max_inflight = 0
+        server.release = release
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[addr] = (server, f"http://{addr}:{server.server_address[1]}")
+    yield servers
+    release.set()
+    for server, _ in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def test_deadline_skips_hanging_host(hosts):
+    ok, fail, hang = (hosts[a][1] for a in HOSTS)
+    t0 = time.monotonic()
+    pages = read_pages([f"{hang}/hang/1", f"{ok}/ok/1", f"{fail}/fail/1"], deadline=1.0)
+    elapsed = time.monotonic() - t0
+
+    assert elapsed < 1.5
+    by_url = {p["url"]: p for p in pages}
+    assert f"{hang}/hang/1" not in by_url
+    assert by_url[f"{ok}/ok/1"]["status"] == "ok"
+    assert by_url[f"{fail}/fail/1"]["status"] == "error: HTTPError"
+    assert [p["url"] for p in pages] == [f"{ok}/ok/1", f"{fail}/fail/1"]  # 保持输入顺序
+
+
+def test_per_host_cap(hosts):
+    server, base = hosts[HOSTS[0]]
+    server.max_inflight = 0
+    pages = read_pages([f"{base}/slow/{i}" for i in range(6)], deadline=10, per_host=2,
+                       max_workers=6)
+
+    assert [p["status"] for p in pages] == ["ok"] * 6
+    assert server.max_inflight == 2
+
+
+def test_min_chars_returns_early(hosts):
+    fast, slow = hosts[HOSTS[0]][1], hosts[HOSTS[1]][1]
+    urls = [f"{slow}/slow/{i}" for i in range(2)] + [f"{fast}/ok/{i}" for i in range(2)]
+    t0 = time.monotonic()
+    pages = read_pages(urls, deadline=10, min_chars=100)
+
+    assert time.monotonic() - t0 < SLOW_S
+    assert pages and all("/ok/" in p["url"] for p in pages)
+    assert sum(len(p["text"]) for p in pages) >= 100
+
+
+def test_fetch_bounds_total_read_time(hosts):
+    base = hosts[HOSTS[2]][1]
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        page_reader._fetch_text(f"{base}/trickle/1", timeout=0.8)  # 每 0.1 秒一个字节，单次读不超时
+    assert time.monotonic() - t0 < 1.5
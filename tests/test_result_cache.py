@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""结果缓存：Redis 协议后端（scripts/resp_server.py 替身服务）、跨实例共享与 _meta 单次调用字段"""
+
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from src.result_cache import LRUBackend, RedisBackend, ResultCache, SQLiteBackend, cached
+
+SERVER = Path(__file__).resolve().parents[1] / "scripts" / "resp_server.py"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def resp_url():
+    """启动本地 Redis 协议替身服务，返回 redis:// URL"""
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, str(SERVER), "--port", str(port)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        if "listening" not in proc.stdout.readline():
+            pytest.skip("resp stand-in failed to start")
+        yield f"redis://127.0.0.1:{port}/1"
+    finally:
+        proc.terminate()
+        proc.wait(5)
+
+
+def _image(color=(200, 30, 30)) -> Image.Image:
+    return Image.new("RGB", (16, 16), color)
+
+
+def test_redis_backend_roundtrip(resp_url):
+    node = RedisBackend.from_url(resp_url)
+    assert node.ping()
+    assert node.get("missing") is None
+    node.set("k", b"\x00value\r\n", ttl=60)
+    assert node.get("k") == b"\x00value\r\n"
+    assert node.command("DBSIZE") == 1  # SELECT 1 生效：写入的是 db 1
+
+
+def test_instances_share_remote_results(resp_url):
+    calls = []
+
+    def infer(image, **params):
+        calls.append(params)
+        return {"task": "fabric", "engine": "cloud", "labels": ["silk"],
+                "_meta": {"model": "m", "profile": f"logs/profiles/{len(calls)}.json",
+                          "evidence": {"ms": 12}}}
+
+    a = ResultCache(LRUBackend(8), [RedisBackend.from_url(resp_url)])
+    b = ResultCache(LRUBackend(8), [RedisBackend.from_url(resp_url)])
+    first = cached(infer, a)(_image(), engine="cloud", lang="zh")
+    second = cached(infer, b)(_image(), engine="cloud", lang="zh", prefetch_labels=["silk"])
+
+    assert len(calls) == 1
+    assert first["_meta"]["profile"] == "logs/profiles/1.json"  # 调用方拿到的结果不受影响
+    assert second["labels"] == ["silk"]
+    assert second["_meta"] == {"model": "m"}  # 单次调用字段不进缓存
+    assert b.snapshot()["remote"]["hits"] == 1
+
+
+def test_failed_results_are_not_cached(resp_url):
+    cache = ResultCache(LRUBackend(8), [RedisBackend.from_url(resp_url)])
+    infer = cached(lambda image, **p: {"engine": "error", "reasoning": "timeout"}, cache)
+    infer(_image((1, 2, 3)), engine="cloud")
+    assert cache.snapshot()["stores"] == 0
+
+
+def test_unreachable_node_is_a_miss():
+    node = RedisBackend("127.0.0.1", _free_port(), timeout=0.2, down_s=30)
+    cache = ResultCache(LRUBackend(8), [node])
+    t0 = time.monotonic()
+    assert cache.get("k") is None
+    cache.set("k", {"engine": "cloud"})
+    assert cache.get("k") == {"engine": "cloud"}  # 本地层仍可用
+    assert time.monotonic() - t0 < 1.0  # 故障跳过期内不再连接
+    assert cache.snapshot()["remote"]["errors"] == 2
+
+
+def test_sqlite_purge_counter_is_thread_safe(tmp_path):
+    node = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: node.set(f"k{i}", b"v", ttl=60), range(400)))
+    assert node._writes == 400
+    assert node.get("k399") == b"v"
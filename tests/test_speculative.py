@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""选区预分析：命中、重复点击不再预分析、已离开会话的状态回收"""
+
+import time
+
+import pytest
+
+from src import jobs
+from src.jobs import InferenceExecutor, SpeculativeRunner
+
+
+@pytest.fixture
+def runner():
+    executor = InferenceExecutor(max_workers=2)
+    yield SpeculativeRunner(executor, idle_s=0.01)
+    executor._pool.shutdown(wait=True)
+
+
+def _wait_started(runner, n=1):
+    deadline = time.monotonic() + 2
+    while runner.stats["started"] < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_claim_hits_settled_speculation(runner):
+    runner.schedule("s1", "k1", lambda x: x * 2, 21)
+    _wait_started(runner)
+    job = runner.claim("s1", "k1")
+    assert job is not None and job.future.result(2) == 42
+    runner.schedule("s1", "k1", lambda x: x, 1)  # 同一键已由点击得到，不再预分析
+    assert runner.stats["scheduled"] == 1
+
+
+def test_idle_sessions_are_released(runner, monkeypatch):
+    runner.schedule("gone", "k1", lambda: None)
+    _wait_started(runner)
+    runner.claim("gone", "k1")
+    runner.schedule("gone", "k2", lambda: None)
+    assert "gone" in runner._claimed and "gone" in runner._pending
+
+    monkeypatch.setattr(jobs, "SPECULATIVE_SESSION_TTL", 0)
+    time.sleep(0.01)
+    runner.schedule("active", "k1", lambda: None)
+
+    assert set(runner._seen) == {"active"}
+    assert "gone" not in runner._claimed and "gone" not in runner._pending
+    runner.discard("active")
+    assert not runner._seen and not runner._pending
@@ -5,7 +5,10 @@ from __future__ import annotations
 import os
 import socket
 from pathlib import Path
-from typing import Optional, Tuple
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
 import streamlit as st
 import streamlit.components.v1 as components
 from PIL import Image
@@ -51,61 +54,140 @@ def _declare_component():
 
 _web_cropper = _declare_component()
 
-def _pil_to_media_url(img: Image.Image, fmt: str = "PNG", coordinates: str = "web_cropper") -> str:
-    """Store image and return a URL.
+def _resolve_media_adder() -> Optional[Callable[[bytes, str, str, str], str]]:
+    """Find the working Streamlit media API once per process.
 
-    Prefers the current Runtime.media_file_mgr.add API:
-      add(path_or_data: bytes | str, mimetype: str, coordinates: str, file_name: str | None = None) -> str
-
-    Falls back to older Streamlit APIs if necessary.
-    Returns a relative URL (e.g. /media/xxx) when available; otherwise a data URL as a last resort.
+    Returns add(data, mimetype, coordinates, file_name) -> url, or None when no API
+    works (callers then fall back to a data URL). Resolution is only cached once a
+    runtime exists, so bare-mode calls do not pin the fallback.
     """
-    buf = BytesIO()
-    fmt = (fmt or "PNG").upper()
-    img.convert("RGB").save(buf, format=fmt)
-    data = buf.getvalue()
-    mime = f"image/{fmt.lower()}"
-    filename = f"image.{fmt.lower()}"
+    global _MEDIA_ADDER, _MEDIA_ADDER_RESOLVED
+    if _MEDIA_ADDER_RESOLVED:
+        return _MEDIA_ADDER
 
+    adder = None
     # 1) Preferred: Runtime singleton media_file_mgr
     try:
-        from streamlit.runtime import get_instance
+        from streamlit.runtime import Runtime
 
-        mgr = get_instance().media_file_mgr
-        url = mgr.add(data, mime, coordinates, filename)
-        return url
+        if not Runtime.exists():
+            return None
+        mgr = Runtime.instance().media_file_mgr
+        adder = lambda data, mime, coords, name: mgr.add(data, mime, coords, name)  # noqa: E731
     except Exception:
         pass
 
     # 2) Legacy: module-level media_file_manager instance
-    try:
-        from streamlit.runtime.media_file_manager import media_file_manager as mfm  # type: ignore
+    if adder is None:
+        try:
+            from streamlit.runtime import media_file_manager as mfm_module  # type: ignore
 
-        url = mfm.add(data, mime, coordinates, filename)  # type: ignore[attr-defined]
-        return url
-    except Exception:
-        pass
+            mfm = mfm_module.media_file_manager
+            adder = lambda data, mime, coords, name: mfm.add(data, mime, coords, name)  # noqa: E731
+        except Exception:
+            pass
 
     # 3) Old add(...) function variants requiring ctx
-    try:
-        from streamlit.runtime.scriptrunner import get_script_run_ctx
-        from streamlit.runtime.media_file_manager import add as add_func  # type: ignore
-
-        ctx = get_script_run_ctx()
+    if adder is None:
         try:
-            mf = add_func(data=data, mimetype=mime, filename=filename, ctx=ctx)  # type: ignore[call-arg]
-            return mf.url if hasattr(mf, "url") else mf  # type: ignore[no-any-return]
-        except TypeError:
-            mf = add_func(data, f".{fmt.lower()}", mime, ctx=ctx)  # type: ignore[misc]
-            return mf.url if hasattr(mf, "url") else mf  # type: ignore[no-any-return]
-    except Exception:
-        pass
+            from streamlit.runtime.scriptrunner import get_script_run_ctx
+            from streamlit.runtime import media_file_manager as mfm_module  # type: ignore
+
+            add_func = mfm_module.add
+
+            def adder(data, mime, coords, name):
+                ctx = get_script_run_ctx()
+                try:
+                    mf = add_func(  # type: ignore[call-arg]
+                        data=data, mimetype=mime, filename=name, ctx=ctx)
+                except TypeError:
+                    ext = "." + name.rsplit(".", 1)[-1]
+                    mf = add_func(data, ext, mime, ctx=ctx)  # type: ignore[misc]
+                return mf.url if hasattr(mf, "url") else mf  # type: ignore[no-any-return]
+        except Exception:
+            adder = None
+
+    _MEDIA_ADDER, _MEDIA_ADDER_RESOLVED = adder, True
+    return adder
+
+
+_MEDIA_ADDER: Optional[Callable[[bytes, str, str, str], str]] = None
+_MEDIA_ADDER_RESOLVED = False
+
 
-    # 4) Final fallback: data URL (works in all cases, though not relative)
+def _data_url(data: bytes, mime: str) -> str:
     import base64
 
-    b64 = base64.b64encode(data).decode("ascii")
-    return f"data:{mime};base64,{b64}"
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    buf = BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format=fmt, quality=88)
+    else:
+        img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _pil_to_media_url(img: Image.Image, fmt: str = "PNG", coordinates: str = "web_cropper") -> str:
+    """Store image and return a URL.
+
+    Uses the media API resolved once by _resolve_media_adder().
+    Returns a relative URL (e.g. /media/xxx) when available; otherwise a data URL as a last resort.
+    """
+    fmt = (fmt or "PNG").upper()
+    data = _encode(img if img.mode == "RGB" else img.convert("RGB"), fmt)
+    return _bytes_to_media_url(data, fmt, coordinates)
+
+
+def _bytes_to_media_url(data: bytes, fmt: str, coordinates: str) -> str:
+    mime = f"image/{fmt.lower()}"
+    adder = _resolve_media_adder()
+    if adder is not None:
+        try:
+            return adder(data, mime, coordinates, f"image.{fmt.lower()}")
+        except Exception:
+            pass
+    return _data_url(data, mime)
+
+
+# ==================== 显示分辨率编码缓存 ====================
+# (图片哈希, 显示宽度, 格式) -> 编码后的字节。媒体 URL 本身不能缓存：
+# Streamlit 会在每次重跑结束时清理本轮未引用的媒体文件，所以每轮都要 add，
+# 但 add 已编码好的小图只是登记字节，不再重新缩放和编码原图。
+_ENCODED_CACHE_SIZE = 32
+_encoded_cache: "OrderedDict[Tuple[str, int, str], bytes]" = OrderedDict()
+_encoded_lock = threading.Lock()
+
+
+def image_digest(img: Image.Image) -> str:
+    """像素内容哈希（调用方已有内容哈希时应直接传 image_key，省去这一步）"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def display_bytes(img: Image.Image, disp_w: int, disp_h: int, image_key: str,
+                  fmt: str = "JPEG") -> bytes:
+    """返回缩放到显示尺寸并编码后的字节（按 (image_key, disp_w, fmt) 缓存）"""
+    cache_key = (image_key, disp_w, fmt)
+    with _encoded_lock:
+        data = _encoded_cache.get(cache_key)
+        if data is not None:
+            _encoded_cache.move_to_end(cache_key)
+            return data
+    shown = img if img.mode == "RGB" else img.convert("RGB")
+    if shown.width > disp_w:
+        shown = shown.resize((disp_w, max(1, disp_h)), Image.BILINEAR, reducing_gap=2.0)
+    data = _encode(shown, fmt)
+    with _encoded_lock:
+        _encoded_cache[cache_key] = data
+        while len(_encoded_cache) > _ENCODED_CACHE_SIZE:
+            _encoded_cache.popitem(last=False)
+    return data
+
 
 def ensure_pil(obj) -> Image.Image:
     if isinstance(obj, Image.Image):
@@ -117,16 +199,73 @@ def ensure_pil(obj) -> Image.Image:
         return Image.open(b)
     raise TypeError(f"Unsupported image type: {type(obj)}")
 
+# 回传模式：release=松开时回传；debounce=拖动中节流回传；live=每次移动都回传（旧行为，仅用于测量对比）
+COMMIT_MODES = ("release", "debounce", "live")
+DEFAULT_COMMIT_MODE = os.getenv("WEB_CROPPER_COMMIT_MODE", "release")
+
+
+def component_available() -> bool:
+    """前端可用：配置了 Dev Server，或存在构建产物"""
+    if os.getenv("WEB_CROPPER_DEV_URL", "").strip():
+        return True
+    root = Path(__file__).parent / "frontend"
+    return any((root / d / "index.html").exists() for d in ("dist", "build"))
+
+
+def _record_commit(key: str, value: dict) -> None:
+    """
+    统计每个裁剪手势触发的重跑次数（存于 session_state）。
+
+    前端在回传值中附带 gesture（手势序号）/ commits（累计回传次数）/ moves（本次手势移动事件数），
+    后端只在 commits 变化时计一次由裁剪引起的重跑。
+    """
+    stats = st.session_state.setdefault(f"__web_cropper_stats__{key}", {
+        "gestures": 0, "reruns": 0, "last_moves": 0, "last_commit": None, "last_gesture": None})
+    commit_id, gesture = value.get("commits"), value.get("gesture")
+    if commit_id is None or commit_id == stats["last_commit"]:
+        return
+    stats["last_commit"] = commit_id
+    if not gesture:
+        return  # 图片加载时的初始回传不属于任何手势
+    stats["reruns"] += 1
+    if gesture != stats["last_gesture"]:
+        stats["last_gesture"] = gesture
+        stats["gestures"] += 1
+    stats["last_moves"] = int(value.get("moves") or 0)
+
+
+def cropper_stats(key: str = "web_cropper") -> dict:
+    """当前会话的裁剪重跑统计：gestures / reruns / reruns_per_gesture"""
+    stats = dict(st.session_state.get(f"__web_cropper_stats__{key}")
+                 or {"gestures": 0, "reruns": 0})
+    gestures = stats["gestures"]
+    stats["reruns_per_gesture"] = round(stats["reruns"] / gestures, 2) if gestures else 0.0
+    return stats
+
+
 def st_web_cropper(
     image: Image.Image | np.ndarray | bytes,
     init_box: int = 160,
     key: str = "web_cropper",
     container_width: int = 900,
+    commit_mode: str = DEFAULT_COMMIT_MODE,
+    debounce_ms: int = 250,
+    image_key: Optional[str] = None,
 ) -> Optional[Tuple[int, int, int, int]]:
     """
     Returns (x, y, w, h) in original image pixel coordinates, or None.
+
+    拖动/缩放只在前端预览，按 commit_mode 回传坐标：
+    - "release": 松开鼠标时回传一次（每个手势一次重跑）
+    - "debounce": 拖动中每 debounce_ms 最多回传一次，松开时补发最终值
+    - "live": 每次移动都回传（旧行为，仅用于测量对比）
+
+    浏览器拿到的是缩放到 displayWidth 的图（按 (image_key, 显示宽度) 缓存编码结果），
+    返回的坐标仍为原图像素。image_key 为图片内容哈希，省略时按像素计算。
     """
-    img = ensure_pil(image).convert("RGB")
+    if commit_mode not in COMMIT_MODES:
+        raise ValueError(f"commit_mode must be one of {COMMIT_MODES}, got {commit_mode!r}")
+    img = ensure_pil(image)
     w, h = img.size
 
     # Show at most container_width; keep aspect
@@ -134,7 +273,8 @@ def st_web_cropper(
     disp_h = int(h * (disp_w / w))
 
     coords = f"web_cropper.{key}"
-    url = _pil_to_media_url(img, fmt="JPEG", coordinates=coords)  # relative URL when possible
+    data = display_bytes(img, disp_w, disp_h, image_key or image_digest(img))
+    url = _bytes_to_media_url(data, "JPEG", coords)  # relative URL when possible
     # Pass to frontend: imageUrl (relative), natural size and display size, initBox
     value = _web_cropper(
         imageUrl=url,
@@ -143,16 +283,23 @@ def st_web_cropper(
         displayWidth=disp_w,
         displayHeight=disp_h,
         initBox=init_box,
+        commitMode=commit_mode,
+        debounceMs=int(debounce_ms),
         key=key,
         default=None,
     )
     # value expected as dict {x,y,w,h} in **original** pixel units
+    # (+ gesture/commits/moves counters)
     if isinstance(value, dict):
+        _record_commit(key, value)
         try:
             x = int(value.get("x", 0))
             y = int(value.get("y", 0))
             ww = int(value.get("w", 0))
             hh = int(value.get("h", 0))
+            # 前端按显示尺寸换算，取整误差可能越界：限制在原图范围内
+            x, y = max(0, min(x, w - 1)), max(0, min(y, h - 1))
+            ww, hh = min(ww, w - x), min(hh, h - y)
             if ww > 0 and hh > 0:
                 return (x, y, ww, hh)
         except Exception:
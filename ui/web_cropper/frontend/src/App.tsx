@@ -1,117 +1,180 @@
-import React, { useEffect, useState, useRef } from 'react'
+import React, { useEffect, useState, useRef, useCallback } from 'react'
 import { Streamlit } from 'streamlit-component-lib'
 
+// 提交模式：
+// - release:  拖动/缩放时仅在前端预览，松开鼠标时回传一次
+// - debounce: 拖动中每 debounceMs 内最多回传一次，松开时补发最终值
+// - live:     每次移动都回传（旧行为，仅用于对比测量重跑次数）
+type CommitMode = 'release' | 'debounce' | 'live'
+
 type Props = {
   args: {
+    imageUrl?: string
     image_b64?: string
-    box?: { x: number; y: number; w: number; h: number } | null
+    naturalWidth?: number
+    naturalHeight?: number
+    displayWidth?: number
+    displayHeight?: number
+    initBox?: number
     minSize?: number
+    commitMode?: CommitMode
+    debounceMs?: number
   }
 }
 
 type Rect = { x: number; y: number; w: number; h: number }
+type Gesture = { kind: 'move' | 'resize'; startX: number; startY: number; origin: Rect }
 
 const App: React.FC<Props> = (props) => {
-  const { image_b64, box, minSize = 32 } = props.args || {}
-  const [rect, setRect] = useState<Rect>(box || { x: 50, y: 50, w: 200, h: 200 })
-  const [isDragging, setIsDragging] = useState(false)
-  const [isResizing, setIsResizing] = useState(false)
-  const [dragStart, setDragStart] = useState({ x: 0, y: 0 })
-  const containerRef = useRef<HTMLDivElement>(null)
+  const {
+    imageUrl,
+    image_b64,
+    naturalWidth = 0,
+    naturalHeight = 0,
+    displayWidth = 800,
+    initBox = 160,
+    minSize = 32,
+    commitMode = 'release',
+    debounceMs = 250,
+  } = props.args || {}
+  const src = imageUrl || (image_b64 ? `data:image/png;base64,${image_b64}` : '')
+
+  // rect 为显示坐标（CSS 像素），回传时换算为原图像素
+  const [rect, setRect] = useState<Rect>({ x: 0, y: 0, w: 0, h: 0 })
+  const [active, setActive] = useState<Gesture['kind'] | null>(null)
   const [imgSize, setImgSize] = useState({ width: 0, height: 0 })
+  const rectRef = useRef(rect)
+  const gestureRef = useRef<Gesture | null>(null)
+  const timerRef = useRef<number | null>(null)
+  // 测量：手势序号、已回传次数、本次手势内的移动事件数
+  const statsRef = useRef({ gesture: 0, commits: 0, moves: 0 })
+  const lastSentRef = useRef('')
 
-  // Update frame height when content changes
-  useEffect(() => {
-    Streamlit.setFrameHeight()
-  }, [rect, image_b64])
+  const commit = useCallback(() => {
+    if (timerRef.current !== null) {
+      window.clearTimeout(timerRef.current)
+      timerRef.current = null
+    }
+    const r = rectRef.current
+    if (!imgSize.width || !r.w || !r.h) return
+    const sx = (naturalWidth || imgSize.width) / imgSize.width
+    const sy = (naturalHeight || imgSize.height) / imgSize.height
+    const value = {
+      x: Math.round(r.x * sx),
+      y: Math.round(r.y * sy),
+      w: Math.round(r.w * sx),
+      h: Math.round(r.h * sy),
+    }
+    const sig = `${value.x},${value.y},${value.w},${value.h}`
+    if (sig === lastSentRef.current) return // 坐标未变不触发重跑
+    lastSentRef.current = sig
+    statsRef.current.commits += 1
+    Streamlit.setComponentValue({ ...value, ...statsRef.current })
+  }, [imgSize, naturalWidth, naturalHeight])
+
+  const updateRect = (r: Rect) => {
+    rectRef.current = r
+    setRect(r)
+  }
+
+  const centeredRect = (width: number, height: number): Rect => {
+    const scale = naturalWidth ? width / naturalWidth : 1
+    const size = Math.min(initBox * scale, width * 0.5, height * 0.5)
+    return { x: (width - size) / 2, y: (height - size) / 2, w: size, h: size }
+  }
 
-  // Handle image load to get dimensions
+  // 图片加载后初始化选区，并立即回传一次，让后端拿到默认裁剪
   const handleImageLoad = (e: React.SyntheticEvent<HTMLImageElement>) => {
     const img = e.currentTarget
     setImgSize({ width: img.clientWidth, height: img.clientHeight })
-    
-    // Initialize rect if needed
-    if (!box) {
-      const size = Math.min(200, img.clientWidth * 0.5, img.clientHeight * 0.5)
-      setRect({
-        x: (img.clientWidth - size) / 2,
-        y: (img.clientHeight - size) / 2,
-        w: size,
-        h: size,
-      })
-    }
+    updateRect(centeredRect(img.clientWidth, img.clientHeight))
+    Streamlit.setFrameHeight()
   }
 
-  // Mouse down on rectangle (start drag)
-  const handleMouseDown = (e: React.MouseEvent) => {
-    if ((e.target as HTMLElement).classList.contains('resize-handle')) {
-      setIsResizing(true)
-    } else {
-      setIsDragging(true)
-    }
-    setDragStart({ x: e.clientX, y: e.clientY })
+  useEffect(() => {
+    if (imgSize.width) commit()
+  }, [imgSize, commit])
+
+  const handlePointerDown = (e: React.PointerEvent) => {
+    const kind = (e.target as HTMLElement).classList.contains('resize-handle') ? 'resize' : 'move'
+    gestureRef.current = { kind, startX: e.clientX, startY: e.clientY, origin: rectRef.current }
+    statsRef.current.gesture += 1
+    statsRef.current.moves = 0
+    setActive(kind)
     e.preventDefault()
   }
 
-  // Mouse move (drag or resize)
-  const handleMouseMove = (e: React.MouseEvent) => {
-    if (!isDragging && !isResizing) return
-
-    const dx = e.clientX - dragStart.x
-    const dy = e.clientY - dragStart.y
-
-    if (isDragging) {
-      // Move rectangle
-      const newX = Math.max(0, Math.min(imgSize.width - rect.w, rect.x + dx))
-      const newY = Math.max(0, Math.min(imgSize.height - rect.h, rect.y + dy))
-      setRect({ ...rect, x: newX, y: newY })
-      setDragStart({ x: e.clientX, y: e.clientY })
-    } else if (isResizing) {
-      // Resize rectangle
-      const newW = Math.max(minSize, Math.min(imgSize.width - rect.x, rect.w + dx))
-      const newH = Math.max(minSize, Math.min(imgSize.height - rect.y, rect.h + dy))
-      setRect({ ...rect, w: newW, h: newH })
-      setDragStart({ x: e.clientX, y: e.clientY })
+  // 监听挂在 window 上：指针移出 iframe 内图片区域时也能正确结束手势
+  useEffect(() => {
+    if (!active) return
+
+    const onMove = (e: PointerEvent) => {
+      const g = gestureRef.current
+      if (!g) return
+      const dx = e.clientX - g.startX
+      const dy = e.clientY - g.startY
+      const o = g.origin
+      if (g.kind === 'move') {
+        updateRect({
+          ...o,
+          x: Math.max(0, Math.min(imgSize.width - o.w, o.x + dx)),
+          y: Math.max(0, Math.min(imgSize.height - o.h, o.y + dy)),
+        })
+      } else {
+        updateRect({
+          ...o,
+          w: Math.max(minSize, Math.min(imgSize.width - o.x, o.w + dx)),
+          h: Math.max(minSize, Math.min(imgSize.height - o.y, o.h + dy)),
+        })
+      }
+      statsRef.current.moves += 1
+      if (commitMode === 'live') {
+        commit()
+      } else if (commitMode === 'debounce' && timerRef.current === null) {
+        timerRef.current = window.setTimeout(commit, debounceMs)
+      }
     }
-  }
 
-  // Mouse up (stop drag/resize)
-  const handleMouseUp = () => {
-    setIsDragging(false)
-    setIsResizing(false)
-  }
+    const onUp = () => {
+      gestureRef.current = null
+      setActive(null)
+      commit()
+    }
 
-  const onConfirm = () => {
-    Streamlit.setComponentValue({ rect })
-  }
+    window.addEventListener('pointermove', onMove)
+    window.addEventListener('pointerup', onUp)
+    window.addEventListener('pointercancel', onUp)
+    return () => {
+      window.removeEventListener('pointermove', onMove)
+      window.removeEventListener('pointerup', onUp)
+      window.removeEventListener('pointercancel', onUp)
+    }
+  }, [active, imgSize, minSize, commitMode, debounceMs, commit])
+
+  useEffect(() => () => {
+    if (timerRef.current !== null) window.clearTimeout(timerRef.current)
+  }, [])
 
   const onReset = () => {
-    const size = Math.min(200, imgSize.width * 0.5, imgSize.height * 0.5)
-    setRect({
-      x: (imgSize.width - size) / 2,
-      y: (imgSize.height - size) / 2,
-      w: size,
-      h: size,
-    })
+    statsRef.current.gesture += 1
+    statsRef.current.moves = 0
+    updateRect(centeredRect(imgSize.width, imgSize.height))
+    commit()
   }
 
+  const scale = naturalWidth && imgSize.width ? naturalWidth / imgSize.width : 1
+
   return (
     <div style={{ width: '100%', padding: '8px', fontFamily: 'sans-serif' }}>
-      {image_b64 ? (
-        <div
-          ref={containerRef}
-          style={{ position: 'relative', width: '100%', maxWidth: '800px', userSelect: 'none' }}
-          onMouseMove={handleMouseMove}
-          onMouseUp={handleMouseUp}
-          onMouseLeave={handleMouseUp}
-        >
+      {src ? (
+        <div style={{ position: 'relative', width: '100%', maxWidth: `${displayWidth}px`, userSelect: 'none', touchAction: 'none' }}>
           <img
-            src={`data:image/png;base64,${image_b64}`}
+            src={src}
             style={{ width: '100%', display: 'block', pointerEvents: 'none' }}
             onLoad={handleImageLoad}
             alt="Crop target"
           />
-          
+
           {/* Crop rectangle overlay */}
           <div
             style={{
@@ -122,10 +185,10 @@ const App: React.FC<Props> = (props) => {
               height: `${rect.h}px`,
               border: '2px dashed #00d4ff',
               boxShadow: '0 0 0 9999px rgba(0,0,0,0.4)',
-              cursor: isDragging ? 'grabbing' : 'grab',
+              cursor: active === 'move' ? 'grabbing' : 'grab',
               boxSizing: 'border-box',
             }}
-            onMouseDown={handleMouseDown}
+            onPointerDown={handlePointerDown}
           >
             {/* Resize handle (bottom-right corner) */}
             <div
@@ -143,8 +206,8 @@ const App: React.FC<Props> = (props) => {
                 boxShadow: '0 2px 4px rgba(0,0,0,0.3)',
               }}
             />
-            
-            {/* Info label */}
+
+            {/* Info label (original pixels) */}
             <div
               style={{
                 position: 'absolute',
@@ -160,7 +223,7 @@ const App: React.FC<Props> = (props) => {
                 pointerEvents: 'none',
               }}
             >
-              {Math.round(rect.w)} × {Math.round(rect.h)}
+              {Math.round(rect.w * scale)} × {Math.round(rect.h * scale)}
             </div>
           </div>
         </div>
@@ -171,21 +234,6 @@ const App: React.FC<Props> = (props) => {
       )}
 
       <div style={{ display: 'flex', gap: '8px', marginTop: '12px' }}>
-        <button
-          onClick={onConfirm}
-          style={{
-            padding: '8px 16px',
-            background: '#00d4ff',
-            color: 'white',
-            border: 'none',
-            borderRadius: '4px',
-            cursor: 'pointer',
-            fontWeight: 'bold',
-            fontSize: '14px',
-          }}
-        >
-          ✓ Confirm
-        </button>
         <button
           onClick={onReset}
           style={{
@@ -203,7 +251,7 @@ const App: React.FC<Props> = (props) => {
       </div>
 
       <div style={{ marginTop: '8px', fontSize: '12px', color: '#666' }}>
-        Drag to move • Drag corner to resize • Click Confirm to apply
+        Drag to move • Drag corner to resize • Selection is applied on release
       </div>
     </div>
   )